@@ -0,0 +1,108 @@
+"""
+Helpers shared by the benchmarks: db seeding/cleanup and the JSON report.
+The benchmarks use the db configured in config.ini, point HOSTPINGBOT_CONFIG
+to another config file to use a dedicated db
+"""
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+from utils import get_logger  # noqa: E402
+
+# the report goes to stdout, keep the logs out of it
+for handler in get_logger().handlers:
+    if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+        handler.setStream(sys.stderr)
+
+from database import db, Watchdog, PingSample, UptimeBucket  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+# synthetic watchdogs belong to chat ids above this one (no telegram id is that big)
+BENCH_CHAT_BASE = 9_000_000_000_000_000_000
+SEED_BATCH_SIZE = 1000
+
+
+def prepare_db(allow_non_empty_db=False):
+    """
+    Run the migrations and refuse to run on a db that holds real watchdogs
+    """
+    run_migrations()
+    cleanup()
+
+    real = Watchdog.select().where(Watchdog.chat_id < BENCH_CHAT_BASE).count()
+    if real != 0 and not allow_non_empty_db:
+        sys.exit(
+            f"The db holds {real} real watchdogs, use a dedicated db "
+            "(HOSTPINGBOT_CONFIG) or pass --allow-non-empty-db"
+        )
+
+
+def seed(count, is_push, watchdogs_per_chat=10, check_interval=60):
+    """
+    Insert count synthetic watchdogs, returns their uuids
+    """
+    now = datetime.now()
+    uuids = [uuid4() for _ in range(count)]
+
+    with db.atomic():
+        for start in range(0, count, SEED_BATCH_SIZE):
+            Watchdog.insert_many(
+                [
+                    dict(
+                        uuid=uuids[i],
+                        name=f"bench-{i}",
+                        is_push=is_push,
+                        address=None if is_push else f"host-{i}.bench",
+                        is_enabled=True,
+                        last_update=now,
+                        check_interval=check_interval,
+                        is_offline=False,
+                        chat_id=BENCH_CHAT_BASE + i // watchdogs_per_chat,
+                        deadline=now + timedelta(seconds=check_interval) if is_push else None,
+                        updated_at=now,
+                    )
+                    for i in range(start, min(start + SEED_BATCH_SIZE, count))
+                ]
+            ).execute()
+
+    db.close()
+    return uuids
+
+
+def cleanup():
+    """
+    Delete the synthetic watchdogs and their history
+    """
+    synthetic = Watchdog.select(Watchdog.uuid).where(Watchdog.chat_id >= BENCH_CHAT_BASE)
+
+    with db.atomic():
+        PingSample.delete().where(PingSample.watchdog.in_(synthetic)).execute()
+        UptimeBucket.delete().where(UptimeBucket.watchdog.in_(synthetic)).execute()
+        Watchdog.delete().where(Watchdog.chat_id >= BENCH_CHAT_BASE).execute()
+
+    db.close()
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def write_report(report, output=None):
+    report = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **report}
+
+    if output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
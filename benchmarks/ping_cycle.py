@@ -0,0 +1,302 @@
+"""
+End-to-end benchmark of a ping cycle: seeds synthetic ping watchdogs, runs
+the real Pinger, Db and MainBot notification path with multiping, DNS and
+the Telegram Bot replaced by in-process fakes, and prints a JSON report with
+the cycle time, per-stage timing, db query counts and peak memory.
+Stages are the pinger spans (see instrumentation), the refresh_hosts stage
+of the first cycle includes the initial load of the watchdogs.
+Peak memory is traced with tracemalloc, which slows everything down,
+use --no-memory for timings closer to production.
+In async mode the db calls run on executor threads, so their queries are
+reported under "other"
+
+    python benchmarks/ping_cycle.py --watchdogs 1000 10000 --offline 0.05
+"""
+import argparse
+import asyncio
+import math
+import random
+import threading
+import time
+import tracemalloc
+
+import common  # sets up sys.path, must come before the src imports
+
+from aiogram import Bot
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from icmplib import Host
+import bot as bot_module
+import database
+import pinger as pinger_module
+import resolver as resolver_module
+from database import Db
+from instrumentation import Tracer, current_span
+from samples import SampleWriter
+from uptime import UptimeRecorder
+
+
+class Stages:
+    """
+    Wall time, calls and db queries of the spans, by stage name.
+    Queries are attributed to the innermost span open on the same thread
+    """
+
+    def __init__(self):
+        self.__stages = {}
+        self.__lock = threading.Lock()
+        self.__tracer = Tracer("benchmark")
+        self.__tracer.add_span_hook(self.record)
+
+        execute_sql = database.db.execute_sql
+
+        def counting_execute_sql(*args, **kwargs):
+            span = current_span()
+            self.__add(span.name if span is not None else "other", 0, 0, 1)
+            return execute_sql(*args, **kwargs)
+
+        database.db.execute_sql = counting_execute_sql
+
+    def stage(self, name):
+        """
+        Span of a stage run by the benchmark itself
+        """
+        return self.__tracer.span(name)
+
+    def record(self, span):
+        self.__add(span.name, span.seconds, 1, 0)
+
+    def __add(self, name, seconds, calls, queries):
+        with self.__lock:
+            stage = self.__stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "queries": 0}
+            )
+            stage["seconds"] += seconds
+            stage["calls"] += calls
+            stage["queries"] += queries
+
+    def pop(self):
+        with self.__lock:
+            stages, self.__stages = self.__stages, {}
+
+        for stage in stages.values():
+            stage["seconds"] = round(stage["seconds"], 6)
+        return stages
+
+
+class FakeNetwork:
+    """
+    multiping and DNS replacements. Hosts listed in offline never answer,
+    the others lose each probe with probability loss
+    """
+
+    def __init__(self, latency, loss, dns_latency, offline):
+        self.latency = latency
+        self.loss = loss
+        self.dns_latency = dns_latency
+        self.offline = offline
+
+    def resolve(self, hostname):
+        time.sleep(self.dns_latency)
+        return self.ip_of(hostname)
+
+    async def resolve_async(self, hostname):
+        await asyncio.sleep(self.dns_latency)
+        return self.ip_of(hostname)
+
+    def multiping(self, addresses, count=2, interval=0.05, concurrent_tasks=100, **kwargs):
+        time.sleep(self.__duration(len(addresses), count, interval, concurrent_tasks))
+        return [self.__host(a, count) for a in addresses]
+
+    async def async_multiping(
+        self, addresses, count=2, interval=0.05, concurrent_tasks=100, **kwargs
+    ):
+        await asyncio.sleep(
+            self.__duration(len(addresses), count, interval, concurrent_tasks)
+        )
+        return [self.__host(a, count) for a in addresses]
+
+    def ip_of(self, hostname):
+        i = int(hostname.split("-")[1].split(".")[0])
+        return f"{11 + i // 65536 % 100}.{i // 256 % 256}.{i % 256}.1"
+
+    def __duration(self, hosts, count, interval, concurrent_tasks):
+        # probes of a host are sequential, hosts are pinged concurrent_tasks at a time
+        return math.ceil(hosts / concurrent_tasks) * ((count - 1) * interval + self.latency)
+
+    def __host(self, address, count):
+        if address in self.offline:
+            return Host(address, count, [])
+
+        rtts = [
+            self.latency * 1000 * random.uniform(0.8, 1.2)
+            for _ in range(count)
+            if random.random() >= self.loss
+        ]
+        return Host(address, count, rtts)
+
+
+class FakeTelegramBot(Bot):
+    """
+    aiogram Bot whose send_message only waits latency seconds
+    """
+
+    latency = 0.05
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+def start_bot(telegram_latency):
+    """
+    Start a real MainBot (without polling) on its own loop with the fake Bot
+    """
+    FakeTelegramBot.latency = telegram_latency
+    bot_module.Bot = FakeTelegramBot
+    bot_module.RedisStorage2 = lambda *args, **kwargs: MemoryStorage()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    main_bot = bot_module.MainBot(Db())
+
+    def run():
+        asyncio.set_event_loop(loop)
+        main_bot.run(polling=False)
+
+    threading.Thread(target=run, daemon=True).start()
+    return main_bot, loop
+
+
+def run_size(args, count, network, main_bot, bot_loop, stages):
+    common.cleanup()
+    seed_start = time.perf_counter()
+    common.seed(count, is_push=False, watchdogs_per_chat=args.watchdogs_per_chat)
+    seed_seconds = time.perf_counter() - seed_start
+
+    network.offline = set(
+        network.ip_of(f"host-{i}.bench")
+        for i in random.sample(range(count), int(count * args.offline))
+    )
+
+    db = Db()
+    samples = SampleWriter(db)
+    uptime = UptimeRecorder(db)
+    pinger = pinger_module.Pinger(
+        db, main_bot, samples=samples, uptime=uptime, interval=args.interval
+    )
+    pinger.add_span_hook(stages.record)
+
+    # only the confirmation of the suspects runs in background
+    if args.mode == "sync":
+        pinger.start(schedule=False)
+    else:
+        pinger.start_async(schedule=False)
+
+    stages.pop()  # drop the queries of the seeding
+    cycles = []
+    for cycle in range(1, args.cycles + 1):
+        submitted = main_bot.bridge.submitted
+        sent = main_bot.notifier.sent
+        if args.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+
+        if args.mode == "sync":
+            pinger.ping_all()
+        else:
+            asyncio.run_coroutine_threadsafe(pinger.ping_all_async(), bot_loop).result()
+        cycle_seconds = time.perf_counter() - start
+
+        # suspects are confirmed off the critical path, wait for the verdicts
+        while pinger.suspects != 0:
+            time.sleep(0.05)
+        confirm_seconds = time.perf_counter() - start - cycle_seconds
+
+        with stages.stage("history_flush"):
+            samples.flush()
+            uptime.flush()
+
+        peak_memory = tracemalloc.get_traced_memory()[1] if args.memory else None
+
+        # fan-out: notifications go through the bridge, coalescer and dispatcher
+        drain_start = time.perf_counter()
+        while (
+            main_bot.notifier.queue_depth + main_bot.bridge.pending != 0
+            or time.perf_counter() - drain_start < args.coalesce_window
+        ) and time.perf_counter() - drain_start < args.drain_seconds:
+            time.sleep(0.05)
+
+        stage_stats = stages.pop()
+        cycles.append(
+            {
+                "cycle": cycle,
+                "cycle_seconds": round(cycle_seconds, 6),
+                "confirm_seconds": round(confirm_seconds, 6),
+                "stages": stage_stats,
+                "queries": sum(s["queries"] for s in stage_stats.values()),
+                "peak_memory_bytes": peak_memory,
+                "notifications": {
+                    "submitted": main_bot.bridge.submitted - submitted,
+                    "sent": main_bot.notifier.sent - sent,
+                    "backlog": main_bot.notifier.queue_depth + main_bot.bridge.pending,
+                    "drain_seconds": round(time.perf_counter() - drain_start, 3),
+                },
+            }
+        )
+
+    common.cleanup()
+    return {
+        "watchdogs": count,
+        "offline": len(network.offline),
+        "seed_seconds": round(seed_seconds, 3),
+        "cycles": cycles,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--watchdogs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--watchdogs-per-chat", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="ping rtt (s)")
+    parser.add_argument("--loss", type=float, default=0.0, help="probe loss (0-1)")
+    parser.add_argument("--offline", type=float, default=0.01, help="hosts down (0-1)")
+    parser.add_argument("--dns-latency", type=float, default=0.001)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--coalesce-window", type=float, default=3.5)
+    parser.add_argument("--drain-seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--no-memory", dest="memory", action="store_false")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--allow-non-empty-db", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    common.prepare_db(args.allow_non_empty_db)
+
+    network = FakeNetwork(args.latency, args.loss, args.dns_latency, set())
+    pinger_module.multiping = network.multiping
+    pinger_module.async_multiping = network.async_multiping
+    resolver_module.resolve_public_address = network.resolve
+    resolver_module.async_resolve_public_address = network.resolve_async
+
+    stages = Stages()
+    main_bot, bot_loop = start_bot(args.telegram_latency)
+    if args.memory:
+        tracemalloc.start()
+
+    runs = []
+    try:
+        for count in args.watchdogs:
+            runs.append(run_size(args, count, network, main_bot, bot_loop, stages))
+    finally:
+        common.cleanup()
+
+    common.write_report(
+        {"benchmark": "ping_cycle", "config": vars(args), "runs": runs}, args.output
+    )
+
+
+if __name__ == "__main__":
+    main()
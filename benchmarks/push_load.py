@@ -0,0 +1,224 @@
+"""
+Load test of the push server: seeds synthetic push watchdogs, starts a
+PushServer in a separate process (waitress or aiohttp) and drives /update,
+/status and /badge with a configurable concurrency and request mix, then
+prints a JSON report with the throughput and p50/p90/p99 latency.
+
+    python benchmarks/push_load.py --server aiohttp --concurrency 100 --mix update=80,status=15,badge=5
+"""
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+
+import common  # sets up sys.path, must come before the src imports
+
+import aiohttp
+from configuration import Configuration
+
+
+class FakeBot:
+    """
+    Stands for MainBot in the server process: counts the notifications and
+    runs the background tasks of the aiohttp server on the current loop
+    """
+
+    def __init__(self):
+        self.notifications = 0
+        self.background_tasks = []
+
+    def add_background_task(self, coroutine_function):
+        self.background_tasks.append(coroutine_function)
+
+    def notify_online_host(self, watchdog, last_update=None):
+        self.notifications += 1
+
+    def notify_offline_hosts(self, watchdogs):
+        self.notifications += len(watchdogs)
+
+
+def serve(args):
+    """
+    Server process, runs until it's terminated
+    """
+    from database import Db
+    from push_server import PushServer
+    from uptime import UptimeRecorder
+
+    Configuration.PUSH_SERVER_PORT = args.port
+    db = Db()
+    bot = FakeBot()
+    ps = PushServer(db, bot, uptime=UptimeRecorder(db).start(), check_interval=10)
+
+    if args.server == "aiohttp":
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        ps.start_async()
+        for coroutine_function in bot.background_tasks:
+            loop.create_task(coroutine_function())
+        loop.run_forever()
+    else:
+        ps.start()
+        while True:
+            time.sleep(3600)
+
+
+def parse_mix(mix):
+    """
+    "update=80,status=15,badge=5" -> ([endpoints], [weights])
+    """
+    weights = dict(item.split("=") for item in mix.split(","))
+    for endpoint in weights:
+        if endpoint not in ("update", "status", "badge"):
+            sys.exit(f"Unknown endpoint {endpoint} in --mix")
+
+    return list(weights), [float(w) for w in weights.values()]
+
+
+async def wait_ready(session, base_url, uuid, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base_url}/status/{uuid}") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+
+    sys.exit("Push server didn't start")
+
+
+async def worker(session, base_url, uuids, endpoints, weights, deadline, warmup_end, results):
+    while time.monotonic() < deadline:
+        endpoint = random.choices(endpoints, weights)[0]
+        url = f"{base_url}/{endpoint}/{random.choice(uuids)}"
+
+        start = time.monotonic()
+        try:
+            if endpoint == "update":
+                request = session.post(url)
+            else:
+                request = session.get(url)
+
+            async with request as response:
+                await response.read()
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            ok = False
+
+        if start >= warmup_end:
+            results[endpoint]["latencies" if ok else "errors"].append(
+                time.monotonic() - start
+            )
+
+
+def summarize(latencies, errors, seconds):
+    return {
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "throughput_rps": round((len(latencies) + len(errors)) / seconds, 1),
+        "latency_ms": {
+            p: None if v is None else round(v * 1000, 3)
+            for p, v in (
+                ("p50", common.percentile(latencies, 50)),
+                ("p90", common.percentile(latencies, 90)),
+                ("p99", common.percentile(latencies, 99)),
+                ("max", max(latencies) if latencies else None),
+            )
+        },
+    }
+
+
+async def load(args, uuids):
+    endpoints, weights = parse_mix(args.mix)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {e: {"latencies": [], "errors": []} for e in endpoints}
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_ready(session, base_url, str(uuids[0]))
+
+        warmup_end = time.monotonic() + args.warmup
+        deadline = warmup_end + args.duration
+        await asyncio.gather(
+            *[
+                worker(
+                    session,
+                    base_url,
+                    [str(u) for u in uuids],
+                    endpoints,
+                    weights,
+                    deadline,
+                    warmup_end,
+                    results,
+                )
+                for _ in range(args.concurrency)
+            ]
+        )
+
+    report = {
+        e: summarize(r["latencies"], r["errors"], args.duration)
+        for e, r in results.items()
+    }
+    report["total"] = summarize(
+        [l for r in results.values() for l in r["latencies"]],
+        [l for r in results.values() for l in r["errors"]],
+        args.duration,
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", choices=["waitress", "aiohttp"], default="waitress")
+    parser.add_argument("--watchdogs", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds")
+    parser.add_argument("--mix", default="update=80,status=15,badge=5")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--allow-non-empty-db", action="store_true")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    random.seed(args.seed)
+    common.prepare_db(args.allow_non_empty_db)
+    uuids = common.seed(args.watchdogs, is_push=True)
+
+    # the report goes to stdout, the server logs go to stderr
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--server", args.server, "--port", str(args.port)],
+        stdout=sys.stderr,
+    )
+    try:
+        report = asyncio.run(load(args, uuids))
+    finally:
+        server.terminate()
+        server.wait()
+        common.cleanup()
+
+    common.write_report(
+        {
+            "benchmark": "push_load",
+            "config": {
+                **vars(args),
+                "db_pool_max_connections": Configuration.DATABASE_POOL_MAX_CONNECTIONS,
+                "db_prepared_statements": Configuration.DATABASE_PREPARED_STATEMENTS,
+            },
+            "endpoints": report,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
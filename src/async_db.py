@@ -0,0 +1,29 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from database import Db
+
+
+class AsyncDb:
+    """
+    Awaitable access to the Db methods, e.g. await async_db.get_watchdog(uuid).
+    Calls run on a dedicated thread pool, so that a slow query never blocks
+    the bot loop and the db work of the handlers doesn't compete with the
+    default executor
+    """
+
+    def __init__(self, db: Db, max_workers=8):
+        self.__db = db
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="db"
+        )
+
+    def __getattr__(self, name):
+        method = getattr(self.__db, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.__executor, functools.partial(method, *args, **kwargs)
+            )
+
+        return call
@@ -1,4 +1,4 @@
-from utils import get_logger, is_valid_address, time_delta_to_string
+from utils import get_logger, async_is_valid_address, time_delta_to_string
 from aiogram.utils.exceptions import BotBlocked, TelegramAPIError, RetryAfter
 from configuration import Configuration
 from aiogram import Bot, Dispatcher, executor, types
@@ -11,11 +11,16 @@ from exceptions.exceptions import (
     WatchdogDuplicateException,
 )
 from database import Db
+from async_db import AsyncDb
+from stats import StatsCollector
 from markups import Markups
 from custom_filters import IsAdmin
 from datetime import datetime
 from strings import Strings
+from notifier import NotificationDispatcher, NotificationCoalescer
+from loop_bridge import LoopBridge
 import asyncio
+from threading import Lock
 import os
 
 logger = get_logger()
@@ -35,7 +40,10 @@ class WatchdogDeletion(StatesGroup):
 
 class MainBot:
     def __init__(self, db: Db):
-        self.__db = db
+        self.__db = AsyncDb(db)  # handlers run on the loop, never call the db directly
+        self.__background_tasks = []
+        self.__background_tasks_lock = Lock()
+        self.__started = False
         self.__storage = RedisStorage2(
             "localhost", 6379, db=5, pool_size=10, prefix="watchdog_fsm"
         )
@@ -46,8 +54,28 @@ class MainBot:
             logger.error(f"Cannot start: {e}")
             os._exit(1)
 
+        self.__notifier = NotificationDispatcher(self.__bot)
+        self.__coalescer = NotificationCoalescer(self.__notifier)
+        # same loop as the one run() will use
+        self.__bridge = LoopBridge(asyncio.get_event_loop())
+        self.add_background_task(self.__notifier.run)
+        self.__stats = StatsCollector(db)
+        self.__stats.watch_bot(self)
+
         self.__register_handlers()
 
+    @property
+    def notifier(self) -> NotificationDispatcher:
+        return self.__notifier
+
+    @property
+    def bridge(self) -> LoopBridge:
+        return self.__bridge
+
+    @property
+    def stats(self) -> StatsCollector:
+        return self.__stats
+
     def __register_handlers(self):
         """
         Register endpoints for the Telegram bot
@@ -122,32 +150,48 @@ class MainBot:
             self.__process_address, state=WatchdogCreation.address
         )
 
-    def __send_message_to_user(self, chat_id, message):
-        bot_loop.create_task(self.__bot.send_message(chat_id, message, parse_mode="HTML"))
+    def add_background_task(self, coroutine_function):
+        """
+        Run coroutine_function() as a task on the bot loop once it's started,
+        or right away if it's already running
+        """
+        with self.__background_tasks_lock:
+            if not self.__started:
+                self.__background_tasks.append(coroutine_function)
+                return
+
+        self.__bridge.submit(lambda: bot_loop.create_task(coroutine_function()))
+
+    async def __on_startup(self, dp: Dispatcher):
+        with self.__background_tasks_lock:
+            self.__started = True
+
+        for coroutine_function in self.__background_tasks:
+            bot_loop.create_task(coroutine_function())
+
+    def __notify(self, chat_id, is_offline, name, down_for=None):
+        """
+        Notifications are coalesced per chat, then sent by the dispatcher.
+        May be called from any thread
+        """
+        self.__bridge.submit(self.__coalescer.add, chat_id, is_offline, name, down_for)
 
     def notify_offline_host(self, watchdog):
-        self.__send_message_to_user(
-            watchdog.chat_id, Strings.OFFLINE_MESSAGE(watchdog.name)
-        )
+        self.__notify(watchdog.chat_id, True, watchdog.name)
 
     def notify_offline_hosts(self, watchdogs):
         for w in watchdogs:
             self.notify_offline_host(w)
 
     def notify_online_host(self, watchdog, last_update=None):
+        down_for = None
+
         if last_update is not None:
             total_seconds = (datetime.now() - last_update).total_seconds()
 
             down_for = time_delta_to_string(total_seconds)
 
-            self.__send_message_to_user(
-                watchdog.chat_id,
-                Strings.ONLINE_MESSAGE_WITH_TIME(watchdog.name, down_for)
-            )
-        else:
-            self.__send_message_to_user(
-                watchdog.chat_id, Strings.ONLINE_MESSAGE(watchdog.name)
-            )
+        self.__notify(watchdog.chat_id, False, watchdog.name, down_for)
 
     async def __send_welcome(self, message: types.Message):
         """
@@ -166,14 +210,16 @@ class MainBot:
         This handler will be called when ADMIN sends `/stats` command
         """
         await message.answer(
-            self.__db.get_stats(), reply_markup=Markups.default(message)
+            Strings.STATS_MESSAGE(self.__stats.snapshot()),
+            parse_mode="HTML",
+            reply_markup=Markups.default(message),
         )
 
     async def __list_watchdogs(self, message: types.Message):
         """
         This handler will be called when user sends `/list` command
         """
-        watchdogs_list = self.__db.get_watchdogs_for_user(chat_id=message.chat.id)
+        watchdogs_list = await self.__db.get_watchdogs_for_user(chat_id=message.chat.id)
 
         if len(watchdogs_list) == 0:
             await message.answer(
@@ -181,6 +227,8 @@ class MainBot:
             )
             return
 
+        uptime = await self.__db.get_uptime([w.uuid for w in watchdogs_list])
+
         summary = Strings.LIST_WATCHDOGS_HEADER
 
         summary += Strings.LIST_WATCHDOGS_PING_HEADER
@@ -194,7 +242,8 @@ class MainBot:
                 (datetime.now() - w.last_update).total_seconds()
             )
             summary += Strings.LIST_WATCHDOGS_PING_ITEM(
-                w.name, w.address, status_url, badge_url, not bool(w.is_offline), last_update
+                w.name, w.address, status_url, badge_url, not bool(w.is_offline), last_update,
+                Strings.LIST_WATCHDOGS_UPTIME(uptime[w.uuid])
             )
 
         summary += Strings.LIST_WATCHDOGS_PUSH_HEADER
@@ -209,7 +258,8 @@ class MainBot:
             last_remote_address = w.address if w.address else "Unknown"
             push_url = Configuration.BASE_URL + "/update/" + str(w.uuid)
             summary += Strings.LIST_WATCHDOGS_PUSH_ITEM(
-                w.name, push_url, status_url, badge_url, not bool(w.is_offline), last_update, last_remote_address
+                w.name, push_url, status_url, badge_url, not bool(w.is_offline), last_update, last_remote_address,
+                Strings.LIST_WATCHDOGS_UPTIME(uptime[w.uuid])
             )
 
         await message.answer(
@@ -220,7 +270,8 @@ class MainBot:
         """
         This handler will be called when user sends `/new` command
         """
-        if self.__db.has_reached_limits(chat_id=message.chat.id):
+        count, _ = await self.__db.get_admission(chat_id=message.chat.id)
+        if count >= Configuration.WATCHDOGS_LIMIT_FOR_USER:
             limit = Configuration.WATCHDOGS_LIMIT_FOR_USER
             await message.answer(
                 Strings.ERROR_WATCHDOGS_LIMIT_EXCEEDED(limit),
@@ -236,7 +287,7 @@ class MainBot:
     async def __delete_watchdog(self, message: types.Message):
         list_markup = Markups.new()
 
-        watchdogs = self.__db.get_watchdogs_for_user(chat_id=message.chat.id)
+        watchdogs = await self.__db.get_watchdogs_for_user(chat_id=message.chat.id)
 
         if len(watchdogs) == 0:
             await message.answer(
@@ -256,7 +307,7 @@ class MainBot:
     async def __delete_selected_watchdog(
         self, message: types.Message, state: FSMContext
     ):
-        deleted = self.__db.delete_watchdog_for_user(
+        deleted = await self.__db.delete_watchdog_for_user(
             chat_id=message.chat.id, name=message.text
         )
 
@@ -283,7 +334,7 @@ class MainBot:
         if is_push:
             async with state.proxy() as data:
                 try:
-                    w = self.__db.add_push_watchdog(data["name"], message.chat.id)
+                    w = await self.__db.add_push_watchdog(data["name"], message.chat.id)
 
                     logger.debug(f"Created {w}")
 
@@ -301,6 +352,11 @@ class MainBot:
                         Strings.ERROR_WATCHDOGS_LIMIT_EXCEEDED(limit),
                         reply_markup=Markups.default(message),
                     )
+                except WatchdogDuplicateException:
+                    await message.answer(
+                        Strings.ERROR_WATCHDOG_DUPLICATE(data["name"]),
+                        reply_markup=Markups.default(message),
+                    )
 
             # reset state
             await state.finish()
@@ -312,7 +368,7 @@ class MainBot:
 
     async def __process_address(self, message: types.Message, state: FSMContext):
 
-        if not is_valid_address(message.text):
+        if not await async_is_valid_address(message.text):
             await message.answer(
                 Strings.ERROR_INVALID_ADDRESS(message.text), reply_markup=Markups.cancel
             )
@@ -327,7 +383,7 @@ class MainBot:
             logger.debug(
                 f"Creating watchdog with name {data['name']} and address {data['address']} for user {message.chat.id}"
             )
-            w = self.__db.add_ping_watchdog(
+            w = await self.__db.add_ping_watchdog(
                 data["name"], data["address"], message.chat.id
             )
 
@@ -352,7 +408,10 @@ class MainBot:
     async def __process_name(self, message: types.Message, state: FSMContext):
         truncated_name = message.text[:64]
 
-        if self.__db.is_name_duplicated(name=truncated_name, chat_id=message.chat.id):
+        _, duplicated = await self.__db.get_admission(
+            chat_id=message.chat.id, name=truncated_name
+        )
+        if duplicated:
             await message.answer(
                 Strings.ERROR_WATCHDOG_DUPLICATE(truncated_name),
                 reply_markup=Markups.cancel,
@@ -397,13 +456,23 @@ class MainBot:
         else:
             logger.error(f"Exception occured: {context['message']}")
 
-    def run(self):
+    def run(self, polling=True):
+        """
+        Start the bot loop. Without polling the bot only sends notifications
+        (used by the pinger-only workers)
+        """
         global bot_loop
         bot_loop = asyncio.get_event_loop()
         bot_loop.set_exception_handler(self.__exception_handler)
         try:
             logger.info("Starting")
-            executor.start_polling(self.__dp, loop=bot_loop)
+            if polling:
+                executor.start_polling(
+                    self.__dp, loop=bot_loop, on_startup=self.__on_startup
+                )
+            else:
+                bot_loop.run_until_complete(self.__on_startup(self.__dp))
+                bot_loop.run_forever()
         except Exception as e:
             logger.error(f"Cannot start: {e}")
             os._exit(1)
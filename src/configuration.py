@@ -2,7 +2,11 @@ import configparser
 import os
 
 config = configparser.ConfigParser()
-config.read(["/etc/hostpingbot/config.ini", "config.ini", "../config.ini"])
+config.read(
+    ["/etc/hostpingbot/config.ini", "config.ini", "../config.ini"]
+    # e.g. a separate db for the benchmarks, overrides the other files
+    + ([os.environ["HOSTPINGBOT_CONFIG"]] if "HOSTPINGBOT_CONFIG" in os.environ else [])
+)
 
 if "Telegram" not in config:
     exit("Telegram config not found in config.ini")
@@ -12,18 +16,49 @@ if "Database" not in config:
 
 
 class Configuration:
+    DATABASE_NAME = config.get("Database", "Name", fallback=None) or "hostpingbot"
     DATABASE_HOST = config.get("Database", "Host", fallback=None) or "localhost"
     DATABASE_USER = config.get("Database", "User", fallback=None) or ""
     DATABASE_PASSWORD = config.get("Database", "Password", fallback=None) or ""
+    DATABASE_POOL_MAX_CONNECTIONS = config.getint(
+        "Database", "PoolMaxConnections", fallback=0
+    )  # 0 disables the pool
+    DATABASE_POOL_MIN_CONNECTIONS = config.getint(
+        "Database", "PoolMinConnections", fallback=2
+    )
+    DATABASE_POOL_STALE_TIMEOUT = config.getint(
+        "Database", "PoolStaleTimeout", fallback=300
+    )
+    DATABASE_POOL_HEALTH_CHECK_INTERVAL = config.getint(
+        "Database", "PoolHealthCheckInterval", fallback=30
+    )
+    DATABASE_POOL_TIMEOUT = config.getint("Database", "PoolTimeout", fallback=10)
+    DATABASE_PREPARED_STATEMENTS = config.getboolean(
+        "Database", "PreparedStatements", fallback=True
+    )
     TELEGRAM_BOT_TOKEN = config.get("Telegram", "Token", fallback=None) or exit(
         "Telegram token not found in config.ini"
     )
     TELEGRAM_ADMIN_USER_ID = config.get("Telegram", "AdminUserId", fallback=None)
     PUSH_SERVER_PORT = config.getint("PushServer", "Port", fallback=5000)
+    PUSH_SERVER_ASYNC = config.getboolean("PushServer", "Async", fallback=False)
+    # /metrics is only served when set, to clients sending it as a bearer token
+    PUSH_SERVER_METRICS_TOKEN = (
+        config.get("PushServer", "MetricsToken", fallback=None) or None
+    )
     WATCHDOGS_LIMIT_FOR_USER = config.getint(
         "Other", "WatchdogsLimitForUser", fallback=10
     )
+    PINGER_ASYNC = config.getboolean("Pinger", "Async", fallback=False)
+    PINGER_SHARDED = config.getboolean("Pinger", "Sharded", fallback=False)
+    PINGER_WORKER_ID = config.get("Pinger", "WorkerId", fallback=None)
+    HISTORY_RETENTION_DAYS = config.getint("History", "RetentionDays", fallback=30)
     LOGS_PATH = config.get("Other", "LogsPath", fallback=None)
+    PROFILING_LOG_SPANS = config.getboolean("Profiling", "LogSpans", fallback=False)
+    PROFILING_SAMPLE_EVERY = config.getint(
+        "Profiling", "SampleEvery", fallback=0
+    )  # 0 disables cProfile
+    PROFILING_KEEP_SLOWEST = config.getint("Profiling", "KeepSlowest", fallback=5)
     DEBUG = config.getboolean("Other", "Debug", fallback=False)
     BASE_URL = config.get(
         "PushServer", "BaseUrl", fallback=f"http://localhost:{PUSH_SERVER_PORT}"
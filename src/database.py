@@ -1,9 +1,16 @@
-from enum import unique
 from peewee import *
-from uuid import uuid4
+from playhouse.pool import PooledDatabase, PooledPostgresqlDatabase
+from psycopg2.extensions import connection as PsycopgConnection
+from uuid import UUID
+import functools
+import heapq
+import random
+import re
+import time
 from datetime import datetime, timedelta
 from utils import generate_uuid, get_logger
 from configuration import Configuration
+from metrics import Histogram
 from exceptions.exceptions import (
     WatchdogsLimitExceededException,
     WatchdogDuplicateException,
@@ -11,18 +18,171 @@ from exceptions.exceptions import (
 
 logger = get_logger()
 
-# initialize db on module import
-db = PostgresqlDatabase(
-    "hostpingbot",  # Required by Peewee.
-    host=Configuration.DATABASE_HOST,
-    user=Configuration.DATABASE_USER,
-    password=Configuration.DATABASE_PASSWORD,
-    thread_safe=True,
-    autorollback=True,
-    autoconnect=True,
+DB_CALL_SECONDS = Histogram(
+    "hostpingbot_db_call_seconds",
+    "Duration of the Db calls, including the wait for a pooled connection",
+    labels=["method"],
 )
 
 
+class PreparingConnection(PsycopgConnection):
+    """
+    psycopg2 connection that remembers the statements prepared on it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+    def reset(self):
+        super().reset()
+        self.prepared_statements.clear()
+
+
+class HealthCheckedPooledDatabase(PooledPostgresqlDatabase):
+    """
+    Connection pool that keeps at least min_connections open and runs
+    a health check on connections idle for more than health_check_interval
+    seconds before handing them out. The connections dropped (stale or
+    unhealthy) are replaced when the next one is checked out
+    """
+
+    def __init__(self, *args, min_connections=0, health_check_interval=30, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__min_connections = min_connections
+        self.__health_check_interval = health_check_interval
+        self.__returned_at = {}  # connection key -> time it was returned to the pool
+
+    def fill(self):
+        """
+        Open connections until the pool holds min_connections
+        """
+        with self._lock:
+            missing = (
+                self.__min_connections - len(self._connections) - len(self._in_use)
+            )
+            for _ in range(missing):
+                conn = super(PooledDatabase, self)._connect()
+                heapq.heappush(
+                    self._connections, (time.time() - random.random() / 1000, conn)
+                )
+
+    def _connect(self):
+        conn = super()._connect()
+        self.fill()
+        return conn
+
+    def _is_closed(self, conn):
+        returned_at = self.__returned_at.pop(self.conn_key(conn), None)
+        if super()._is_closed(conn):
+            return True
+
+        if returned_at is None or time.time() - returned_at < self.__health_check_interval:
+            return False
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return False
+        except Exception as e:
+            logger.warning(f"Dropping unhealthy connection: {e}")
+            return True
+
+    def _close(self, conn, close_conn=False):
+        pooled = len(self._connections)
+        super()._close(conn, close_conn)
+
+        # stale or broken connections are closed instead of going back to the pool
+        if len(self._connections) > pooled:
+            self.__returned_at[self.conn_key(conn)] = time.time()
+        else:
+            self.__returned_at.pop(self.conn_key(conn), None)
+
+
+# initialize db on module import
+if Configuration.DATABASE_POOL_MAX_CONNECTIONS > 0:
+    db = HealthCheckedPooledDatabase(
+        Configuration.DATABASE_NAME,
+        host=Configuration.DATABASE_HOST,
+        user=Configuration.DATABASE_USER,
+        password=Configuration.DATABASE_PASSWORD,
+        max_connections=Configuration.DATABASE_POOL_MAX_CONNECTIONS,
+        min_connections=Configuration.DATABASE_POOL_MIN_CONNECTIONS,
+        stale_timeout=Configuration.DATABASE_POOL_STALE_TIMEOUT,
+        health_check_interval=Configuration.DATABASE_POOL_HEALTH_CHECK_INTERVAL,
+        timeout=Configuration.DATABASE_POOL_TIMEOUT,
+        autorollback=True,
+        autoconnect=True,
+        connection_factory=PreparingConnection,
+    )
+else:
+    db = PostgresqlDatabase(
+        Configuration.DATABASE_NAME,
+        host=Configuration.DATABASE_HOST,
+        user=Configuration.DATABASE_USER,
+        password=Configuration.DATABASE_PASSWORD,
+        thread_safe=True,
+        autorollback=True,
+        autoconnect=True,
+        connection_factory=PreparingConnection,
+    )
+
+
+def _pooled(method):
+    """
+    Check a pooled connection out for the duration of the call,
+    unless the calling thread already holds one
+    """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not db.is_closed():
+            return method(*args, **kwargs)
+
+        db.connect()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            db.close()
+
+    return wrapper
+
+
+def _with_pooled_connections(cls):
+    """
+    With a pool, connections are returned after each Db call instead of
+    being held by their thread forever
+    """
+    if not isinstance(db, PooledPostgresqlDatabase):
+        return cls
+
+    for name, method in list(vars(cls).items()):
+        if callable(method) and not name.startswith("_") and not name.endswith("_hook"):
+            setattr(cls, name, _pooled(method))
+
+    return cls
+
+
+def _timed(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with DB_CALL_SECONDS.time(method=name):
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+def _with_call_metrics(cls):
+    """
+    Export the latency of every public Db method
+    """
+    for name, method in list(vars(cls).items()):
+        if callable(method) and not name.startswith("_") and not name.endswith("_hook"):
+            setattr(cls, name, _timed(name, method))
+
+    return cls
+
+
 class Watchdog(Model):
     class Meta:
         database = db
@@ -38,40 +198,127 @@ class Watchdog(Model):
     )  # in seconds or IntervalField() from peewee postgres extension
     is_offline = BooleanField(default=False)
     chat_id = BigIntegerField(null=False)
+    deadline = TimestampField(
+        null=True, default=None
+    )  # push only, last_update + check_interval
+    updated_at = DateTimeField(
+        default=datetime.now, index=True
+    )  # bumped only when the watchdog itself changes, not its status
 
     def __str__(self):
         return f"<{self.uuid}, {self.name}>"
 
 
+class PingerLease(Model):
+    """
+    Liveness lease of a pinger worker, used to shard watchdogs between workers
+    """
+
+    class Meta:
+        database = db
+
+    worker_id = CharField(primary_key=True)
+    heartbeat = DateTimeField(null=False)
+
+
+class PingSample(Model):
+    """
+    Latency and packet loss of a ping watchdog, the table is partitioned
+    by day on time (see migrations.create_ping_sample_table)
+    """
+
+    class Meta:
+        database = db
+        primary_key = False
+
+    watchdog = UUIDField(null=False)
+    time = TimestampField(null=False)
+    rtt = FloatField(null=True)  # average round trip time in ms, null if down
+    loss = FloatField(null=False)  # packet loss between 0 and 1
+
+
+class UptimeBucket(Model):
+    """
+    Seconds a watchdog spent up and down during an hour
+    """
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("watchdog", "bucket")
+
+    watchdog = UUIDField(null=False)
+    bucket = IntegerField(null=False, index=True)  # epoch hours
+    up = IntegerField(default=0)
+    down = IntegerField(default=0)
+
+
+# uptime window -> hours
+UPTIME_WINDOWS = {"24h": 24, "7d": 7 * 24, "30d": 30 * 24}
+
+SAMPLE_PARTITION_SECONDS = 24 * 3600
+SAMPLE_INSERT_BATCH_SIZE = 1000
+
+
+@_with_call_metrics
+@_with_pooled_connections
 class Db:
-    def add_push_watchdog(self, name, chat_id):
-        # check watchdogs count limit for chat_id
-        if self.has_reached_limits(chat_id):
-            raise WatchdogsLimitExceededException()
+    def __init__(self):
+        self.__created_hooks = []
+        self.__deleted_hooks = []
+        self.__status_hooks = []
 
-        if self.is_name_duplicated(name, chat_id):
-            raise WatchdogDuplicateException()
+    def add_created_hook(self, hook):
+        """
+        hook(watchdog) is called after a watchdog is created
+        """
+        self.__created_hooks.append(hook)
 
-        w = Watchdog().create(
+    def add_deleted_hook(self, hook):
+        """
+        hook(uuid) is called after a watchdog is deleted
+        """
+        self.__deleted_hooks.append(hook)
+
+    def add_status_hook(self, hook):
+        """
+        hook(uuid) is called after the status (is_offline, last_update) of a watchdog changed
+        """
+        self.__status_hooks.append(hook)
+
+    def __fire_created(self, watchdog):
+        for hook in self.__created_hooks:
+            hook(watchdog)
+
+    def __fire_deleted(self, uuids):
+        for uuid in uuids:
+            for hook in self.__deleted_hooks:
+                hook(uuid)
+
+    def __fire_status(self, uuids):
+        for uuid in uuids:
+            for hook in self.__status_hooks:
+                hook(uuid)
+
+    def add_push_watchdog(self, name, chat_id):
+        self.check_admission(chat_id, name)
+
+        w = self.__create_watchdog(
             uuid=generate_uuid(),
             name=name,
             is_push=True,
             is_enabled=True,
             last_update=datetime.now(),
+            deadline=datetime.now() + timedelta(seconds=Watchdog.check_interval.default),
             chat_id=chat_id,
         )
 
+        self.__fire_created(w)
         return w
 
     def add_ping_watchdog(self, name, address, chat_id):
-        # check watchdogs count limit for chat_id
-        if self.has_reached_limits(chat_id):
-            raise WatchdogsLimitExceededException()
+        self.check_admission(chat_id, name)
 
-        if self.is_name_duplicated(name, chat_id):
-            raise WatchdogDuplicateException()
-
-        w = Watchdog().create(
+        w = self.__create_watchdog(
             uuid=generate_uuid(),
             name=name,
             is_push=False,
@@ -81,40 +328,50 @@ class Db:
             chat_id=chat_id,
         )
 
+        self.__fire_created(w)
         return w
 
+    def __create_watchdog(self, **fields):
+        try:
+            return Watchdog.create(**fields)
+        except IntegrityError:  # unique (chat_id, name), created concurrently
+            raise WatchdogDuplicateException()
+
     # def add_user(self, id):
     #     return User(id=id).save()
 
     def delete_watchdog(self, uuid):
-        return Watchdog.delete_by_id(uuid)
+        deleted = Watchdog.delete_by_id(uuid)
+        if deleted > 0:
+            self.__fire_deleted([uuid])
+        return deleted
 
     def delete_watchdog_for_user(self, chat_id, name):
-        return (
-            Watchdog.delete()
+        deleted = [
+            w.uuid
+            for w in Watchdog.delete()
             .where(Watchdog.chat_id == chat_id, Watchdog.name == name)
+            .returning(Watchdog.uuid)
             .execute()
-            > 0
-        )
+        ]
+
+        self.__fire_deleted(deleted)
+        return len(deleted) > 0
 
-    def get_new_offline_hosts(self):
+    def get_push_deadlines(self) -> list:
         """
-        Used by push_server to check which hosts didn't post updates for check_interval seconds
+        Used by push_server to rebuild its deadlines at startup,
+        returns (uuid, deadline) for the push watchdogs that are online
         """
-        offline_hosts = Watchdog.select().where(
-            (int(round(datetime.now().timestamp())) - Watchdog.last_update)
-            > Watchdog.check_interval,
-            Watchdog.is_enabled == True,
-            Watchdog.is_push == True,
-            Watchdog.is_offline == False,  # offline for the first time
-        )
-
-        # set is_offline to True for the newest offline hosts
-        Watchdog.update(is_offline=True).where(
-            Watchdog.uuid.in_([w.uuid for w in offline_hosts])
-        )
-
-        return offline_hosts
+        return [
+            (w.uuid, w.deadline.timestamp())
+            for w in Watchdog.select(Watchdog.uuid, Watchdog.deadline).where(
+                Watchdog.is_enabled == True,
+                Watchdog.is_push == True,
+                Watchdog.is_offline == False,
+                Watchdog.deadline.is_null(False),
+            )
+        ]
 
     def get_hosts_to_ping(self) -> list[Watchdog]:
         """
@@ -129,68 +386,394 @@ class Db:
             .execute()
         )
 
+    def get_hosts_to_ping_changed_since(self, timestamp) -> list[Watchdog]:
+        """
+        Used by the registry to poll changes, disabled watchdogs are included
+        so that they can be dropped
+        """
+        return list(
+            Watchdog.select()
+            .where(Watchdog.updated_at >= timestamp, Watchdog.is_push == False)
+            .execute()
+        )
+
+    def get_hosts_to_ping_uuids(self) -> list:
+        return [
+            w.uuid
+            for w in Watchdog.select(Watchdog.uuid).where(
+                Watchdog.is_enabled == True,
+                Watchdog.is_push == False,
+            )
+        ]
+
+    def get_watchdogs(self, uuids) -> list[Watchdog]:
+        return list(Watchdog.select().where(Watchdog.uuid.in_(list(uuids))))
+
     def get_watchdog(self, uuid):
-        return Watchdog.get_or_none(Watchdog.uuid == uuid)
+        if not Configuration.DATABASE_PREPARED_STATEMENTS:
+            return Watchdog.get_or_none(Watchdog.uuid == uuid)
+
+        cursor = self.__execute_prepared(
+            "get_watchdog", Watchdog.select().where(Watchdog.uuid == uuid).limit(1)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        columns = Watchdog._meta.columns
+        return Watchdog(
+            **{
+                d[0]: columns[d[0]].python_value(v)
+                for d, v in zip(cursor.description, row)
+            }
+        )
 
     def get_watchdogs_for_user(self, chat_id) -> list[Watchdog]:
-        return (
+        return list(
             Watchdog.select()
             .where(Watchdog.chat_id == chat_id)
             .order_by(Watchdog.is_push.asc(), Watchdog.name.asc())
         )
 
-    def has_reached_limits(self, chat_id):
+    def get_admission(self, chat_id, name=None):
+        """
+        Returns (watchdogs count, whether name is already used) for a user,
+        with a single query on the (chat_id, name) index
+        """
         return (
-            Watchdog.select().where(Watchdog.chat_id == chat_id).count()
-            >= Configuration.WATCHDOGS_LIMIT_FOR_USER
+            Watchdog.select(
+                fn.COUNT(SQL("*")),
+                fn.COALESCE(fn.BOOL_OR(Watchdog.name == name), False),
+            )
+            .where(Watchdog.chat_id == chat_id)
+            .tuples()
+            .get()
         )
 
-    def is_name_duplicated(self, name, chat_id):
+    def check_admission(self, chat_id, name=None):
         """
-        Check if name is duplicated within same user
+        Raise WatchdogsLimitExceededException or WatchdogDuplicateException
+        if the user can't add a watchdog (named name)
         """
-        return (
-            Watchdog.select()
-            .where(Watchdog.chat_id == chat_id, Watchdog.name == name)
-            .count()
-            > 0
+        count, duplicated = self.get_admission(chat_id, name)
+
+        if count >= Configuration.WATCHDOGS_LIMIT_FOR_USER:
+            raise WatchdogsLimitExceededException()
+
+        if duplicated:
+            raise WatchdogDuplicateException()
+
+    def transition_expired_push_watchdogs(self, uuids=None) -> list[Watchdog]:
+        """
+        Set is_offline to True for the push watchdogs whose deadline expired
+        (optionally only among uuids), returns only the watchdogs that changed.
+        Used by push_server
+        """
+        query = Watchdog.update(is_offline=True).where(
+            Watchdog.deadline <= datetime.now(),
+            Watchdog.is_enabled == True,
+            Watchdog.is_push == True,
+            Watchdog.is_offline == False,  # offline for the first time
         )
 
-    def set_watchdogs_offline(self, offline_hosts):
+        if uuids is not None:
+            if len(uuids) == 0:
+                return []
+            query = query.where(Watchdog.uuid.in_(list(uuids)))
+
+        changed = list(query.returning(Watchdog).execute())
+
+        self.__fire_status([w.uuid for w in changed])
+        return changed
+
+    def transition_watchdogs_offline(self, uuids) -> list[Watchdog]:
         """
-        Set is_offline to True
+        Set is_offline to True, returns only the watchdogs that were online
         Used by pinger
         """
-        return (
+        if len(uuids) == 0:
+            return []
+
+        changed = list(
             Watchdog.update(is_offline=True)
-            .where(Watchdog.uuid.in_([w.uuid for w in offline_hosts]))
+            .where(Watchdog.uuid.in_(list(uuids)), Watchdog.is_offline == False)
+            .returning(Watchdog)
             .execute()
-            is not None
         )
 
-    def set_watchdog_online(self, uuid, remote_address=None):
-        return (
-            Watchdog.update(last_update=datetime.now(), address=remote_address, is_offline=False)
-            .where(Watchdog.uuid == uuid)
+        self.__fire_status([w.uuid for w in changed])
+        return changed
+
+    def transition_watchdogs_online(self, uuids) -> list[Watchdog]:
+        """
+        Set is_offline to False and update last_update, returns every updated
+        watchdog with the values it had before the update in was_offline and
+        previous_update (the previous row is read by the same statement)
+        Used by pinger
+        """
+        if len(uuids) == 0:
+            return []
+
+        previous = Watchdog.alias("previous")
+        updated = list(
+            Watchdog.update(is_offline=False, last_update=datetime.now())
+            .from_(previous)
+            .where(Watchdog.uuid == previous.uuid, Watchdog.uuid.in_(list(uuids)))
+            .returning(
+                Watchdog,
+                previous.is_offline.alias("was_offline"),
+                previous.last_update.alias("previous_update"),
+            )
             .execute()
-            is not None
         )
 
-    def set_watchdogs_online(self, online_hosts):
+        # aliased columns come back as raw db values (epoch seconds)
+        for w in updated:
+            w.previous_update = Watchdog.last_update.python_value(w.previous_update)
+
+        self.__fire_status(uuids)
+        return updated
+
+    def set_watchdogs_online_bulk(self, heartbeats):
         """
-        Set is_offline to False and update last_update
+        Update last_update and address of several push watchdogs with a single query.
+        heartbeats is a dict uuid -> (datetime, remote_address)
+        Used by push_server
         """
-        return (
-            Watchdog.update(is_offline=False, last_update=datetime.now())
-            .where(Watchdog.uuid.in_([w.uuid for w in online_hosts]))
+        if len(heartbeats) == 0:
+            return True
+
+        values = ValuesList(
+            [
+                (str(uuid), Watchdog.last_update.db_value(t), remote_address)
+                for uuid, (t, remote_address) in heartbeats.items()
+            ],
+            columns=("uuid", "last_update", "address"),
+            alias="heartbeat",
+        )
+
+        updated = (
+            Watchdog.update(
+                last_update=values.c.last_update,
+                deadline=values.c.last_update + Watchdog.check_interval,
+                address=values.c.address,
+                is_offline=False,
+            )
+            .from_(values)
+            .where(Watchdog.uuid == values.c.uuid.cast("uuid"))
             .execute()
             is not None
         )
 
-    def get_stats(self):
-        return f"Users: {Watchdog.select(Watchdog.chat_id).distinct().count()}\nWatchdogs: {Watchdog.select().count()}\nPing watchdogs: {Watchdog.select().where(Watchdog.is_push == False).count()}\nPush watchdogs: {Watchdog.select().where(Watchdog.is_push == True).count()}"
+        self.__fire_status(heartbeats.keys())
+        return updated
+
+    def __execute_prepared(self, name, query):
+        """
+        Execute query as the server-side prepared statement name, which is
+        prepared once per connection. The query must always have the same
+        shape, only its parameters may change
+        """
+        sql, params = query.sql()
+        connection = db.connection()
+
+        if name not in connection.prepared_statements:
+            placeholders = iter(range(1, len(params) + 1))
+            db.execute_sql(
+                f"PREPARE {name} AS "
+                + re.sub("%s", lambda _: f"${next(placeholders)}", sql)
+            )
+            connection.prepared_statements.add(name)
+
+        return db.execute_sql(
+            f"EXECUTE {name} ({', '.join(['%s'] * len(params))})"
+            if len(params) != 0
+            else f"EXECUTE {name}",
+            params,
+        )
+
+    def renew_pinger_lease(self, worker_id, lease_ttl):
+        """
+        Create or extend the lease of a pinger worker and drop the expired ones
+        """
+        with db.atomic():
+            PingerLease.insert(worker_id=worker_id, heartbeat=fn.NOW()).on_conflict(
+                conflict_target=[PingerLease.worker_id],
+                update={PingerLease.heartbeat: fn.NOW()},
+            ).execute()
+
+            PingerLease.delete().where(
+                PingerLease.heartbeat < fn.NOW() - timedelta(seconds=lease_ttl)
+            ).execute()
+
+    def release_pinger_lease(self, worker_id):
+        return PingerLease.delete_by_id(worker_id)
+
+    def get_live_pinger_workers(self, lease_ttl) -> list[str]:
+        return [
+            l.worker_id
+            for l in PingerLease.select(PingerLease.worker_id)
+            .where(PingerLease.heartbeat >= fn.NOW() - timedelta(seconds=lease_ttl))
+            .order_by(PingerLease.worker_id)
+        ]
+
+    def add_ping_samples(self, samples):
+        """
+        Insert (uuid, epoch seconds, rtt, loss) samples with multi-row inserts
+        Used by pinger
+        """
+        with db.atomic():
+            for i in range(0, len(samples), SAMPLE_INSERT_BATCH_SIZE):
+                PingSample.insert_many(
+                    samples[i : i + SAMPLE_INSERT_BATCH_SIZE],
+                    fields=[
+                        PingSample.watchdog,
+                        PingSample.time,
+                        PingSample.rtt,
+                        PingSample.loss,
+                    ],
+                ).execute()
+
+    def get_ping_history(self, uuid, since, bucket_seconds) -> list:
+        """
+        Samples of a watchdog since an epoch, averaged over buckets of
+        bucket_seconds. Returns (bucket start epoch, rtt, loss) tuples
+        """
+        bucket = (PingSample.time / bucket_seconds) * bucket_seconds
+
+        return list(
+            PingSample.select(
+                bucket.alias("t"),
+                fn.AVG(PingSample.rtt).alias("rtt"),
+                fn.AVG(PingSample.loss).alias("loss"),
+            )
+            .where(PingSample.watchdog == uuid, PingSample.time >= int(since))
+            .group_by(bucket)
+            .order_by(bucket)
+            .tuples()
+        )
+
+    def add_uptime(self, buckets):
+        """
+        Add (uuid, bucket, up seconds, down seconds) to the uptime counters
+        """
+        with db.atomic():
+            for i in range(0, len(buckets), SAMPLE_INSERT_BATCH_SIZE):
+                UptimeBucket.insert_many(
+                    sorted(buckets[i : i + SAMPLE_INSERT_BATCH_SIZE]),
+                    fields=[
+                        UptimeBucket.watchdog,
+                        UptimeBucket.bucket,
+                        UptimeBucket.up,
+                        UptimeBucket.down,
+                    ],
+                ).on_conflict(
+                    conflict_target=[UptimeBucket.watchdog, UptimeBucket.bucket],
+                    update={
+                        UptimeBucket.up: UptimeBucket.up + EXCLUDED.up,
+                        UptimeBucket.down: UptimeBucket.down + EXCLUDED.down,
+                    },
+                ).execute()
+
+    def get_uptime(self, uuids) -> dict:
+        """
+        Uptime percentages of the watchdogs over UPTIME_WINDOWS, with a single
+        query. Returns uuid -> {window: percentage or None if there's no data}
+        """
+        uuids = [UUID(str(uuid)) for uuid in uuids]
+        if len(uuids) == 0:
+            return {}
+
+        current = int(datetime.now().timestamp()) // 3600
+        columns = [UptimeBucket.watchdog]
+        for window, hours in UPTIME_WINDOWS.items():
+            since = UptimeBucket.bucket > current - hours
+            columns.append(fn.SUM(UptimeBucket.up).filter(since))
+            columns.append(fn.SUM(UptimeBucket.down).filter(since))
+
+        uptime = {uuid: dict.fromkeys(UPTIME_WINDOWS) for uuid in uuids}
+        for row in (
+            UptimeBucket.select(*columns)
+            .where(
+                UptimeBucket.watchdog.in_(uuids),
+                UptimeBucket.bucket > current - max(UPTIME_WINDOWS.values()),
+            )
+            .group_by(UptimeBucket.watchdog)
+            .tuples()
+        ):
+            for i, window in enumerate(UPTIME_WINDOWS):
+                up, down = row[1 + 2 * i] or 0, row[2 + 2 * i] or 0
+                if up + down > 0:
+                    uptime[row[0]][window] = round(100 * up / (up + down), 2)
+
+        return uptime
+
+    def delete_uptime_before(self, bucket):
+        return UptimeBucket.delete().where(UptimeBucket.bucket < bucket).execute()
+
+    def create_ping_sample_partitions(self, days_ahead=2):
+        """
+        Create the partitions from today to days_ahead days ahead
+        """
+        today = int(datetime.now().timestamp()) // SAMPLE_PARTITION_SECONDS
+
+        for day in range(today, today + days_ahead + 1):
+            start = day * SAMPLE_PARTITION_SECONDS
+            db.execute_sql(
+                f"CREATE TABLE IF NOT EXISTS {PingSample._meta.table_name}_{day} "
+                f"PARTITION OF {PingSample._meta.table_name} "
+                f"FOR VALUES FROM ({start}) TO ({start + SAMPLE_PARTITION_SECONDS})"
+            )
+
+    def drop_ping_sample_partitions(self, retention_days):
+        """
+        Drop the partitions that only hold samples older than retention_days
+        """
+        oldest = (
+            int(datetime.now().timestamp()) // SAMPLE_PARTITION_SECONDS
+            - retention_days
+        )
+        prefix = f"{PingSample._meta.table_name}_"
+
+        for (name,) in db.execute_sql(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            (PingSample._meta.table_name,),
+        ).fetchall():
+            if name.startswith(prefix) and int(name[len(prefix) :]) < oldest:
+                logger.info(f"Dropping partition {name}")
+                db.execute_sql(f"DROP TABLE IF EXISTS {name}")
+
+    def get_stats(self) -> dict:
+        """
+        Watchdog counts for the admin stats, with a single scan of the table
+        """
+        users, watchdogs, ping_watchdogs, push_watchdogs, offline_watchdogs = (
+            Watchdog.select(
+                fn.COUNT(Watchdog.chat_id.distinct()),
+                fn.COUNT(SQL("*")),
+                fn.COUNT(SQL("*")).filter(Watchdog.is_push == False),
+                fn.COUNT(SQL("*")).filter(Watchdog.is_push == True),
+                fn.COUNT(SQL("*")).filter(
+                    (Watchdog.is_enabled == True) & (Watchdog.is_offline == True)
+                ),
+            )
+            .tuples()
+            .get()
+        )
+
+        return {
+            "users": users,
+            "watchdogs": watchdogs,
+            "ping_watchdogs": ping_watchdogs,
+            "push_watchdogs": push_watchdogs,
+            "offline_watchdogs": offline_watchdogs,
+        }
 
 
-# create tables if they don't exist
-db.create_tables([Watchdog])
+# tables and indexes are created by migrations.run_migrations()
+if isinstance(db, HealthCheckedPooledDatabase):
+    db.fill()
 logger.info("Connected")
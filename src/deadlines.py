@@ -0,0 +1,94 @@
+import heapq
+from threading import Lock
+from utils import get_logger
+
+logger = get_logger()
+
+
+class DeadlineTracker:
+    """
+    Min-heap of the push watchdogs deadlines (epoch seconds), so that expired
+    watchdogs can be found without scanning the table.
+    Entries are invalidated lazily: a newer deadline for the same uuid just
+    shadows the older heap entry
+    """
+
+    def __init__(self):
+        self.__heap = []  # (deadline, uuid)
+        self.__deadlines = {}  # uuid -> current deadline
+        self.__wakeup_hooks = []
+        self.__lock = Lock()
+
+    def add_wakeup_hook(self, hook):
+        """
+        hook() is called when the earliest deadline moves earlier
+        """
+        self.__wakeup_hooks.append(hook)
+
+    def load(self, deadlines):
+        """
+        (Re)build the heap from (uuid, deadline) pairs
+        """
+        with self.__lock:
+            self.__deadlines = dict(deadlines)
+            self.__heap = [(d, uuid) for uuid, d in self.__deadlines.items()]
+            heapq.heapify(self.__heap)
+
+        logger.debug(f"Loaded {len(self.__heap)} deadlines")
+        self.__fire_wakeup()
+
+    def set(self, uuid, deadline):
+        with self.__lock:
+            earliest = self.__heap[0][0] if len(self.__heap) != 0 else None
+
+            self.__deadlines[uuid] = deadline
+            heapq.heappush(self.__heap, (deadline, uuid))
+            self.__compact()
+
+        if earliest is None or deadline < earliest:
+            self.__fire_wakeup()
+
+    def remove(self, uuid):
+        with self.__lock:
+            self.__deadlines.pop(uuid, None)
+
+    def has(self, uuid):
+        return uuid in self.__deadlines
+
+    def seconds_to_next(self, now):
+        """
+        Seconds until the earliest deadline, None if there are no deadlines
+        """
+        with self.__lock:
+            if len(self.__heap) == 0:
+                return None
+            return max(0, self.__heap[0][0] - now)
+
+    def pop_expired(self, now):
+        """
+        Remove and return the uuids whose deadline passed.
+        They won't expire again until a new deadline is set
+        """
+        expired = []
+
+        with self.__lock:
+            while len(self.__heap) != 0 and self.__heap[0][0] <= now:
+                deadline, uuid = heapq.heappop(self.__heap)
+
+                if self.__deadlines.get(uuid) == deadline:  # not shadowed
+                    del self.__deadlines[uuid]
+                    expired.append(uuid)
+
+        return expired
+
+    def __compact(self):
+        """
+        Drop the shadowed entries when they outnumber the live ones
+        """
+        if len(self.__heap) > 2 * len(self.__deadlines) + 1000:
+            self.__heap = [(d, uuid) for uuid, d in self.__deadlines.items()]
+            heapq.heapify(self.__heap)
+
+    def __fire_wakeup(self):
+        for hook in self.__wakeup_hooks:
+            hook()
@@ -0,0 +1,160 @@
+from datetime import datetime
+from threading import Lock, Thread
+import time
+from uuid import UUID
+from utils import get_logger
+from database import Db
+from uptime import UptimeRecorder
+
+logger = get_logger()
+
+
+class HeartbeatBuffer:
+    """
+    Write-behind buffer for push heartbeats.
+    The state of the push watchdogs is kept in memory, so that a host coming
+    back online is detected right away, while the db is updated in bulk
+    every flush_interval seconds with the latest heartbeat of each watchdog
+    """
+
+    def __init__(self, db: Db, uptime: UptimeRecorder = None, flush_interval=0.3):
+        self.__db = db
+        self.__uptime = uptime
+        self.__flush_interval = flush_interval
+        self.__watchdogs = {}  # uuid -> Watchdog, latest known state
+        self.__pending = {}  # uuid -> (datetime, remote_address)
+        self.__down_since = {}  # uuid -> timestamp, downtime recorded until then
+        self.__lock = Lock()
+        self.__flush_lock = Lock()
+
+        db.add_deleted_hook(self.__forget)
+
+    def heartbeat(self, uuid, remote_address):
+        """
+        Record a heartbeat. Returns (watchdog, last_update) where last_update is
+        the time of the previous heartbeat if the watchdog was offline, otherwise None.
+        The watchdog is None if it doesn't exist, no heartbeat is recorded if it's not push
+        """
+        w = self.__get_watchdog(uuid)
+        if w is None or not w.is_push:
+            return w, None
+
+        now = datetime.now()
+
+        with self.__lock:
+            last_update = w.last_update if w.is_offline else None
+            elapsed = (now - w.last_update).total_seconds()
+            down_since = self.__down_since.pop(w.uuid, None)
+
+            w.is_offline = False
+            w.last_update = now
+            w.address = remote_address
+            self.__pending[w.uuid] = (now, remote_address)
+
+        if self.__uptime is not None:
+            if down_since is None:
+                self.__add_uptime(w, elapsed, now.timestamp())
+            else:  # the downtime until down_since is already recorded
+                self.__uptime.add(
+                    w.uuid, 0, now.timestamp() - down_since, now.timestamp()
+                )
+
+        return w, last_update
+
+    def __add_uptime(self, w, elapsed, timestamp):
+        # up until the deadline of the previous heartbeat, down after it
+        up = min(elapsed, w.check_interval)
+        self.__uptime.add(w.uuid, up, elapsed - up, timestamp)
+
+    def set_offline(self, watchdogs):
+        """
+        Mark watchdogs offline in memory, after the db was updated. Returns
+        only the ones that are really offline: the others sent a heartbeat
+        after their deadline was checked, which brings them back online
+        in the db with the next flush
+        """
+        now = datetime.now()
+        offline = []
+
+        with self.__lock:
+            for watchdog in watchdogs:
+                w = self.__watchdogs.get(watchdog.uuid)
+                if w is not None:
+                    if (now - w.last_update).total_seconds() < w.check_interval:
+                        continue
+                    w.is_offline = True
+                else:
+                    w = watchdog
+                offline.append(watchdog)
+
+                if self.__uptime is not None:
+                    self.__add_uptime(
+                        w, (now - w.last_update).total_seconds(), now.timestamp()
+                    )
+                    self.__down_since[w.uuid] = now.timestamp()
+
+        return offline
+
+    def record_downtime(self):
+        """
+        Record the downtime of the offline watchdogs up to now, so that their
+        uptime drops while they are down rather than when they come back
+        """
+        now = time.time()
+        with self.__lock:
+            down = list(self.__down_since.items())
+            for uuid, _ in down:
+                self.__down_since[uuid] = now
+
+        for uuid, since in down:
+            self.__uptime.add(uuid, 0, now - since, now)
+
+    def flush(self):
+        with self.__flush_lock:
+            with self.__lock:
+                pending, self.__pending = self.__pending, {}
+
+            if len(pending) == 0:
+                return
+
+            try:
+                self.__db.set_watchdogs_online_bulk(pending)
+                logger.debug(f"Flushed {len(pending)} heartbeats")
+            except Exception:
+                # put them back unless newer heartbeats arrived meanwhile
+                with self.__lock:
+                    self.__pending = {**pending, **self.__pending}
+                raise
+
+    def __get_watchdog(self, uuid):
+        w = self.__watchdogs.get(UUID(str(uuid)))
+        if w is not None:
+            return w
+
+        w = self.__db.get_watchdog(uuid)
+        if w is not None:
+            with self.__lock:
+                w = self.__watchdogs.setdefault(w.uuid, w)
+
+        return w
+
+    def __forget(self, uuid):
+        with self.__lock:
+            self.__watchdogs.pop(uuid, None)
+            self.__pending.pop(uuid, None)
+            self.__down_since.pop(uuid, None)
+
+    def __schedule_flush(self):
+        logger.debug(f"Scheduled flush every {self.__flush_interval} seconds")
+
+        while True:
+            time.sleep(self.__flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing heartbeats")
+                logger.error(e)
+
+    def start(self):
+        Thread(target=self.__schedule_flush, daemon=True).start()
+        return self
@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import cProfile
+import heapq
+import json
+import os
+import time
+from metrics import Histogram
+from utils import get_logger
+
+logger = get_logger()
+
+STAGE_SECONDS = Histogram(
+    "hostpingbot_stage_seconds",
+    "Duration of the pinger and push server stages",
+    labels=["component", "stage"],
+)
+
+# span currently open in this thread or task, parent of the next ones
+_current_span = ContextVar("current_span", default=None)
+
+
+def current_span():
+    """
+    Innermost span open in this thread or task, None outside of any span
+    """
+    return _current_span.get()
+
+
+class Span:
+    """
+    Timing of a stage: name, parent span, start time (epoch), duration and
+    attributes (e.g. number of hosts). Attributes can be set while it's open
+    """
+
+    __slots__ = ("component", "name", "parent", "start", "seconds", "attributes")
+
+    def __init__(self, component, name, parent, attributes):
+        self.component = component
+        self.name = name
+        self.parent = parent
+        self.start = time.time()
+        self.seconds = None
+        self.attributes = attributes
+
+    def as_dict(self):
+        return {
+            "component": self.component,
+            "span": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start": self.start,
+            "seconds": self.seconds,
+            **self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Times the stages of a component and passes every finished span to the
+    span hooks. Spans opened inside another one (same thread or task) are
+    its children. Without hooks only the time is measured
+    """
+
+    def __init__(self, component):
+        self.__component = component
+        self.__hooks = []
+
+    def add_span_hook(self, hook):
+        """
+        hook(span) is called from the thread or task that ran the stage,
+        it must be quick
+        """
+        self.__hooks.append(hook)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(self.__component, name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.seconds = time.perf_counter() - start
+            _current_span.reset(token)
+
+            for hook in self.__hooks:
+                try:
+                    hook(span)
+                except Exception as e:
+                    logger.error(f"Error in span hook: {e}")
+
+
+def log_span(span: Span):
+    """
+    Span hook that logs the span as a JSON line
+    """
+    logger.info(f"span {json.dumps(span.as_dict(), default=str)}")
+
+
+def observe_span(span: Span):
+    """
+    Span hook that exports the span duration in hostpingbot_stage_seconds
+    """
+    STAGE_SECONDS.observe(span.seconds, component=span.component, stage=span.name)
+
+
+class CycleProfiler:
+    """
+    Runs cProfile on one cycle out of every sample_every and keeps the pstats
+    of the keep slowest profiled cycles in directory, as
+    <name>-<date>-<seconds>s.pstats (open them with pstats or snakeviz).
+    cProfile only sees the thread that runs the cycle: in async mode that's
+    the whole bot loop, and the db calls moved to executors are missed
+    """
+
+    def __init__(self, directory, name="ping_cycle", sample_every=10, keep=5):
+        self.__directory = directory
+        self.__name = name
+        self.__sample_every = sample_every
+        self.__keep = keep
+        self.__cycles = 0
+        self.__slowest = []  # min-heap of (seconds, path) of the dumped profiles
+
+    @contextmanager
+    def profile(self):
+        self.__cycles += 1
+        if self.__cycles % self.__sample_every != 0:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.__keep_if_slow(profile, time.perf_counter() - start)
+
+    def __keep_if_slow(self, profile, seconds):
+        if len(self.__slowest) == self.__keep and seconds <= self.__slowest[0][0]:
+            return
+
+        path = os.path.join(
+            self.__directory,
+            f"{self.__name}-{datetime.now():%Y%m%d-%H%M%S}-{seconds:.3f}s.pstats",
+        )
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            logger.error(f"Can't write profile {path}: {e}")
+            return
+
+        logger.debug(f"Profiled a {seconds:.3f} seconds cycle in {path}")
+        heapq.heappush(self.__slowest, (seconds, path))
+
+        if len(self.__slowest) > self.__keep:
+            _, faster = heapq.heappop(self.__slowest)
+            try:
+                os.remove(faster)
+            except OSError:
+                pass
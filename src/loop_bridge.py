@@ -0,0 +1,82 @@
+import asyncio
+from threading import BoundedSemaphore, Lock
+from utils import get_logger
+
+logger = get_logger()
+
+
+class LoopBridge:
+    """
+    Thread-safe and bounded way to run callbacks on an event loop from other threads.
+    At most max_pending callbacks can wait to be run: when they're exhausted the
+    submitting thread is blocked (backpressure) for up to timeout seconds,
+    then the callback is dropped
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending=10000, timeout=1.0):
+        self.__loop = loop
+        self.__max_pending = max_pending
+        self.__timeout = timeout
+        self.__slots = BoundedSemaphore(max_pending)
+        self.__lock = Lock()
+        self.__pending = 0
+        self.__submitted = 0
+        self.__overflowed = 0  # submissions that had to wait for a free slot
+        self.__dropped = 0  # submissions that waited too long
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    @property
+    def submitted(self):
+        return self.__submitted
+
+    @property
+    def overflowed(self):
+        return self.__overflowed
+
+    @property
+    def dropped(self):
+        return self.__dropped
+
+    def submit(self, callback, *args):
+        """
+        Run callback(*args) on the loop, returns False if it was dropped
+        """
+        if self.__is_loop_thread():
+            callback(*args)
+            return True
+
+        if not self.__slots.acquire(blocking=False):
+            with self.__lock:
+                self.__overflowed += 1
+
+            if not self.__slots.acquire(timeout=self.__timeout):
+                with self.__lock:
+                    self.__dropped += 1
+                logger.warning(f"Dropped callback, {self.__max_pending} already pending")
+                return False
+
+        with self.__lock:
+            self.__pending += 1
+            self.__submitted += 1
+
+        self.__loop.call_soon_threadsafe(self.__run, callback, args)
+        return True
+
+    def __run(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Exception occured: {e}")
+        finally:
+            with self.__lock:
+                self.__pending -= 1
+            self.__slots.release()
+
+    def __is_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.__loop
+        except RuntimeError:  # no loop running in this thread
+            return False
@@ -1,25 +1,105 @@
 from bot import MainBot
 from pinger import Pinger
 from push_server import PushServer
+from sharding import ShardCoordinator
+from samples import SampleWriter
+from uptime import UptimeRecorder
+from instrumentation import CycleProfiler, log_span, observe_span
 from database import Db
+from migrations import run_migrations
+from configuration import Configuration
+import argparse
 import os
 from utils import get_logger
 
 logger = get_logger()
 
 
+def add_span_hooks(component):
+    component.add_span_hook(observe_span)
+    if Configuration.PROFILING_LOG_SPANS:
+        component.add_span_hook(log_span)
+
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pinger-only",
+        action="store_true",
+        help="run only a sharded pinger worker (no bot polling, no push server)",
+    )
+    args = parser.parse_args()
+
+    run_migrations()
     db = Db()
     bot = MainBot(db)
-    ps = PushServer(db, bot, check_interval=10).start()
-    pinger = Pinger(db, bot, interval=60).start()
+    uptime = UptimeRecorder(db).start()
+
+    if not args.pinger_only:
+        ps = PushServer(
+            db,
+            bot,
+            uptime=uptime,
+            check_interval=10,
+            metrics_token=Configuration.PUSH_SERVER_METRICS_TOKEN,
+        )
+        add_span_hooks(ps)
+
+        if Configuration.PUSH_SERVER_ASYNC:
+            ps.start_async()
+        else:
+            ps.start()
+
+    shard = None
+    if Configuration.PINGER_SHARDED or args.pinger_only:
+        shard = ShardCoordinator(db, worker_id=Configuration.PINGER_WORKER_ID).start()
+
+    samples = None
+    if Configuration.HISTORY_RETENTION_DAYS > 0:
+        samples = SampleWriter(
+            db, retention_days=Configuration.HISTORY_RETENTION_DAYS
+        ).start()
+
+    profiler = None
+    if Configuration.PROFILING_SAMPLE_EVERY > 0:
+        if Configuration.LOGS_PATH:
+            profiler = CycleProfiler(
+                Configuration.LOGS_PATH,
+                sample_every=Configuration.PROFILING_SAMPLE_EVERY,
+                keep=Configuration.PROFILING_KEEP_SLOWEST,
+            )
+        else:
+            logger.warning("Profiling needs LogsPath, cProfile disabled")
+
+    pinger = Pinger(
+        db,
+        bot,
+        shard=shard,
+        samples=samples,
+        uptime=uptime,
+        profiler=profiler,
+        interval=60,
+    )
+    add_span_hooks(pinger)
+
+    if not args.pinger_only:
+        bot.stats.watch_pinger(pinger)
+        bot.stats.start()
+
+    if Configuration.PINGER_ASYNC:
+        pinger.start_async()
+    else:
+        pinger.start()
 
     try:
-        bot.run()
+        bot.run(polling=not args.pinger_only)
     except Exception as e:
         logger.error("Error in bot")
         logger.error(e)
         os._exit(1)
+    finally:
+        if shard is not None:
+            shard.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+from threading import Lock
+import time
+
+# default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """
+    Set of metrics rendered together in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.__metrics = []
+        self.__lock = Lock()
+
+    def register(self, metric):
+        with self.__lock:
+            self.__metrics.append(metric)
+
+    def render(self):
+        with self.__lock:
+            metrics = list(self.__metrics)
+
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.documentation}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            lines += m.samples()
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ""
+
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self._label_names = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = Lock()
+        if len(self._label_names) == 0:
+            self._values[()] = self._zero()  # exported from the start
+        registry.register(self)
+
+    def _zero(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self._label_names):
+            raise ValueError(f"{self.name} expects labels {self._label_names}")
+        return tuple(labels[n] for n in self._label_names)
+
+    def _labels(self, key, **extra):
+        return _format_labels(list(zip(self._label_names, key)) + list(extra.items()))
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        return [
+            f"{self.name}{self._labels(key)} {_format_value(v)}"
+            for key, v in values.items()
+        ]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value, e.g. requests served
+    """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. a queue depth. With set_function
+    the value is read when the metrics are rendered
+    """
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """
+        function() returns the value, only for gauges without labels
+        """
+        self.__function = function
+
+    def samples(self):
+        if self.__function is not None:
+            try:
+                self.set(self.__function())
+            except Exception:
+                pass  # a broken callback shouldn't break /metrics
+
+        return super().samples()
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (e.g. durations in seconds) in cumulative buckets
+    """
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        self.__buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(*args, **kwargs)
+
+    def _zero(self):
+        return [0] * len(self.__buckets), 0
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or self._zero()
+            for i, bound in enumerate(self.__buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """
+        Context manager that observes the seconds spent in its block
+        """
+        histogram = self
+
+        class Timer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                histogram.observe(time.perf_counter() - self.start, **labels)
+
+        return Timer()
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.__buckets, counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{self._labels(key, le=_format_value(bound))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+
+        return lines
@@ -0,0 +1,189 @@
+from datetime import datetime
+from peewee import (
+    Model,
+    BigIntegerField,
+    BooleanField,
+    CharField,
+    DateTimeField,
+    IntegerField,
+    TimestampField,
+    UUIDField,
+)
+from playhouse.migrate import PostgresqlMigrator, migrate
+from database import db, Db, Watchdog, PingerLease, PingSample, UptimeBucket
+from utils import get_logger
+
+logger = get_logger()
+
+# any constant, shared by the processes that may migrate at the same time
+MIGRATIONS_LOCK_ID = 7146531
+
+
+class SchemaMigration(Model):
+    """
+    Versions of the migrations applied to the db
+    """
+
+    class Meta:
+        database = db
+
+    version = IntegerField(primary_key=True)
+    applied_at = DateTimeField(default=datetime.now)
+
+
+class BaselineWatchdog(Model):
+    """
+    Watchdog table of the first release, the next migrations add the other
+    columns and their indexes
+    """
+
+    class Meta:
+        database = db
+        table_name = Watchdog._meta.table_name
+
+    uuid = UUIDField(primary_key=True)
+    name = CharField(null=False)
+    is_push = BooleanField(null=False)
+    address = CharField(null=True)
+    is_enabled = BooleanField(null=False)
+    last_update = TimestampField()
+    check_interval = IntegerField(default=120)
+    is_offline = BooleanField(default=False)
+    chat_id = BigIntegerField(null=False)
+
+
+def create_tables():
+    """
+    Dbs created before the migrations already have the watchdog table,
+    maybe without the columns of the next migrations: creating the current
+    model here would build indexes on columns that don't exist yet
+    """
+    db.create_tables([BaselineWatchdog, PingerLease, UptimeBucket])
+
+
+def add_updated_at_and_deadline():
+    """
+    Columns introduced after the watchdog table was first created
+    """
+    columns = [c.name for c in db.get_columns(Watchdog._meta.table_name)]
+    migrator = PostgresqlMigrator(db)
+
+    if "updated_at" not in columns:
+        logger.info("Adding column updated_at")
+        migrate(
+            # add_column also builds the index
+            migrator.add_column(
+                Watchdog._meta.table_name, "updated_at", Watchdog.updated_at
+            ),
+        )
+
+    if "deadline" not in columns:
+        logger.info("Adding column deadline")
+        migrate(
+            migrator.add_column(
+                Watchdog._meta.table_name, "deadline", Watchdog.deadline
+            ),
+        )
+        Watchdog.update(
+            deadline=Watchdog.last_update + Watchdog.check_interval
+        ).where(Watchdog.is_push == True).execute()
+
+
+def create_ping_sample_table():
+    """
+    Peewee can't declare partitioned tables, create it with raw DDL
+    """
+    table = PingSample._meta.table_name
+    db.execute_sql(
+        f"CREATE TABLE IF NOT EXISTS {table} ("
+        "watchdog UUID NOT NULL, "
+        "time INTEGER NOT NULL, "
+        "rtt REAL, "
+        "loss REAL NOT NULL"
+        ") PARTITION BY RANGE (time)"
+    )
+    db.execute_sql(
+        f"CREATE INDEX IF NOT EXISTS {table}_watchdog_time ON {table} (watchdog, time)"
+    )
+    Db().create_ping_sample_partitions()
+
+
+def add_watchdog_indexes():
+    """
+    Indexes for the admission check (chat_id, name), the pinger queries
+    (is_enabled, is_push) and the push deadlines
+    """
+    table = Watchdog._meta.table_name
+
+    # names were only checked by the application, rename the duplicates
+    # that slipped through so that the unique index can be built
+    duplicates = db.execute_sql(
+        f"SELECT uuid, chat_id, name FROM (SELECT uuid, chat_id, name, row_number() "
+        f"OVER (PARTITION BY chat_id, name ORDER BY uuid) AS n FROM {table}) AS d "
+        "WHERE d.n > 1 ORDER BY chat_id, name, n"
+    ).fetchall()
+
+    if len(duplicates) != 0:
+        # the suffixed name may be taken already, e.g. by "x (2)"
+        taken = set(
+            db.execute_sql(
+                f"SELECT chat_id, name FROM {table} WHERE chat_id = ANY(%s)",
+                (list(set(chat_id for _, chat_id, _ in duplicates)),),
+            ).fetchall()
+        )
+
+        for uuid, chat_id, name in duplicates:
+            n = 2
+            while (chat_id, f"{name} ({n})") in taken:
+                n += 1
+
+            taken.add((chat_id, f"{name} ({n})"))
+            db.execute_sql(
+                f"UPDATE {table} SET name = %s WHERE uuid = %s", (f"{name} ({n})", uuid)
+            )
+
+    db.execute_sql(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_chat_id_name "
+        f"ON {table} (chat_id, name)"
+    )
+    db.execute_sql(
+        f"CREATE INDEX IF NOT EXISTS {table}_is_enabled_is_push "
+        f"ON {table} (is_enabled, is_push)"
+    )
+    # only the online push watchdogs have a deadline that can expire
+    db.execute_sql(
+        f"CREATE INDEX IF NOT EXISTS {table}_push_deadline ON {table} (deadline) "
+        "WHERE is_push AND is_enabled AND NOT is_offline"
+    )
+    db.execute_sql(f"DROP INDEX IF EXISTS {table}_deadline")
+
+
+# never reorder or remove, a migration's version is its position in the list
+MIGRATIONS = [
+    create_tables,
+    add_updated_at_and_deadline,
+    create_ping_sample_table,
+    add_watchdog_indexes,
+]
+
+
+def run_migrations():
+    """
+    Apply the migrations that weren't applied yet, each in its own transaction
+    """
+    db.execute_sql("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+    try:
+        db.create_tables([SchemaMigration])
+        applied = set(m.version for m in SchemaMigration.select())
+
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if version in applied:
+                continue
+
+            logger.info(f"Applying migration {version} ({migration.__name__})")
+            with db.atomic():
+                migration()
+                SchemaMigration.create(version=version)
+    finally:
+        db.execute_sql("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+        db.close()  # the connection of the main thread goes back to the pool
@@ -0,0 +1,326 @@
+from aiogram import Bot
+from aiogram.utils.exceptions import BotBlocked, NetworkError, RetryAfter, TelegramAPIError
+from collections import Counter
+import asyncio
+import heapq
+import itertools
+import time
+from metrics import Counter as MetricCounter, Gauge
+from strings import Strings
+from utils import get_logger
+
+logger = get_logger()
+
+NOTIFICATION_QUEUE_DEPTH = Gauge(
+    "hostpingbot_notification_queue_depth",
+    "Notifications waiting to be sent or being sent",
+)
+TELEGRAM_ERRORS = MetricCounter(
+    "hostpingbot_telegram_errors_total",
+    "Failed Telegram sends by exception type",
+    labels=["type"],
+)
+
+
+class Notification:
+    def __init__(self, chat_id, text, priority):
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.submitted_at = time.monotonic()
+        self.attempts = 0  # failed sends, flood waits excluded
+        self.slot = None  # send time reserved in its chat
+
+
+class NotificationDispatcher:
+    """
+    Sends the Telegram notifications from a priority queue, within the
+    Telegram limits: a global token bucket (rate messages per second) and at
+    most one message every chat_interval seconds to the same chat.
+    When flooded (RetryAfter) every send is paused for the requested time
+    and the message is queued again, so nothing is lost during bulk outages.
+    Network errors are retried with exponential backoff, at most max_attempts times.
+    Must be used from the bot loop
+    """
+
+    PRIORITY_OFFLINE = 0
+    PRIORITY_ONLINE = 1
+    MIN_PRUNE_SIZE = 1024  # chats tracked before the past send times are pruned
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate=25,
+        chat_interval=1.0,
+        concurrent_sends=10,
+        max_attempts=5,
+    ):
+        self.__bot = bot
+        self.__rate = rate
+        self.__tokens = rate
+        self.__last_refill = time.monotonic()
+        self.__chat_interval = chat_interval
+        self.__max_attempts = max_attempts
+        self.__ready = []  # heap of (priority, seq, Notification)
+        self.__delayed = []  # heap of (ready time, seq, Notification)
+        self.__next_send_by_chat = {}  # chat_id -> next free send time
+        self.__prune_size = self.MIN_PRUNE_SIZE
+        self.__paused_until = 0
+        self.__seq = itertools.count()
+        self.__wakeup = None
+        self.__sending = None
+        self.__concurrent_sends = concurrent_sends
+        self.__in_flight = 0
+        self.__sent = 0
+        self.__errors = Counter()  # exception name -> count
+        self.__send_latency = 0  # seconds from submit to sent (moving average)
+
+        NOTIFICATION_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self):
+        return len(self.__ready) + len(self.__delayed) + self.__in_flight
+
+    @property
+    def send_latency(self):
+        return self.__send_latency
+
+    @property
+    def sent(self):
+        return self.__sent
+
+    @property
+    def errors(self):
+        return dict(self.__errors)
+
+    def submit(self, chat_id, text, priority=PRIORITY_ONLINE):
+        self.__push_ready(Notification(chat_id, text, priority))
+
+    async def run(self):
+        logger.info("Started")
+        self.__wakeup = asyncio.Event()
+        self.__sending = asyncio.Semaphore(self.__concurrent_sends)
+
+        while True:
+            try:
+                notification = await self.__next_notification()
+                await self.__take_token()
+                await self.__sending.acquire()
+
+                self.__in_flight += 1
+                asyncio.get_running_loop().create_task(self.__send(notification))
+            except Exception as e:
+                logger.error("Error in notification dispatcher")
+                logger.error(e)
+
+    async def __next_notification(self):
+        """
+        Wait for the most urgent notification whose chat can receive a message now
+        """
+        while True:
+            now = time.monotonic()
+
+            while len(self.__delayed) != 0 and self.__delayed[0][0] <= now:
+                _, _, notification = heapq.heappop(self.__delayed)
+                self.__push_ready(notification)
+
+            if now < self.__paused_until:
+                await self.__sleep(self.__paused_until - now)
+                continue
+
+            if len(self.__ready) != 0:
+                _, _, notification = heapq.heappop(self.__ready)
+
+                if notification.slot is None:
+                    # reserve the next free send time of the chat
+                    chat_id = notification.chat_id
+                    slot = max(now, self.__next_send_by_chat.get(chat_id, 0))
+                    self.__next_send_by_chat[chat_id] = slot + self.__chat_interval
+                    self.__prune_chat_slots(now)
+
+                    if slot > now:  # too early for this chat, try the next one
+                        notification.slot = slot
+                        self.__push_delayed(notification, slot)
+                        continue
+
+                return notification
+
+            timeout = self.__delayed[0][0] - now if len(self.__delayed) != 0 else None
+            await self.__sleep(timeout)
+
+    def __prune_chat_slots(self, now):
+        """
+        Forget the chats whose next free send time has passed, once their number
+        doubled since the last prune (amortized O(1) per message)
+        """
+        if len(self.__next_send_by_chat) < self.__prune_size:
+            return
+
+        self.__next_send_by_chat = {
+            chat_id: slot
+            for chat_id, slot in self.__next_send_by_chat.items()
+            if slot > now
+        }
+        self.__prune_size = max(self.MIN_PRUNE_SIZE, 2 * len(self.__next_send_by_chat))
+
+    async def __sleep(self, timeout):
+        """
+        Sleep until timeout or until a new notification is submitted
+        """
+        self.__wakeup.clear()
+        try:
+            await asyncio.wait_for(self.__wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def __take_token(self):
+        while True:
+            now = time.monotonic()
+            self.__tokens = min(
+                self.__rate, self.__tokens + (now - self.__last_refill) * self.__rate
+            )
+            self.__last_refill = now
+
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.__tokens) / self.__rate)
+
+    async def __send(self, notification):
+        try:
+            await self.__bot.send_message(
+                notification.chat_id, notification.text, parse_mode="HTML"
+            )
+            self.__sent += 1
+            latency = time.monotonic() - notification.submitted_at
+            self.__send_latency = 0.9 * self.__send_latency + 0.1 * latency
+        except RetryAfter as e:
+            self.__count_error(e)
+            logger.warning(f"API Flooded, pausing for {e.timeout} seconds")
+            self.__paused_until = max(self.__paused_until, time.monotonic() + e.timeout)
+            notification.slot = None
+            self.__push_ready(notification)  # doesn't count as an attempt
+        except (NetworkError, asyncio.TimeoutError) as e:
+            self.__count_error(e)
+            logger.warning(f"Network error sending notification: {e}")
+            self.__retry(notification)
+        except BotBlocked as e:
+            self.__count_error(e)
+            logger.info("Bot blocked by user")
+        except TelegramAPIError as e:
+            self.__count_error(e)
+            logger.warning(f"Telegram API error: {e}")
+        except Exception as e:
+            self.__count_error(e)
+            logger.error(f"Exception occured: {e}")
+        finally:
+            self.__in_flight -= 1
+            self.__sending.release()
+
+    def __count_error(self, e):
+        self.__errors[type(e).__name__] += 1
+        TELEGRAM_ERRORS.inc(type=type(e).__name__)
+
+    def __retry(self, notification):
+        notification.attempts += 1
+        if notification.attempts >= self.__max_attempts:
+            logger.error(f"Dropping notification after {notification.attempts} attempts")
+            return
+
+        notification.slot = None
+
+        self.__push_delayed(notification, time.monotonic() + 2 ** notification.attempts)
+
+    def __push_ready(self, notification):
+        heapq.heappush(
+            self.__ready, (notification.priority, next(self.__seq), notification)
+        )
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    def __push_delayed(self, notification, ready_time):
+        heapq.heappush(self.__delayed, (ready_time, next(self.__seq), notification))
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+
+class NotificationCoalescer:
+    """
+    Groups the status changes of the same chat that happen within window
+    seconds and sends them as a single digest message.
+    Must be used from the bot loop
+    """
+
+    MAX_MESSAGE_LENGTH = 4000  # Telegram limit is 4096
+
+    def __init__(self, dispatcher: NotificationDispatcher, window=3):
+        self.__dispatcher = dispatcher
+        self.__window = window
+        self.__pending = {}  # chat_id -> [(is_offline, name, down_for)]
+
+    def add(self, chat_id, is_offline, name, down_for=None):
+        events = self.__pending.get(chat_id)
+
+        if events is None:
+            events = self.__pending[chat_id] = []
+            asyncio.get_running_loop().call_later(self.__window, self.__flush, chat_id)
+
+        events.append((is_offline, name, down_for))
+
+    def __flush(self, chat_id):
+        events = self.__pending.pop(chat_id)
+
+        priority = (
+            NotificationDispatcher.PRIORITY_OFFLINE
+            if any(is_offline for is_offline, _, _ in events)
+            else NotificationDispatcher.PRIORITY_ONLINE
+        )
+
+        if len(events) == 1:
+            messages = [self.__single_message(*events[0])]
+        else:
+            messages = self.__digest_messages(events)
+
+        for message in messages:
+            self.__dispatcher.submit(chat_id, message, priority)
+
+    def __single_message(self, is_offline, name, down_for):
+        if is_offline:
+            return Strings.OFFLINE_MESSAGE(name)
+        elif down_for is not None:
+            return Strings.ONLINE_MESSAGE_WITH_TIME(name, down_for)
+        else:
+            return Strings.ONLINE_MESSAGE(name)
+
+    def __digest_messages(self, events):
+        offline = [name for is_offline, name, _ in events if is_offline]
+        online = [(name, down_for) for is_offline, name, down_for in events if not is_offline]
+
+        lines = []
+
+        if len(offline) != 0:
+            lines.append(Strings.DIGEST_OFFLINE_HEADER(len(offline)))
+            lines += [Strings.DIGEST_ITEM(name) for name in offline]
+
+        if len(online) != 0:
+            if len(lines) != 0:
+                lines.append("\n")
+            lines.append(Strings.DIGEST_ONLINE_HEADER(len(online)))
+            lines += [
+                Strings.DIGEST_ITEM_WITH_TIME(name, down_for)
+                if down_for is not None
+                else Strings.DIGEST_ITEM(name)
+                for name, down_for in online
+            ]
+
+        # split long digests in several messages
+        messages = [""]
+        for line in lines:
+            if len(messages[-1]) + len(line) > self.MAX_MESSAGE_LENGTH:
+                if line == "\n":  # no separator at the top of a message
+                    continue
+                messages.append("")
+            messages[-1] += line
+
+        return messages
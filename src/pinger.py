@@ -1,117 +1,767 @@
 from datetime import datetime
-from icmplib import multiping
-from icmplib import NameLookupError
+from icmplib import multiping, async_multiping, async_ping
+from icmplib.exceptions import ICMPSocketError, SocketBroadcastError
+import asyncio
+from collections import deque
+from contextlib import nullcontext
+import heapq
 import time
-from threading import Thread
-from utils import get_logger, dns_resolves
+from threading import Event, Thread
+from utils import get_logger
+from metrics import Gauge, Histogram
+from instrumentation import Tracer, CycleProfiler
+from resolver import Resolver
+from sharding import ShardCoordinator
+from registry import WatchdogRegistry
+from samples import SampleWriter
+from uptime import UptimeRecorder
+from prober import OfflineProber, VERDICT_ONLINE, VERDICT_OFFLINE
 from database import Db
 from bot import MainBot
 import os
 
 logger = get_logger()
 
+PING_CYCLE_SECONDS = Histogram(
+    "hostpingbot_ping_cycle_seconds",
+    "Duration of the ping cycles",
+    buckets=(0.5, 1, 2, 5, 10, 15, 30, 60, 90, 120, 180, 300),
+)
+PING_CYCLE_HOSTS = Gauge(
+    "hostpingbot_ping_cycle_hosts",
+    "Hosts of the last ping cycle: pinged, up and down (down hosts are "
+    "confirmed by the prober before being set offline)",
+    labels=["state"],
+)
+
+
+def _is_socket_error(error):
+    """
+    Errors of the ICMP socket itself (e.g. missing permissions), which would
+    fail every address, unlike a broadcast address
+    """
+    return isinstance(error, ICMPSocketError) and not isinstance(
+        error, SocketBroadcastError
+    )
+
 
 class Pinger:
     def __init__(
         self,
         db: Db,
         bot: MainBot,
+        shard: ShardCoordinator = None,
+        samples: SampleWriter = None,
+        uptime: UptimeRecorder = None,
+        profiler: CycleProfiler = None,
         interval=120,
+        min_interval=10,
+        tick=1,
         p_count=2,
         p_interval=0.05,
         p_concurrent_tasks=100,
         p_payload_size=8,
         p_offline_repeat_count=3,
+        bad_address_ttl=300,
     ):
         self.__db = db
         self.__bot = bot
-        self.__interval = interval
-        self.__hosts = []
+        self.__shard = shard
+        self.__shard_version = None
+        self.__samples = samples  # latency and packet loss history, optional
+        self.__uptime = uptime  # uptime counters, optional
+        self.__last_cycle = (None, None)  # (seconds, hosts) of the last ping cycle
+        self.__tracer = Tracer("pinger")
+        self.__profiler = profiler  # profiles the slowest cycles, optional
+        self.__interval = interval  # longest allowed gap between two pings of a host
+        self.__min_interval = min_interval
+        self.__tick = tick
+        self.__registry = WatchdogRegistry(db)
+        self.__pending = deque()  # watchdogs to add to the queue
+        self.__queue = []  # min-heap of (next due time, uuid)
+        self.__scheduled = set()  # uuids currently in the queue
+        self.__loaded = False  # the initial load has been queued
+        self.__resolver = Resolver()
         self.__p_count = p_count
         self.__p_interval = p_interval
         self.__p_concurrent_tasks = p_concurrent_tasks
         self.__p_payload_size = p_payload_size
-        self.__offline_repeat_count = p_offline_repeat_count
+        self.__prober = OfflineProber(p_count=p_count, stages=p_offline_repeat_count)
+        self.__offline = set()  # uuids known to be offline, they aren't probed again
+        self.__bad_address_ttl = bad_address_ttl
+        self.__bad_addresses = {}  # ip -> time until it's skipped
+
+        # may be called from other threads (e.g. watchdogs created by the bot)
+        self.__registry.add_added_hook(self.__pending.append)
 
         logger.debug("Ready")
 
+    @property
+    def last_cycle(self):
+        """
+        (duration in seconds, pinged hosts) of the last ping cycle
+        """
+        return self.__last_cycle
+
+    @property
+    def suspects(self):
+        """
+        Number of hosts that didn't answer and wait for the prober's verdict
+        """
+        return len(self.__prober)
+
+    def ping_all(self):
+        """
+        Run a ping cycle on every host right now, outside of the schedule
+        (benchmarks and tests). Returns the number of pinged hosts
+        """
+        with self.__tracer.span("refresh_hosts"):
+            self.__refresh_hosts()
+
+        hosts = [w for w in self.__registry.all() if self.__owns(w)]
+        self.__run_cycle(hosts)
+        return len(hosts)
+
+    async def ping_all_async(self):
+        """
+        Same as ping_all with the async ping engine
+        """
+        with self.__tracer.span("refresh_hosts"):
+            await asyncio.get_running_loop().run_in_executor(None, self.__refresh_hosts)
+
+        hosts = [w for w in self.__registry.all() if self.__owns(w)]
+        await self.__run_cycle_async(hosts)
+        return len(hosts)
+
+    def add_span_hook(self, hook):
+        """
+        hook(span) receives the timing of every stage (see instrumentation.Tracer)
+        """
+        self.__tracer.add_span_hook(hook)
+
     def __schedule(self):
-        logger.debug(f"Scheduled ping every {self.__interval} seconds")
+        logger.debug(
+            f"Scheduled ping every {self.__min_interval}-{self.__interval} seconds"
+        )
 
         while True:
             try:
-                start_time = datetime.now()
-                self.__ping_hosts()
-                total_seconds = (datetime.now() - start_time).total_seconds()
-                logger.debug(f"Took {total_seconds} seconds to ping")
+                with self.__tracer.span("refresh_hosts"):
+                    self.__refresh_hosts()
+
+                due_hosts = self.__pop_due_hosts(time.monotonic())
 
-                left_waiting_time = max(0, self.__interval - total_seconds)
-                time.sleep(left_waiting_time)
+                if len(due_hosts) != 0:
+                    self.__run_cycle(due_hosts)
+
+                time.sleep(self.__seconds_to_next_wakeup())
             except Exception as e:
                 logger.error("Error in pinger")
                 logger.error(e)
                 os._exit(1)
 
-    def __ping_hosts(self):
+    async def __schedule_async(self):
+        """
+        Same as __schedule but runs as a task on the bot loop,
+        blocking db calls are moved to the default executor
+        """
+        logger.debug(
+            f"Scheduled async ping every {self.__min_interval}-{self.__interval} seconds"
+        )
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                with self.__tracer.span("refresh_hosts"):
+                    await loop.run_in_executor(None, self.__refresh_hosts)
+
+                due_hosts = self.__pop_due_hosts(time.monotonic())
+
+                if len(due_hosts) != 0:
+                    await self.__run_cycle_async(due_hosts)
+
+                await asyncio.sleep(self.__seconds_to_next_wakeup())
+            except Exception as e:
+                logger.error("Error in pinger")
+                logger.error(e)
+                os._exit(1)
+
+    def __profile(self):
+        if self.__profiler is None:
+            return nullcontext()
+
+        return self.__profiler.profile()
+
+    def __run_cycle(self, hosts):
+        """
+        A failed cycle (e.g. db unreachable) is logged, its hosts are pinged
+        again when they're due next time
+        """
+        start_time = datetime.now()
+
+        with self.__profile(), self.__tracer.span("cycle", hosts=len(hosts)):
+            try:
+                self.__ping_hosts(hosts)
+            except Exception as e:
+                logger.error("Error in ping cycle")
+                logger.error(e)
+
+        self.__end_cycle(start_time, hosts)
+
+    async def __run_cycle_async(self, hosts):
+        start_time = datetime.now()
+
+        with self.__profile(), self.__tracer.span("cycle", hosts=len(hosts)):
+            try:
+                await self.__ping_hosts_async(hosts)
+            except Exception as e:
+                logger.error("Error in ping cycle")
+                logger.error(e)
+
+        self.__end_cycle(start_time, hosts)
+
+    def __end_cycle(self, start_time, hosts):
+        total_seconds = (datetime.now() - start_time).total_seconds()
+        self.__last_cycle = (total_seconds, len(hosts))
+        PING_CYCLE_SECONDS.observe(total_seconds)
+        logger.debug(f"Took {total_seconds} seconds to ping {len(hosts)} hosts")
+
+    def __seconds_to_next_wakeup(self):
+        """
+        Sleep until the next host is due, but wake up at least every
+        min_interval to pick up new hosts
+        """
+        next_wakeup = time.monotonic() + self.__min_interval
+        if len(self.__queue) != 0:
+            next_wakeup = min(next_wakeup, self.__queue[0][0])
+
+        return max(self.__tick, next_wakeup - time.monotonic())
+
+    def __owns(self, watchdog):
+        return self.__shard is None or self.__shard.owns(watchdog.uuid)
+
+    def __host_interval(self, watchdog):
+        """
+        Seconds between two pings of the same host, bounded by [min_interval, interval]
+        """
+        return max(self.__min_interval, min(watchdog.check_interval, self.__interval))
+
+    def __enqueue(self, uuid, due_time):
+        heapq.heappush(self.__queue, (due_time, uuid))
+        self.__scheduled.add(uuid)
+
+    def __pop_due_hosts(self, now):
+        """
+        Pop every host whose next due time has passed and schedule its next ping
+        """
+        due_hosts = []
+
+        while len(self.__queue) != 0 and self.__queue[0][0] <= now:
+            due_time, uuid = heapq.heappop(self.__queue)
+            self.__scheduled.discard(uuid)
+
+            w = self.__registry.get(uuid)
+            if w is None or not self.__owns(w):  # deleted, disabled or moved to another worker
+                continue
+
+            due_hosts.append(w)
+
+            # keep a fixed rate so that hosts stay spread over time,
+            # unless the pinger fell behind by more than one interval
+            next_due_time = due_time + self.__host_interval(w)
+            if next_due_time <= now:
+                next_due_time = now + self.__host_interval(w)
+            self.__enqueue(uuid, next_due_time)
+
+        return due_hosts
+
+    def __ping_args(self, count=None):
+        return dict(
+            count=count or self.__p_count,
+            interval=self.__p_interval,
+            payload_size=self.__p_payload_size,
+            privileged=False,
+        )
+
+    def __multiping_args(self, count=None):
+        return dict(self.__ping_args(count), concurrent_tasks=self.__p_concurrent_tasks)
+
+    def __ping_hosts(self, hosts):
+        """
+        Sweep: ping every host once, the ones that don't answer are confirmed
+        by the prober (see __confirm) instead of being pinged again here
+        """
         logger.debug("Running ping")
 
-        self.__fetch_hosts()
+        # resolve once per cycle, unresolvable hosts aren't pinged (so they're suspects)
+        with self.__tracer.span("resolve", hosts=len(hosts)):
+            ips = self.__resolver.resolve_all([h.address for h in hosts])
 
-        hosts_to_ping = self.__hosts
-        retries = 0
+        addresses = list(set(ips[h.address] for h in self.__pingable_hosts(hosts, ips)))
+        with self.__tracer.span("multiping", addresses=len(addresses)):
+            results = self.__multiping_isolated(addresses)
 
-        while retries < 5:
+        with self.__tracer.span("record_samples"):
+            self.__record_samples([(h, ips[h.address]) for h in hosts], results)
+
+        online_hosts, down_hosts = self.__process_results(hosts, ips, results)
+        with self.__tracer.span("transition_online", hosts=len(online_hosts)):
+            online = self.__db.transition_watchdogs_online(
+                [h.uuid for h in online_hosts]
+            )
+        with self.__tracer.span("notify_online", hosts=len(online)):
+            self.__notify_online_hosts(online)
+
+        offline_hosts = self.__add_suspects(down_hosts, ips, results)
+        with self.__tracer.span("record_uptime"):
+            self.__record_uptime(online_hosts, offline_hosts)
+        with self.__tracer.span("transition_offline", hosts=len(offline_hosts)):
+            offline = self.__db.transition_watchdogs_offline(
+                [h.uuid for h in offline_hosts]
+            )
+        with self.__tracer.span("notify_offline", hosts=len(offline)):
+            self.__notify_offline_hosts(down_hosts, offline)
+
+    async def __ping_hosts_async(self, hosts):
+        logger.debug("Running async ping")
+
+        loop = asyncio.get_running_loop()
+
+        # resolve once per cycle, unresolvable hosts aren't pinged (so they're suspects)
+        with self.__tracer.span("resolve", hosts=len(hosts)):
+            ips = await self.__resolver.resolve_all_async([h.address for h in hosts])
+
+        addresses = list(set(ips[h.address] for h in self.__pingable_hosts(hosts, ips)))
+        with self.__tracer.span("multiping", addresses=len(addresses)):
+            results = await self.__multiping_isolated_async(addresses)
+
+        with self.__tracer.span("record_samples"):
+            self.__record_samples([(h, ips[h.address]) for h in hosts], results)
+
+        online_hosts, down_hosts = self.__process_results(hosts, ips, results)
+        with self.__tracer.span("transition_online", hosts=len(online_hosts)):
+            online = await loop.run_in_executor(
+                None,
+                self.__db.transition_watchdogs_online,
+                [h.uuid for h in online_hosts],
+            )
+        with self.__tracer.span("notify_online", hosts=len(online)):
+            self.__notify_online_hosts(online)
+
+        offline_hosts = self.__add_suspects(down_hosts, ips, results)
+        with self.__tracer.span("record_uptime"):
+            self.__record_uptime(online_hosts, offline_hosts)
+        with self.__tracer.span("transition_offline", hosts=len(offline_hosts)):
+            offline = await loop.run_in_executor(
+                None,
+                self.__db.transition_watchdogs_offline,
+                [h.uuid for h in offline_hosts],
+            )
+        with self.__tracer.span("notify_offline", hosts=len(offline)):
+            self.__notify_offline_hosts(down_hosts, offline)
+
+    def __add_suspects(self, down_hosts, ips, results):
+        """
+        Queue the hosts that didn't answer for confirmation, hosts that
+        couldn't be pinged (no ip or bad address) included: a failed lookup
+        may be transient, the prober resolves them again. Returns the hosts
+        already known to be offline, to keep offline right away
+        """
+        now = time.monotonic()
+        offline = []
+
+        for h in down_hosts:
+            ip = ips[h.address]
+
+            if h.uuid in self.__offline:
+                offline.append(h)
+            else:
+                lost = results[ip].packets_sent if ip in results else 0
+                self.__prober.add(h, ip, lost, now)
+
+        if len(self.__prober) != 0:
+            logger.debug(f"{len(self.__prober)} hosts waiting for confirmation")
+
+        return offline
+
+    def __confirm(self):
+        logger.debug("Confirming offline hosts")
+        wakeup = Event()
+        self.__prober.add_wakeup_hook(wakeup.set)
+
+        while True:
             try:
-                for _ in range(self.__offline_repeat_count):
-                    current_iteration_hosts = [h for h in hosts_to_ping if dns_resolves(h.address)]
-
-                    if len(current_iteration_hosts) == 0:
-                        break
-
-                    results = multiping(
-                        map(lambda h: h.address, current_iteration_hosts),
-                        count=self.__p_count,
-                        interval=self.__p_interval,
-                        concurrent_tasks=self.__p_concurrent_tasks,
-                        payload_size=self.__p_payload_size,
-                        privileged=False,
-                    )
-
-                    online_hosts = []
-
-                    for i, r in enumerate(results):
-                        if r.is_alive:
-                            online_hosts.append(current_iteration_hosts[i])
-
-                    for h in online_hosts:
-                        if h.is_offline:  # host became online
-                            self.__bot.notify_online_host(h, h.last_update)
-
-                        hosts_to_ping.remove(h)
-
-                    self.__db.set_watchdogs_online(online_hosts)
-                break
-            except NameLookupError as e:
-                logger.error(f"NameLookupError {e}")
-                retries += 1
+                wakeup.wait(self.__seconds_to_next_probe())
+                wakeup.clear()
+
+                for count, suspects in self.__pop_due_suspects().items():
+                    try:
+                        with self.__tracer.span(
+                            "confirm", count=count, hosts=len(suspects)
+                        ):
+                            self.__confirm_suspects(suspects, count)
+                    except Exception as e:
+                        self.__drop_suspects(suspects, e)
+            except Exception as e:
+                logger.error("Error in pinger confirmation")
+                logger.error(e)
+                os._exit(1)
+
+    async def __confirm_async(self):
+        logger.debug("Confirming offline hosts (async)")
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.__prober.add_wakeup_hook(lambda: loop.call_soon_threadsafe(wakeup.set))
+
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.__seconds_to_next_probe())
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+
+                for count, suspects in self.__pop_due_suspects().items():
+                    try:
+                        with self.__tracer.span(
+                            "confirm", count=count, hosts=len(suspects)
+                        ):
+                            await self.__confirm_suspects_async(suspects, count)
+                    except Exception as e:
+                        self.__drop_suspects(suspects, e)
             except Exception as e:
+                logger.error("Error in pinger confirmation")
                 logger.error(e)
-                retries += 1
+                os._exit(1)
+
+    def __confirm_suspects(self, suspects, count):
+        unresolved = [s for s in suspects if s.ip is None]
+        if len(unresolved) != 0:
+            with self.__tracer.span("resolve", hosts=len(unresolved)):
+                ips = self.__resolver.resolve_all(
+                    [s.watchdog.address for s in unresolved], retry_failures=True
+                )
+            self.__set_suspect_ips(unresolved, ips)
+
+        addresses = list(set(s.ip for s in suspects if s.ip is not None))
+        with self.__tracer.span("multiping", addresses=len(addresses)):
+            results = self.__multiping_isolated(addresses, count)
+
+        online_hosts, offline_hosts = self.__record_probes(suspects, results, count)
+
+        with self.__tracer.span("transition_online", hosts=len(online_hosts)):
+            online = self.__db.transition_watchdogs_online(
+                [h.uuid for h in online_hosts]
+            )
+        with self.__tracer.span("notify_online", hosts=len(online)):
+            self.__notify_online_hosts(online)
+
+        with self.__tracer.span("transition_offline", hosts=len(offline_hosts)):
+            offline = self.__db.transition_watchdogs_offline(
+                [h.uuid for h in offline_hosts]
+            )
+        with self.__tracer.span("notify_offline", hosts=len(offline)):
+            self.__notify_offline_hosts(offline_hosts, offline)
+
+    async def __confirm_suspects_async(self, suspects, count):
+        loop = asyncio.get_running_loop()
+
+        unresolved = [s for s in suspects if s.ip is None]
+        if len(unresolved) != 0:
+            with self.__tracer.span("resolve", hosts=len(unresolved)):
+                ips = await self.__resolver.resolve_all_async(
+                    [s.watchdog.address for s in unresolved], retry_failures=True
+                )
+            self.__set_suspect_ips(unresolved, ips)
+
+        addresses = list(set(s.ip for s in suspects if s.ip is not None))
+        with self.__tracer.span("multiping", addresses=len(addresses)):
+            results = await self.__multiping_isolated_async(addresses, count)
+
+        online_hosts, offline_hosts = self.__record_probes(suspects, results, count)
+
+        with self.__tracer.span("transition_online", hosts=len(online_hosts)):
+            online = await loop.run_in_executor(
+                None,
+                self.__db.transition_watchdogs_online,
+                [h.uuid for h in online_hosts],
+            )
+        with self.__tracer.span("notify_online", hosts=len(online)):
+            self.__notify_online_hosts(online)
+
+        with self.__tracer.span("transition_offline", hosts=len(offline_hosts)):
+            offline = await loop.run_in_executor(
+                None,
+                self.__db.transition_watchdogs_offline,
+                [h.uuid for h in offline_hosts],
+            )
+        with self.__tracer.span("notify_offline", hosts=len(offline)):
+            self.__notify_offline_hosts(offline_hosts, offline)
+
+    def __set_suspect_ips(self, suspects, ips):
+        """
+        The ones still without an ip lose the probe
+        """
+        for s in suspects:
+            s.ip = ips[s.watchdog.address]
+
+    def __seconds_to_next_probe(self):
+        seconds = self.__prober.seconds_to_next(time.monotonic())
+        if seconds is None:
+            return self.__min_interval
+
+        return min(seconds, self.__min_interval)
+
+    def __pop_due_suspects(self):
+        """
+        Due suspects grouped by probe count, without the hosts that were
+        deleted or moved to another worker in the meantime
+        """
+        due = self.__prober.pop_due(time.monotonic())
+
+        for count, suspects in due.items():
+            for s in suspects:
+                if self.__registry.get(s.watchdog.uuid) is None or not self.__owns(
+                    s.watchdog
+                ):
+                    self.__prober.discard(s.watchdog.uuid)
+
+            due[count] = [s for s in suspects if self.__prober.has(s.watchdog.uuid)]
+
+        return {count: suspects for count, suspects in due.items() if suspects}
+
+    def __record_probes(self, suspects, results, count):
+        """
+        Returns (online, offline) hosts, the others wait for a longer probe
+        """
+        self.__record_samples([(s.watchdog, s.ip) for s in suspects], results)
+
+        now = time.monotonic()
+        online_hosts = []
+        offline_hosts = []
+
+        for s in suspects:
+            r = results.get(s.ip)
+            if r is None:  # no ip or bad address, nothing came back
+                verdict = self.__prober.record(s, count, 0, now)
+            else:
+                verdict = self.__prober.record(s, r.packets_sent, r.packets_received, now)
+
+            if verdict == VERDICT_ONLINE:
+                online_hosts.append(s.watchdog)
+            elif verdict == VERDICT_OFFLINE:
+                logger.debug(
+                    f"{s.watchdog} offline, confidence {self.__prober.confidence(s):.4f}"
+                )
+                offline_hosts.append(s.watchdog)
+
+        self.__record_uptime(online_hosts, offline_hosts)
+        return online_hosts, offline_hosts
+
+    def __drop_suspects(self, suspects, error):
+        """
+        A failed probe drops its suspects, they come back with the next sweep
+        """
+        logger.error("Error probing offline hosts")
+        logger.error(error)
 
-        if len(hosts_to_ping) != 0:
-            logger.debug(f"{len(hosts_to_ping)} hosts are down")
+        for s in suspects:
+            self.__prober.discard(s.watchdog.uuid)
 
-            # notify users
-            new_offline_hosts = [h for h in hosts_to_ping if not h.is_offline]
-            self.__bot.notify_offline_hosts(new_offline_hosts)
-            self.__db.set_watchdogs_offline(new_offline_hosts)
-        else:
+    def __multiping_isolated(self, addresses, count=None):
+        """
+        Ping addresses, returns a dict ip -> icmplib Host.
+        If multiping fails every address is pinged on its own, so that only
+        the ones raising an error are marked and skipped for bad_address_ttl
+        seconds. Socket errors are raised, they aren't caused by an address
+        """
+        try:
+            return dict(zip(addresses, multiping(addresses, **self.__multiping_args(count))))
+        except Exception as e:
+            self.__check_batch_error(e, addresses)
+
+        return asyncio.run(self.__ping_each(addresses, count))
+
+    async def __multiping_isolated_async(self, addresses, count=None):
+        """
+        Same as __multiping_isolated but non-blocking
+        """
+        try:
+            return dict(
+                zip(addresses, await async_multiping(addresses, **self.__multiping_args(count)))
+            )
+        except Exception as e:
+            self.__check_batch_error(e, addresses)
+
+        return await self.__ping_each(addresses, count)
+
+    def __check_batch_error(self, error, addresses):
+        if _is_socket_error(error):
+            raise error
+
+        logger.warning(
+            f"Multiping of {len(addresses)} addresses failed, pinging them one by one: {error}"
+        )
+
+    async def __ping_each(self, addresses, count):
+        semaphore = asyncio.Semaphore(self.__p_concurrent_tasks)
+
+        async def ping_one(address):
+            async with semaphore:
+                return await async_ping(address, **self.__ping_args(count))
+
+        hosts = await asyncio.gather(
+            *[ping_one(a) for a in addresses], return_exceptions=True
+        )
+
+        results = {}
+        for address, host in zip(addresses, hosts):
+            if not isinstance(host, Exception):
+                results[address] = host
+            elif _is_socket_error(host):
+                raise host
+            else:
+                logger.warning(f"Skipping {address} for {self.__bad_address_ttl}s: {host}")
+                self.__bad_addresses[address] = time.monotonic() + self.__bad_address_ttl
+
+        return results
+
+    def __pingable_hosts(self, hosts, ips):
+        """
+        Hosts with a valid ip that isn't marked as bad
+        """
+        now = time.monotonic()
+        self.__bad_addresses = {
+            ip: until for ip, until in self.__bad_addresses.items() if until > now
+        }
+
+        return [
+            h
+            for h in hosts
+            if ips[h.address] is not None and ips[h.address] not in self.__bad_addresses
+        ]
+
+    def __process_results(self, hosts, ips, results):
+        """
+        Returns (alive hosts, hosts that didn't answer)
+        """
+        online_hosts = []
+        down_hosts = []
+
+        for h in hosts:
+            r = results.get(ips[h.address])
+            if r is not None and r.is_alive:
+                online_hosts.append(h)
+                self.__prober.discard(h.uuid)
+            else:
+                down_hosts.append(h)
+
+        PING_CYCLE_HOSTS.set(len(hosts), state="pinged")
+        PING_CYCLE_HOSTS.set(len(online_hosts), state="up")
+        PING_CYCLE_HOSTS.set(len(down_hosts), state="down")
+
+        return online_hosts, down_hosts
+
+    def __record_samples(self, hosts_ips, results):
+        """
+        Keep the latency and packet loss of the hosts that were pinged
+        """
+        if self.__samples is None:
+            return
+
+        for h, ip in hosts_ips:
+            if ip in results:
+                self.__samples.add(h.uuid, results[ip])
+
+    def __record_uptime(self, online_hosts, offline_hosts):
+        """
+        Each ping result stands for the interval until the next ping of the host
+        """
+        if self.__uptime is None:
+            return
+
+        for h in online_hosts:
+            self.__uptime.add(h.uuid, self.__host_interval(h), 0)
+
+        for h in offline_hosts:
+            self.__uptime.add(h.uuid, 0, self.__host_interval(h))
+
+    def __notify_online_hosts(self, updated_hosts):
+        """
+        Notify the hosts that came back online, as returned by transition_watchdogs_online
+        """
+        for w in updated_hosts:
+            self.__offline.discard(w.uuid)
+
+            if w.was_offline:  # host became online
+                self.__bot.notify_online_host(w, w.previous_update)
+
+    def __notify_offline_hosts(self, down_hosts, new_offline_hosts):
+        """
+        Notify the hosts that went offline in this cycle,
+        as returned by transition_watchdogs_offline
+        """
+        if len(down_hosts) == 0:
             logger.debug("All hosts are online")
+            return
+
+        logger.debug(f"{len(down_hosts)} hosts are down")
+
+        for w in new_offline_hosts:
+            self.__offline.add(w.uuid)
 
-    def __fetch_hosts(self):
-        self.__hosts = self.__db.get_hosts_to_ping()
+        # notify users
+        self.__bot.notify_offline_hosts(new_offline_hosts)
 
-    def start(self):
+    def __refresh_hosts(self):
+        """
+        Apply the registry changes and add the new hosts to the queue. New hosts are
+        pinged right away, while the first ping of the hosts loaded at startup (or
+        taken over from another worker) is spread over one interval (by uuid) so
+        that they don't all fire at once.
+        When sharded only the hosts owned by this worker are queued
+        """
+        self.__registry.refresh()
+
+        spread = not self.__loaded
+        self.__loaded = True
+
+        if self.__shard is not None and self.__shard.version != self.__shard_version:
+            # partitions changed, queue the hosts this worker may now own
+            self.__shard_version = self.__shard.version
+            self.__pending.extend(self.__registry.all())
+            spread = True
+
+        now = time.monotonic()
+        while len(self.__pending) != 0:
+            w = self.__pending.popleft()
+
+            if w.is_offline:
+                self.__offline.add(w.uuid)
+
+            if w.uuid not in self.__scheduled and self.__owns(w):
+                offset = 0
+                if spread:
+                    offset = (w.uuid.int % 1000) / 1000 * self.__host_interval(w)
+                self.__enqueue(w.uuid, now + offset)
+
+    def start(self, schedule=True):
+        """
+        With schedule=False only the suspects are confirmed, cycles are run
+        with ping_all
+        """
         logger.info("Started")
-        Thread(target=self.__schedule, daemon=True).start()
+        if schedule:
+            Thread(target=self.__schedule, daemon=True).start()
+        Thread(target=self.__confirm, daemon=True).start()
+        return self
+
+    def start_async(self, schedule=True):
+        """
+        Run the pinger as a task on the bot loop instead of its own thread
+        """
+        logger.info("Started (async)")
+        if schedule:
+            self.__bot.add_background_task(self.__schedule_async)
+        self.__bot.add_background_task(self.__confirm_async)
         return self
@@ -0,0 +1,140 @@
+import heapq
+from threading import Lock
+from utils import get_logger
+
+logger = get_logger()
+
+VERDICT_ONLINE = "online"
+VERDICT_OFFLINE = "offline"
+
+
+class Suspect:
+    """
+    A host that didn't answer a sweep, waiting for its next confirmation probe
+    """
+
+    __slots__ = ("watchdog", "ip", "stage", "lost", "due")
+
+    def __init__(self, watchdog, ip, lost, due):
+        self.watchdog = watchdog
+        self.ip = ip
+        self.stage = 0
+        self.lost = lost  # probes lost in a row, sweep included
+        self.due = due
+
+
+class OfflineProber:
+    """
+    Confirmation queue for the hosts that didn't answer a sweep.
+    Every stage sends more probes (p_count * 2^(stage+1)) after a longer
+    backoff (backoff * 2^stage seconds). A single reply means the host is
+    online, otherwise it's declared offline once the confidence
+    1 - loss_rate^lost reaches min_confidence or after the last stage
+    """
+
+    def __init__(
+        self, p_count=2, stages=3, backoff=1, loss_rate=0.3, min_confidence=0.99
+    ):
+        self.__p_count = p_count
+        self.__stages = stages
+        self.__backoff = backoff
+        self.__loss_rate = loss_rate
+        self.__min_confidence = min_confidence
+        self.__heap = []  # (due, uuid)
+        self.__suspects = {}  # uuid -> Suspect
+        self.__wakeup_hooks = []
+        self.__lock = Lock()
+
+    def add_wakeup_hook(self, hook):
+        """
+        hook() is called when a new suspect is added
+        """
+        self.__wakeup_hooks.append(hook)
+
+    def add(self, watchdog, ip, lost, now):
+        """
+        Queue a host that lost its last `lost` probes, returns False if
+        it's already being probed
+        """
+        with self.__lock:
+            if watchdog.uuid in self.__suspects:
+                return False
+
+            s = Suspect(watchdog, ip, lost, now + self.__backoff)
+            self.__suspects[watchdog.uuid] = s
+            heapq.heappush(self.__heap, (s.due, watchdog.uuid))
+
+        for hook in self.__wakeup_hooks:
+            hook()
+        return True
+
+    def discard(self, uuid):
+        with self.__lock:
+            self.__suspects.pop(uuid, None)
+
+    def has(self, uuid):
+        return uuid in self.__suspects
+
+    def __len__(self):
+        return len(self.__suspects)
+
+    def seconds_to_next(self, now):
+        """
+        Seconds until the next probe is due, None if there are no suspects
+        """
+        with self.__lock:
+            if len(self.__heap) == 0:
+                return None
+            return max(0, self.__heap[0][0] - now)
+
+    def pop_due(self, now):
+        """
+        Return the suspects whose probe is due, grouped by probe count.
+        They stay suspects until record() gives a verdict
+        """
+        due = {}
+
+        with self.__lock:
+            while len(self.__heap) != 0 and self.__heap[0][0] <= now:
+                t, uuid = heapq.heappop(self.__heap)
+
+                s = self.__suspects.get(uuid)
+                if s is not None and s.due == t:  # not discarded meanwhile
+                    due.setdefault(self.probe_count(s), []).append(s)
+
+        return due
+
+    def probe_count(self, suspect):
+        return self.__p_count * 2 ** (suspect.stage + 1)
+
+    def confidence(self, suspect):
+        """
+        Probability that the host is really down given the probes lost in a row
+        """
+        return 1 - self.__loss_rate ** suspect.lost
+
+    def record(self, suspect, sent, received, now):
+        """
+        Record the result of a probe. Returns VERDICT_ONLINE, VERDICT_OFFLINE
+        or None if the host needs another (longer) probe
+        """
+        with self.__lock:
+            if self.__suspects.get(suspect.watchdog.uuid) is not suspect:
+                return None  # discarded while it was probed
+
+            if received > 0:
+                del self.__suspects[suspect.watchdog.uuid]
+                return VERDICT_ONLINE
+
+            suspect.lost += sent
+            if (
+                self.confidence(suspect) >= self.__min_confidence
+                or suspect.stage + 1 >= self.__stages
+            ):
+                del self.__suspects[suspect.watchdog.uuid]
+                return VERDICT_OFFLINE
+
+            suspect.stage += 1
+            suspect.due = now + self.__backoff * 2 ** suspect.stage
+            heapq.heappush(self.__heap, (suspect.due, suspect.watchdog.uuid))
+            return None
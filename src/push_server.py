@@ -1,106 +1,409 @@
-from flask import Flask, request, send_file
+from flask import Flask, Response, jsonify, request
+from aiohttp import web
 from utils import get_logger, is_valid_uuid4
 from configuration import Configuration
-from threading import Thread
+from threading import Event, Thread
+import asyncio
+import hmac
+import math
 import time
 from waitress import serve
 from database import Db
 from bot import MainBot
+from heartbeats import HeartbeatBuffer
+from status_cache import StatusCache
+from deadlines import DeadlineTracker
+from uptime import UptimeRecorder
+from metrics import REGISTRY, Counter
+from instrumentation import Tracer
 import os
 
 logger = get_logger()
 
-NO_CACHE_HEADERS = {"Cache-Control": "no-cache, no-store, must-revalidate", "Pragma": "no-cache", "Expires": "0"}
+# clients may store responses but must revalidate them (with ETags) every time
+NO_CACHE_HEADERS = {"Cache-Control": "no-cache, must-revalidate", "Pragma": "no-cache", "Expires": "0"}
+
+
+def _load_badge(filename):
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(current_dir, "static", filename), "rb") as f:
+        return f.read()
+
+
+BADGES = {True: _load_badge("online.svg"), False: _load_badge("offline.svg")}
+
+# /history/<uuid>?hours=24&points=200
+HISTORY_DEFAULT_HOURS = 24
+HISTORY_MAX_HOURS = 30 * 24
+HISTORY_DEFAULT_POINTS = 200
+HISTORY_MAX_POINTS = 1000
+HISTORY_MIN_BUCKET = 60  # seconds
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+UPDATE_REQUESTS = Counter(
+    "hostpingbot_update_requests_total",
+    "/update requests by response status",
+    labels=["status"],
+)
+
+
+@web.middleware
+async def _page_not_found_async(request: web.Request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPNotFound:
+        return web.Response(
+            text="This page does not exist {}".format(request.url), status=404
+        )
+
 
 class PushServer:
-    def __init__(self, db: Db, bot: MainBot, check_interval=10):
+    def __init__(
+        self,
+        db: Db,
+        bot: MainBot,
+        uptime: UptimeRecorder = None,
+        check_interval=10,
+        metrics_token=None,
+    ):
         self.__db = db
         self.__bot = bot
-        self.__check_interval = check_interval
+        self.__check_interval = check_interval  # longest wait between two checks
+        self.__metrics_token = metrics_token  # /metrics is disabled without it
+        self.__heartbeats = HeartbeatBuffer(db, uptime=uptime)
+        self.__statuses = StatusCache(db)
+        self.__deadlines = DeadlineTracker()
+        self.__tracer = Tracer("push_server")
+
+        db.add_created_hook(self.__on_created)
+        db.add_deleted_hook(self.__deadlines.remove)
 
         self.__app = Flask(__name__)
         self.__app.add_url_rule("/status/<uuid>", "status", self.status)
         self.__app.add_url_rule("/badge/<uuid>", "badge", self.badge, )
+        self.__app.add_url_rule("/history/<uuid>", "history", self.history)
         self.__app.add_url_rule(
             "/update/<uuid>", "update", self.update, methods=["POST"]
         )
+        if metrics_token:
+            self.__app.add_url_rule("/metrics", "metrics", self.metrics)
         self.__app.register_error_handler(404, self.page_not_found)
 
+    @property
+    def app(self):
+        """
+        Flask app of the routes, served by waitress (start_async serves
+        the same routes with aiohttp)
+        """
+        return self.__app
+
+    def add_span_hook(self, hook):
+        """
+        hook(span) receives the timing of every stage of the deadline checks
+        (see instrumentation.Tracer)
+        """
+        self.__tracer.add_span_hook(hook)
+
     def page_not_found(self, error):
         return "This page does not exist {}".format(request.url), 404
 
     def status(self, uuid):
         logger.debug(f"GET /status/{uuid}")
-        
-        if not is_valid_uuid4(uuid):
+
+        w = self.__get_status(uuid)
+        if not w:
             return "Bad id", 400
 
-        w = self.__db.get_watchdog(uuid)
+        response = jsonify(self.__status_result(uuid, w))
+        response.headers.update(NO_CACHE_HEADERS)
+        response.set_etag(self.__status_etag(w))
+        return response.make_conditional(request)
+
+    def badge(self, uuid):
+        logger.debug(f"GET /badge/{uuid}")
+
+        w = self.__get_status(uuid)
         if not w:
             return "Bad id", 400
 
-        result = {
+        response = Response(
+            BADGES[w.online], mimetype="image/svg+xml", headers=NO_CACHE_HEADERS
+        )
+        response.set_etag(self.__badge_etag(w))
+        return response.make_conditional(request)
+
+    def history(self, uuid):
+        logger.debug(f"GET /history/{uuid}")
+
+        result, status = self.__history(
+            uuid, request.args.get("hours"), request.args.get("points")
+        )
+        if status != 200:
+            return result, status
+
+        return jsonify(result)
+
+    def update(self, uuid):
+        logger.debug(f"POST /update/{uuid}")
+
+        if request.headers.getlist("X-Forwarded-For"):
+            remote_address = request.headers.getlist("X-Forwarded-For")[0]
+        else:
+            remote_address = request.remote_addr
+
+        return self.__heartbeat(uuid, remote_address)
+
+    def metrics(self):
+        if not self.__is_metrics_client(request.headers.get("Authorization")):
+            return Response("Unauthorized", 401, {"WWW-Authenticate": "Bearer"})
+
+        return Response(REGISTRY.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    async def __status_async(self, request: web.Request):
+        uuid = request.match_info["uuid"]
+        logger.debug(f"GET /status/{uuid}")
+
+        w = await self.__run_blocking(self.__get_status, uuid)
+        if not w:
+            return web.Response(text="Bad id", status=400)
+
+        return self.__conditional_response_async(
+            request,
+            web.json_response(self.__status_result(uuid, w), headers=NO_CACHE_HEADERS),
+            self.__status_etag(w),
+        )
+
+    async def __badge_async(self, request: web.Request):
+        uuid = request.match_info["uuid"]
+        logger.debug(f"GET /badge/{uuid}")
+
+        w = await self.__run_blocking(self.__get_status, uuid)
+        if not w:
+            return web.Response(text="Bad id", status=400)
+
+        return self.__conditional_response_async(
+            request,
+            web.Response(
+                body=BADGES[w.online],
+                content_type="image/svg+xml",
+                headers=NO_CACHE_HEADERS,
+            ),
+            self.__badge_etag(w),
+        )
+
+    async def __history_async(self, request: web.Request):
+        uuid = request.match_info["uuid"]
+        logger.debug(f"GET /history/{uuid}")
+
+        result, status = await self.__run_blocking(
+            self.__history,
+            uuid,
+            request.query.get("hours"),
+            request.query.get("points"),
+        )
+        if status != 200:
+            return web.Response(text=result, status=status)
+
+        return web.json_response(result)
+
+    async def __update_async(self, request: web.Request):
+        uuid = request.match_info["uuid"]
+        logger.debug(f"POST /update/{uuid}")
+
+        if request.headers.getall("X-Forwarded-For", []):
+            remote_address = request.headers.getall("X-Forwarded-For")[0]
+        else:
+            remote_address = request.remote
+
+        body, status = await self.__run_blocking(self.__heartbeat, uuid, remote_address)
+        return web.Response(text=body, status=status)
+
+    async def __metrics_async(self, request: web.Request):
+        if not self.__is_metrics_client(request.headers.get("Authorization")):
+            return web.Response(
+                text="Unauthorized", status=401, headers={"WWW-Authenticate": "Bearer"}
+            )
+
+        return web.Response(
+            body=REGISTRY.render().encode(),
+            headers={"Content-Type": METRICS_CONTENT_TYPE},
+        )
+
+    def __is_metrics_client(self, authorization):
+        return hmac.compare_digest(
+            (authorization or "").encode(), f"Bearer {self.__metrics_token}".encode()
+        )
+
+    def __conditional_response_async(self, request: web.Request, response, etag):
+        """
+        Answer 304 if the client already has this representation (If-None-Match)
+        """
+        response.etag = etag
+
+        if request.if_none_match and any(
+            t.value in (etag, "*") for t in request.if_none_match
+        ):
+            not_modified = web.Response(status=304, headers=NO_CACHE_HEADERS)
+            not_modified.etag = etag
+            return not_modified
+
+        return response
+
+    async def __run_blocking(self, function, *args):
+        """
+        Cache misses and notifications may hit the db, keep them off the loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def __get_status(self, uuid):
+        if not is_valid_uuid4(uuid):
+            return None
+
+        return self.__statuses.get(uuid)
+
+    def __status_result(self, uuid, w):
+        return {
             "id": uuid,
             "name": w.name,
-            "last_online": int(w.last_update.timestamp()),
-            "online": not w.is_offline
+            "last_online": w.last_online,
+            "online": w.online,
+            "uptime": w.uptime,
         }
 
-        return result, 200, NO_CACHE_HEADERS
+    def __status_etag(self, w):
+        return "-".join(
+            [str(w.last_online), str(int(w.online))]
+            + [str(p) for p in w.uptime.values()]
+        )
 
-    def badge(self, uuid):
-        logger.debug(f"GET /badge/{uuid}")
+    def __badge_etag(self, w):
+        return "online" if w.online else "offline"
 
-        if not is_valid_uuid4(uuid):
+    def __history(self, uuid, hours, points):
+        """
+        Returns (result, status code) of the /history response, the samples
+        of the last hours are averaged down to at most points values
+        """
+        w = self.__get_status(uuid)
+        if not w or w.is_push:
             return "Bad id", 400
 
-        w = self.__db.get_watchdog(uuid)
-        if not w:
-            return "Bad id", 400
+        try:
+            hours = float(hours or HISTORY_DEFAULT_HOURS)
+            points = int(points or HISTORY_DEFAULT_POINTS)
+        except ValueError:
+            return "Bad parameters", 400
 
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        filename = "offline.svg" if w.is_offline else "online.svg"
-        filename = os.path.join(current_dir, "static", filename)
+        if not math.isfinite(hours) or hours <= 0 or points <= 0:  # nan, inf
+            return "Bad parameters", 400
 
-        return send_file(filename, mimetype="image/svg+xml"), NO_CACHE_HEADERS
+        hours = min(hours, HISTORY_MAX_HOURS)
+        points = min(points, HISTORY_MAX_POINTS)
 
-    def update(self, uuid):
-        logger.debug(f"POST /update/{uuid}")
+        bucket = max(HISTORY_MIN_BUCKET, int(hours * 3600 / points))
+        samples = self.__db.get_ping_history(uuid, time.time() - hours * 3600, bucket)
 
+        return {
+            "id": uuid,
+            "name": w.name,
+            "bucket": bucket,
+            "samples": [
+                {"time": t, "rtt": rtt, "loss": loss} for t, rtt, loss in samples
+            ],
+        }, 200
+
+    def __heartbeat(self, uuid, remote_address):
+        """
+        Returns (body, status code) of the /update response
+        """
+        body, status = self.__process_heartbeat(uuid, remote_address)
+        UPDATE_REQUESTS.inc(status=status)
+        return body, status
+
+    def __process_heartbeat(self, uuid, remote_address):
         if not is_valid_uuid4(uuid):
             return "Bad id", 400
 
-        w = self.__db.get_watchdog(uuid)
+        # written to the db by the next flush
+        w, last_update = self.__heartbeats.heartbeat(uuid, remote_address)
         if not w:
             return "Bad id", 400
 
         if not w.is_push:
             return "Bad id (not push)", 400
 
-        if w.is_offline:  # host became online
-            self.__bot.notify_online_host(w, last_update=w.last_update)
+        self.__deadlines.set(w.uuid, time.time() + w.check_interval)
 
-        if request.headers.getlist("X-Forwarded-For"):
-            remote_address = request.headers.getlist("X-Forwarded-For")[0]
-        else:
-            remote_address = request.remote_addr
-        self.__db.set_watchdog_online(uuid, remote_address=remote_address)
+        if last_update is not None:  # host became online
+            self.__bot.notify_online_host(w, last_update=last_update)
+
+        return "OK", 200
 
-        return "OK"
+    def __on_created(self, watchdog):
+        if watchdog.is_push:
+            self.__deadlines.set(watchdog.uuid, watchdog.deadline.timestamp())
 
     def __check_updates(self):
-        logger.debug("Running check")
-        hosts = self.__db.get_new_offline_hosts()
-        self.__bot.notify_offline_hosts(hosts)
-        self.__db.set_watchdogs_offline(hosts)
+        self.__heartbeats.record_downtime()
+
+        expired = self.__deadlines.pop_expired(time.time())
+        if len(expired) == 0:
+            return
+
+        logger.debug(f"{len(expired)} deadlines expired")
+
+        with self.__tracer.span("check_updates", expired=len(expired)):
+            # the db must have the buffered heartbeats before checking the deadlines
+            with self.__tracer.span("flush_heartbeats"):
+                self.__heartbeats.flush()
+
+            # skip the hosts that sent a heartbeat in the meantime
+            expired = [uuid for uuid in expired if not self.__deadlines.has(uuid)]
+
+            with self.__tracer.span("transition_offline", hosts=len(expired)):
+                hosts = self.__db.transition_expired_push_watchdogs(expired)
+            with self.__tracer.span("set_offline", hosts=len(hosts)):
+                hosts = self.__heartbeats.set_offline(hosts)
+            with self.__tracer.span("notify_offline", hosts=len(hosts)):
+                self.__bot.notify_offline_hosts(hosts)
+
+    def __seconds_to_next_check(self):
+        seconds = self.__deadlines.seconds_to_next(time.time())
+        if seconds is None:
+            return self.__check_interval
+
+        return min(seconds, self.__check_interval)
 
     def __schedule_check(self):
-        logger.debug(f"Scheduled check every {self.__check_interval} seconds")
+        logger.debug("Scheduled check on deadlines")
+        wakeup = Event()
+        self.__deadlines.add_wakeup_hook(wakeup.set)
 
         while True:
             try:
+                wakeup.wait(self.__seconds_to_next_check())
+                wakeup.clear()
                 self.__check_updates()
-                time.sleep(self.__check_interval)
+            except Exception as e:
+                logger.error("Error checking push server updates")
+                logger.error(e)
+                os._exit(1)
+
+    async def __schedule_check_async(self):
+        logger.debug("Scheduled async check on deadlines")
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.__deadlines.add_wakeup_hook(lambda: loop.call_soon_threadsafe(wakeup.set))
+
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.__seconds_to_next_check())
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                await self.__run_blocking(self.__check_updates)
             except Exception as e:
                 logger.error("Error checking push server updates")
                 logger.error(e)
@@ -115,7 +418,40 @@ class PushServer:
             logger.error(e)
             os._exit(1)
 
+    async def __start_server_async(self):
+        try:
+            logger.info("Starting (async)")
+            app = web.Application(middlewares=[_page_not_found_async])
+            app.router.add_get("/status/{uuid}", self.__status_async)
+            app.router.add_get("/badge/{uuid}", self.__badge_async)
+            app.router.add_get("/history/{uuid}", self.__history_async)
+            app.router.add_post("/update/{uuid}", self.__update_async)
+            if self.__metrics_token:
+                app.router.add_get("/metrics", self.__metrics_async)
+
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(
+                runner, host="0.0.0.0", port=Configuration.PUSH_SERVER_PORT
+            ).start()
+        except Exception as e:
+            logger.error(f"Error starting push server: {e}")
+            logger.error(e)
+            os._exit(1)
+
     def start(self):
+        self.__deadlines.load(self.__db.get_push_deadlines())
+        self.__heartbeats.start()
         Thread(target=self.__start_server, daemon=True).start()
         Thread(target=self.__schedule_check, daemon=True).start()
         return self
+
+    def start_async(self):
+        """
+        Serve the same routes with aiohttp on the bot loop instead of waitress
+        """
+        self.__deadlines.load(self.__db.get_push_deadlines())
+        self.__heartbeats.start()
+        self.__bot.add_background_task(self.__start_server_async)
+        self.__bot.add_background_task(self.__schedule_check_async)
+        return self
@@ -0,0 +1,145 @@
+from datetime import datetime
+from threading import Lock
+import time
+from utils import get_logger
+from database import Db, Watchdog
+
+logger = get_logger()
+
+# what an edit of a watchdog can change, its status is tracked in memory
+EDITABLE_FIELDS = ("name", "address", "is_enabled", "check_interval", "chat_id")
+
+
+class WatchdogRegistry:
+    """
+    Long-lived in-memory copy of the enabled ping watchdogs.
+    It's loaded once, then kept up to date with:
+    - the db hooks for watchdogs created or deleted by this process
+    - a poll of the rows changed since the last seen updated_at (high-water mark)
+    - a periodic reconcile of the uuids, for deletions made by other processes
+    """
+
+    def __init__(self, db: Db, poll_interval=10, reconcile_interval=120):
+        self.__db = db
+        self.__poll_interval = poll_interval
+        self.__reconcile_interval = reconcile_interval
+        self.__watchdogs = {}  # uuid -> Watchdog
+        self.__high_water_mark = None
+        self.__last_poll = None
+        self.__last_reconcile = None
+        self.__added_hooks = []
+        self.__removed_hooks = []
+        self.__lock = Lock()
+
+        db.add_created_hook(self.__on_created)
+        db.add_deleted_hook(self.__remove)
+
+    def add_added_hook(self, hook):
+        """
+        hook(watchdog) is called when a watchdog enters the registry
+        """
+        self.__added_hooks.append(hook)
+
+    def add_removed_hook(self, hook):
+        """
+        hook(uuid) is called when a watchdog leaves the registry
+        """
+        self.__removed_hooks.append(hook)
+
+    def get(self, uuid) -> Watchdog:
+        return self.__watchdogs.get(uuid)
+
+    def all(self) -> list[Watchdog]:
+        with self.__lock:
+            return list(self.__watchdogs.values())
+
+    def refresh(self):
+        """
+        Load the registry the first time, then apply the changes if a poll is due
+        """
+        now = time.monotonic()
+
+        if self.__last_poll is None:
+            self.__load()
+            self.__last_poll = self.__last_reconcile = now
+            return
+
+        if now - self.__last_poll >= self.__poll_interval:
+            self.__poll()
+            self.__last_poll = now
+
+        if now - self.__last_reconcile >= self.__reconcile_interval:
+            self.__reconcile()
+            self.__last_reconcile = now
+
+    def __load(self):
+        loaded_at = datetime.now()
+        watchdogs = self.__db.get_hosts_to_ping()
+
+        for w in watchdogs:
+            self.__put(w)
+
+        if self.__high_water_mark is None:  # empty table
+            self.__high_water_mark = loaded_at
+
+        logger.debug(f"Loaded {len(watchdogs)} watchdogs")
+
+    def __poll(self):
+        changed = self.__db.get_hosts_to_ping_changed_since(self.__high_water_mark)
+
+        for w in changed:
+            if w.is_enabled:
+                self.__put(w)
+            else:
+                self.__remove(w.uuid)
+
+    def __reconcile(self):
+        uuids = set(self.__db.get_hosts_to_ping_uuids())
+
+        with self.__lock:
+            known = set(self.__watchdogs.keys())
+
+        for uuid in known - uuids:
+            self.__remove(uuid)
+
+        missing = uuids - known
+        if len(missing) != 0:
+            for w in self.__db.get_watchdogs(missing):
+                self.__put(w)
+
+        logger.debug(f"Reconciled, {len(known - uuids)} removed, {len(missing)} added")
+
+    def __on_created(self, watchdog):
+        if not watchdog.is_push and watchdog.is_enabled:
+            self.__put(watchdog)
+
+    def __put(self, watchdog):
+        with self.__lock:
+            existing = self.__watchdogs.get(watchdog.uuid)
+            if existing is not None and self.__is_unchanged(existing, watchdog):
+                return  # keep the status tracked in memory
+
+            self.__watchdogs[watchdog.uuid] = watchdog
+
+            if self.__high_water_mark is None or watchdog.updated_at > self.__high_water_mark:
+                self.__high_water_mark = watchdog.updated_at
+
+        for hook in self.__added_hooks:
+            hook(watchdog)
+
+    def __is_unchanged(self, existing, watchdog):
+        """
+        The poll returns again the rows updated at the high-water mark, compare
+        their fields too as two edits may share the same updated_at
+        """
+        return existing.updated_at == watchdog.updated_at and all(
+            getattr(existing, f) == getattr(watchdog, f) for f in EDITABLE_FIELDS
+        )
+
+    def __remove(self, uuid):
+        with self.__lock:
+            if self.__watchdogs.pop(uuid, None) is None:
+                return
+
+        for hook in self.__removed_hooks:
+            hook(uuid)
@@ -0,0 +1,135 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import ip_address
+from threading import Lock
+import time
+from metrics import Counter
+from utils import (
+    get_logger,
+    resolve_public_address,
+    async_resolve_public_address,
+)
+
+logger = get_logger()
+
+DNS_FAILURES = Counter(
+    "hostpingbot_dns_failures_total",
+    "Hostname lookups that didn't give a public ip (cached failures aren't counted)",
+)
+
+
+class Resolver:
+    """
+    Resolves batches of hostnames concurrently and caches the results.
+    Failed lookups are cached too (for a shorter time) so that a broken
+    hostname doesn't cost a DNS round-trip on every ping cycle
+    """
+
+    def __init__(self, ttl=300, negative_ttl=60, max_workers=32):
+        self.__max_workers = max_workers
+        self.__ttl = ttl
+        self.__negative_ttl = negative_ttl
+        self.__cache = {}  # hostname -> (ip or None, expiration time)
+        self.__lock = Lock()
+        self.__last_eviction = time.monotonic()
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="resolver"
+        )
+
+    def resolve_all(self, addresses, retry_failures=False):
+        """
+        Returns a dict address -> ip, where ip is None for the addresses
+        that can't be pinged (unresolvable hostnames or private ips).
+        With retry_failures the cached failed lookups are done again
+        """
+        now = time.monotonic()
+        resolved, to_resolve = self.__lookup_cache(addresses, now, retry_failures)
+
+        if len(to_resolve) != 0:
+            logger.debug(f"Resolving {len(to_resolve)} hostnames")
+            ips = list(self.__executor.map(resolve_public_address, to_resolve))
+            self.__store(to_resolve, ips, resolved, now)
+
+        self.__evict_expired(now)
+
+        return resolved
+
+    async def resolve_all_async(self, addresses, retry_failures=False):
+        """
+        Same as resolve_all but non-blocking, lookups run on the current event loop
+        """
+        now = time.monotonic()
+        resolved, to_resolve = self.__lookup_cache(addresses, now, retry_failures)
+
+        if len(to_resolve) != 0:
+            logger.debug(f"Resolving {len(to_resolve)} hostnames")
+            semaphore = asyncio.Semaphore(self.__max_workers)
+
+            async def lookup(hostname):
+                async with semaphore:
+                    return await async_resolve_public_address(hostname)
+
+            ips = await asyncio.gather(*[lookup(h) for h in to_resolve])
+            self.__store(to_resolve, ips, resolved, now)
+
+        self.__evict_expired(now)
+
+        return resolved
+
+    def __lookup_cache(self, addresses, now, retry_failures):
+        """
+        Returns the addresses already known (ips and cached hostnames)
+        and the hostnames that still need to be resolved
+        """
+        resolved = {}
+        to_resolve = []
+
+        with self.__lock:
+            for address in set(addresses):
+                ip = self.__parse_ip(address)
+                if ip is not False:  # it's an ip address
+                    resolved[address] = ip
+                    continue
+
+                cached = self.__cache.get(address)
+                if (
+                    cached is not None
+                    and cached[1] > now
+                    and (cached[0] is not None or not retry_failures)
+                ):
+                    resolved[address] = cached[0]
+                else:
+                    to_resolve.append(address)
+
+        return resolved, to_resolve
+
+    def __store(self, hostnames, ips, resolved, now):
+        with self.__lock:
+            for hostname, ip in zip(hostnames, ips):
+                if ip is None:
+                    DNS_FAILURES.inc()
+                ttl = self.__ttl if ip is not None else self.__negative_ttl
+                self.__cache[hostname] = (ip, now + ttl)
+                resolved[hostname] = ip
+
+    def __parse_ip(self, address):
+        """
+        Returns the address itself if it's a public ip, None if it's a private ip
+        and False if it's not an ip address at all
+        """
+        try:
+            ip = ip_address(address)
+        except ValueError:
+            return False
+        return None if ip.is_private else address
+
+    def __evict_expired(self, now):
+        """
+        Drop expired entries, at most once every negative_ttl seconds
+        """
+        if now - self.__last_eviction < self.__negative_ttl:
+            return
+
+        with self.__lock:
+            self.__cache = {h: e for h, e in self.__cache.items() if e[1] > now}
+            self.__last_eviction = now
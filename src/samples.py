@@ -0,0 +1,101 @@
+from threading import Lock, Thread
+import time
+from utils import get_logger
+from database import Db
+
+logger = get_logger()
+
+
+class SampleWriter:
+    """
+    Buffer of ping samples (latency and packet loss), written to the db with
+    multi-row inserts every flush_interval seconds.
+    Also keeps the daily partitions of the samples table: the next days are
+    created ahead and the ones older than retention_days are dropped
+    """
+
+    def __init__(
+        self,
+        db: Db,
+        retention_days=30,
+        flush_interval=5,
+        max_pending=100000,
+        maintenance_interval=3600,
+    ):
+        self.__db = db
+        self.__retention_days = retention_days
+        self.__flush_interval = flush_interval
+        self.__max_pending = max_pending
+        self.__maintenance_interval = maintenance_interval
+        self.__pending = []  # (uuid, epoch seconds, rtt in ms or None, loss 0-1)
+        self.__dropped = 0
+        self.__lock = Lock()
+        self.__flush_lock = Lock()
+
+    def add(self, uuid, host, timestamp=None):
+        """
+        Record the result of a ping (icmplib Host) of a watchdog
+        """
+        sample = (
+            uuid,
+            int(timestamp or time.time()),
+            host.avg_rtt if host.is_alive else None,
+            host.packet_loss,
+        )
+
+        with self.__lock:
+            if len(self.__pending) >= self.__max_pending:
+                self.__dropped += 1  # the db is behind, keep memory bounded
+                return
+
+            self.__pending.append(sample)
+
+    def flush(self):
+        with self.__flush_lock:
+            with self.__lock:
+                pending, self.__pending = self.__pending, []
+                dropped, self.__dropped = self.__dropped, 0
+
+            if dropped != 0:
+                logger.warning(f"Dropped {dropped} ping samples")
+
+            if len(pending) == 0:
+                return
+
+            try:
+                self.__db.add_ping_samples(pending)
+                logger.debug(f"Flushed {len(pending)} ping samples")
+            except Exception:
+                # put them back before the ones added meanwhile,
+                # the oldest are dropped beyond max_pending
+                with self.__lock:
+                    self.__pending = pending + self.__pending
+                    overflow = len(self.__pending) - self.__max_pending
+                    if overflow > 0:
+                        del self.__pending[:overflow]
+                        self.__dropped += overflow
+                raise
+
+    def maintain(self):
+        self.__db.create_ping_sample_partitions()
+        self.__db.drop_ping_sample_partitions(self.__retention_days)
+
+    def __schedule_flush(self):
+        logger.debug(f"Scheduled samples flush every {self.__flush_interval} seconds")
+        last_maintenance = 0
+
+        while True:
+            try:
+                if time.monotonic() - last_maintenance >= self.__maintenance_interval:
+                    last_maintenance = time.monotonic()
+                    self.maintain()
+
+                time.sleep(self.__flush_interval)
+                self.flush()
+            except Exception as e:
+                logger.error("Error writing ping samples")
+                logger.error(e)
+
+    def start(self):
+        Thread(target=self.__schedule_flush, daemon=True).start()
+        return self
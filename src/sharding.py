@@ -0,0 +1,100 @@
+from bisect import bisect
+import hashlib
+import os
+import socket
+from threading import Event, Lock, Thread
+from utils import get_logger
+from database import Db
+
+logger = get_logger()
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring, each node is placed `replicas` times on the ring
+    so that keys move only from/to the node that joined or left
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.__ring = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self.__hashes = [h for h, _ in self.__ring]
+
+    def owner(self, key):
+        if len(self.__ring) == 0:
+            return None
+
+        i = bisect(self.__hashes, _hash(key)) % len(self.__ring)
+        return self.__ring[i][1]
+
+
+class ShardCoordinator:
+    """
+    Keeps a lease in the db for this worker and tracks the other live workers.
+    Every watchdog is owned by exactly one live worker (by consistent hashing of its uuid),
+    partitions are rebalanced when a worker joins or its lease expires
+    """
+
+    def __init__(self, db: Db, worker_id=None, lease_ttl=30, renew_interval=10):
+        self.__db = db
+        self.__worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.__lease_ttl = lease_ttl
+        self.__renew_interval = renew_interval
+        self.__workers = []
+        self.__ring = HashRing([])
+        self.__version = 0  # bumped every time the partitions change
+        self.__lock = Lock()
+        self.__stopped = Event()
+        self.__thread = None
+
+    @property
+    def worker_id(self):
+        return self.__worker_id
+
+    @property
+    def version(self):
+        return self.__version
+
+    def owns(self, uuid):
+        with self.__lock:
+            return self.__ring.owner(uuid) == self.__worker_id
+
+    def __renew(self):
+        self.__db.renew_pinger_lease(self.__worker_id, self.__lease_ttl)
+        workers = self.__db.get_live_pinger_workers(self.__lease_ttl)
+
+        if workers != self.__workers:
+            logger.info(f"Pinger workers changed: {workers}")
+            with self.__lock:
+                self.__workers = workers
+                self.__ring = HashRing(workers)
+                self.__version += 1
+
+    def __schedule_renew(self):
+        logger.debug(f"Scheduled lease renew every {self.__renew_interval} seconds")
+
+        while not self.__stopped.wait(self.__renew_interval):
+            try:
+                self.__renew()
+            except Exception as e:
+                # keep going, if the lease expires the other workers take over
+                logger.error("Error renewing pinger lease")
+                logger.error(e)
+
+    def start(self):
+        logger.info(f"Started as {self.__worker_id}")
+        self.__renew()  # own a partition before the first ping
+        self.__thread = Thread(target=self.__schedule_renew, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()  # a renew in progress would take the lease back
+        self.__db.release_pinger_lease(self.__worker_id)
@@ -0,0 +1,88 @@
+from collections import namedtuple
+from threading import Thread
+import time
+from utils import get_logger
+from database import Db
+
+logger = get_logger()
+
+StatsSnapshot = namedtuple(
+    "StatsSnapshot",
+    [
+        "users",
+        "watchdogs",
+        "ping_watchdogs",
+        "push_watchdogs",
+        "offline_watchdogs",
+        "counted_seconds_ago",
+        "last_ping_cycle_seconds",
+        "last_ping_cycle_hosts",
+        "notification_backlog",
+        "notifications_sent",
+    ],
+)
+
+
+class StatsCollector:
+    """
+    Admin stats. The watchdog counts come from one aggregate query refreshed
+    in the background every refresh_interval seconds, the operational figures
+    are read from the pinger and the notifier when a snapshot is taken
+    """
+
+    def __init__(self, db: Db, refresh_interval=60):
+        self.__db = db
+        self.__refresh_interval = refresh_interval
+        self.__counts = None  # latest Db.get_stats()
+        self.__counted_at = None
+        self.__pinger = None
+        self.__bot = None
+
+    def watch_pinger(self, pinger):
+        self.__pinger = pinger
+
+    def watch_bot(self, bot):
+        self.__bot = bot
+
+    def snapshot(self) -> StatsSnapshot:
+        counts = self.__counts or {}
+        last_cycle = self.__pinger.last_cycle if self.__pinger else (None, None)
+        backlog = sent = None
+        if self.__bot is not None:
+            backlog = self.__bot.notifier.queue_depth + self.__bot.bridge.pending
+            sent = self.__bot.notifier.sent
+
+        return StatsSnapshot(
+            users=counts.get("users"),
+            watchdogs=counts.get("watchdogs"),
+            ping_watchdogs=counts.get("ping_watchdogs"),
+            push_watchdogs=counts.get("push_watchdogs"),
+            offline_watchdogs=counts.get("offline_watchdogs"),
+            counted_seconds_ago=None
+            if self.__counted_at is None
+            else int(time.monotonic() - self.__counted_at),
+            last_ping_cycle_seconds=last_cycle[0],
+            last_ping_cycle_hosts=last_cycle[1],
+            notification_backlog=backlog,
+            notifications_sent=sent,
+        )
+
+    def refresh(self):
+        self.__counts = self.__db.get_stats()
+        self.__counted_at = time.monotonic()
+
+    def __schedule_refresh(self):
+        logger.debug(f"Scheduled stats refresh every {self.__refresh_interval} seconds")
+
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Error refreshing stats")
+                logger.error(e)
+
+            time.sleep(self.__refresh_interval)
+
+    def start(self):
+        Thread(target=self.__schedule_refresh, daemon=True).start()
+        return self
@@ -0,0 +1,82 @@
+from collections import namedtuple
+from threading import Lock
+import time
+from uuid import UUID
+from utils import get_logger
+from database import Db
+
+logger = get_logger()
+
+WatchdogStatus = namedtuple(
+    "WatchdogStatus", ["uuid", "name", "is_push", "last_online", "online", "uptime"]
+)
+
+
+class StatusCache:
+    """
+    Read-through cache of the watchdogs status served by /status and /badge.
+    Entries are invalidated by the db hooks on every status change made in this
+    process, the ttl bounds staleness for changes made by other processes
+    """
+
+    def __init__(self, db: Db, ttl=10, max_size=100000):
+        self.__db = db
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.__entries = {}  # uuid -> (WatchdogStatus, expiration time)
+        self.__loading = {}  # uuid -> token of the last read, dropped on invalidation
+        self.__lock = Lock()
+
+        db.add_status_hook(self.invalidate)
+        db.add_deleted_hook(self.invalidate)
+
+    def get(self, uuid) -> WatchdogStatus:
+        """
+        Returns the status of the watchdog, None if it doesn't exist
+        """
+        uuid = UUID(str(uuid))
+        now = time.monotonic()
+
+        entry = self.__entries.get(uuid)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        token = object()
+        with self.__lock:
+            self.__loading[uuid] = token
+
+        status = None
+        try:
+            status = self.__load(uuid)
+        finally:
+            with self.__lock:
+                # don't store what was read before an invalidation of this watchdog
+                if self.__loading.get(uuid) is token:
+                    del self.__loading[uuid]
+
+                    if status is not None:
+                        if len(self.__entries) >= self.__max_size:
+                            self.__entries.clear()
+                        self.__entries[uuid] = (status, now + self.__ttl)
+
+        return status
+
+    def invalidate(self, uuid):
+        uuid = UUID(str(uuid))
+        with self.__lock:
+            self.__entries.pop(uuid, None)
+            self.__loading.pop(uuid, None)
+
+    def __load(self, uuid):
+        w = self.__db.get_watchdog(uuid)
+        if w is None:
+            return None
+
+        return WatchdogStatus(
+            uuid=uuid,
+            name=w.name,
+            is_push=w.is_push,
+            last_online=int(w.last_update.timestamp()),
+            online=not w.is_offline,
+            uptime=self.__db.get_uptime([uuid])[uuid],
+        )
@@ -1,3 +1,7 @@
+def _or_dash(value):
+    return "-" if value is None else value
+
+
 class Strings:
     # Miscellanous
     WELCOME_MESSAGE = (
@@ -6,6 +10,18 @@ class Strings:
     CANCEL = "❌ Cancel"
     CANCELLED = "❌ Cancelled"
     STATS = "📊 Stats"
+    STATS_MESSAGE = lambda s: (
+        f"Users: {_or_dash(s.users)}\n"
+        f"Watchdogs: {_or_dash(s.watchdogs)}\n"
+        f"Ping watchdogs: {_or_dash(s.ping_watchdogs)}\n"
+        f"Push watchdogs: {_or_dash(s.push_watchdogs)}\n"
+        f"Offline watchdogs: {_or_dash(s.offline_watchdogs)}\n"
+        f"<i>(counted {_or_dash(s.counted_seconds_ago)}s ago)</i>\n\n"
+        f"Last ping cycle: {_or_dash(s.last_ping_cycle_hosts)} hosts in "
+        f"{'-' if s.last_ping_cycle_seconds is None else round(s.last_ping_cycle_seconds, 2)}s\n"
+        f"Notifications backlog: {_or_dash(s.notification_backlog)}\n"
+        f"Notifications sent: {_or_dash(s.notifications_sent)}"
+    )
 
     # Creation
     NEW_WATCHDOG = "➕ New watchdog"
@@ -37,10 +53,17 @@ class Strings:
     LIST_WATCHDOGS_PING_HEADER = "🔶 <b>Polling (PING)</b>\n\n"
     LIST_WATCHDOGS_PUSH_HEADER = "🔶 <b>Push (HTTP)</b>\n\n"
     LIST_WATCHDOGS_PING_ITEM = (
-        lambda name, addr, status_url, badge_url, status, last_update: f"<b>[{'🟢' if status else '🔴'}] {name}</b>\n\t\t<code>{addr}</code>\n\t\t<a href='{status_url}'>Status API</a>\t|\t<a href='{badge_url}'>Badge API</a>\n\t\tLast online: <i>{last_update} ago</i>\n\n"
+        lambda name, addr, status_url, badge_url, status, last_update, uptime: f"<b>[{'🟢' if status else '🔴'}] {name}</b>\n\t\t<code>{addr}</code>\n\t\t<a href='{status_url}'>Status API</a>\t|\t<a href='{badge_url}'>Badge API</a>\n\t\tLast online: <i>{last_update} ago</i>\n\t\t{uptime}\n\n"
     )
     LIST_WATCHDOGS_PUSH_ITEM = (
-        lambda name, push_url, status_url, badge_url, status, last_update, last_update_ip: f"<b>[{'🟢' if status else '🔴'}] {name}</b>\n\t\t<a href='{push_url}'>Push API</a>\n\t\t<a href='{status_url}'>Status API</a>\t|\t<a href='{badge_url}'>Badge API</a>\n\t\tLast online: <i>{last_update} ago</i>\n\t\tLast update ip: <i>{last_update_ip}</i>\n\n"
+        lambda name, push_url, status_url, badge_url, status, last_update, last_update_ip, uptime: f"<b>[{'🟢' if status else '🔴'}] {name}</b>\n\t\t<a href='{push_url}'>Push API</a>\n\t\t<a href='{status_url}'>Status API</a>\t|\t<a href='{badge_url}'>Badge API</a>\n\t\tLast online: <i>{last_update} ago</i>\n\t\tLast update ip: <i>{last_update_ip}</i>\n\t\t{uptime}\n\n"
+    )
+    LIST_WATCHDOGS_UPTIME = (
+        lambda uptime: "Uptime: "
+        + " | ".join(
+            f"{window} <i>{'-' if p is None else f'{p}%'}</i>"
+            for window, p in uptime.items()
+        )
     )
 
     # Notifications
@@ -50,6 +73,18 @@ class Strings:
         lambda name, down_for: f"<b>[🟢] {name}</b> is back ONLINE\n\nIt's been down for {down_for}"
     )
 
+    # Digests
+    DIGEST_OFFLINE_HEADER = (
+        lambda count: f"<b>[🔴] {count} watchdogs are OFFLINE right now</b>\n"
+    )
+    DIGEST_ONLINE_HEADER = (
+        lambda count: f"<b>[🟢] {count} watchdogs are back ONLINE</b>\n"
+    )
+    DIGEST_ITEM = lambda name: f"\t\t{name}\n"
+    DIGEST_ITEM_WITH_TIME = (
+        lambda name, down_for: f"\t\t{name} <i>(down for {down_for})</i>\n"
+    )
+
     # Errors
     ERROR_WATCHDOGS_LIMIT_EXCEEDED = (
         lambda limit: f"❌ You can't add more than {limit} watchdogs"
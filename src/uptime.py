@@ -0,0 +1,100 @@
+from threading import Lock, Thread
+import time
+from utils import get_logger
+from database import Db
+
+logger = get_logger()
+
+BUCKET_SECONDS = 3600
+
+
+class UptimeRecorder:
+    """
+    Accumulates the seconds each watchdog spent up and down in hourly buckets,
+    added to the db counters every flush_interval seconds. Reading the uptime
+    over 24h/7d/30d then never touches more than 720 buckets per watchdog
+    """
+
+    def __init__(self, db: Db, flush_interval=10, retention_days=30):
+        self.__db = db
+        self.__flush_interval = flush_interval
+        self.__retention_days = retention_days
+        self.__pending = {}  # (uuid, bucket) -> [up seconds, down seconds]
+        self.__lock = Lock()
+        self.__flush_lock = Lock()
+
+    def add(self, uuid, up_seconds, down_seconds, timestamp=None):
+        """
+        Record the up and down seconds of the period that ended at timestamp,
+        the period is spread over the buckets it overlaps
+        """
+        end = timestamp or time.time()
+        total = up_seconds + down_seconds
+        if total <= 0:
+            return
+
+        with self.__lock:
+            for bucket, seconds in self.__split(end - total, end):
+                counters = self.__pending.setdefault((uuid, bucket), [0, 0])
+                counters[0] += up_seconds * seconds / total
+                counters[1] += down_seconds * seconds / total
+
+    def __split(self, start, end):
+        """
+        Yields (bucket, seconds of [start, end) inside the bucket)
+        """
+        bucket = int(start) // BUCKET_SECONDS
+        while bucket * BUCKET_SECONDS < end:
+            bucket_start = bucket * BUCKET_SECONDS
+            yield bucket, min(end, bucket_start + BUCKET_SECONDS) - max(
+                start, bucket_start
+            )
+            bucket += 1
+
+    def flush(self):
+        with self.__flush_lock:
+            with self.__lock:
+                pending, self.__pending = self.__pending, {}
+
+            if len(pending) == 0:
+                return
+
+            try:
+                self.__db.add_uptime(
+                    [
+                        (uuid, bucket, round(up), round(down))
+                        for (uuid, bucket), (up, down) in pending.items()
+                    ]
+                )
+                logger.debug(f"Flushed {len(pending)} uptime buckets")
+            except Exception:
+                # put them back, merged with the ones added meanwhile
+                with self.__lock:
+                    for key, (up, down) in pending.items():
+                        counters = self.__pending.setdefault(key, [0, 0])
+                        counters[0] += up
+                        counters[1] += down
+                raise
+
+    def __schedule_flush(self):
+        logger.debug(f"Scheduled uptime flush every {self.__flush_interval} seconds")
+        last_cleanup = 0
+
+        while True:
+            time.sleep(self.__flush_interval)
+            try:
+                self.flush()
+
+                if time.monotonic() - last_cleanup >= BUCKET_SECONDS:
+                    last_cleanup = time.monotonic()
+                    self.__db.delete_uptime_before(
+                        int(time.time()) // BUCKET_SECONDS
+                        - self.__retention_days * 24
+                    )
+            except Exception as e:
+                logger.error("Error flushing uptime")
+                logger.error(e)
+
+    def start(self):
+        Thread(target=self.__schedule_flush, daemon=True).start()
+        return self
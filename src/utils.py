@@ -1,5 +1,5 @@
 from ipaddress import ip_address
-from icmplib import resolve, NameLookupError
+from icmplib import resolve, async_resolve, NameLookupError
 import logging
 from logging.handlers import RotatingFileHandler
 import os
@@ -71,12 +71,36 @@ def is_valid_uuid4(uuid_string):
     return str(uuid_obj) == uuid_string
 
 
-def dns_resolves(hostname):
+def resolve_public_address(hostname):
+    """
+    Resolves hostname and returns its first ip address,
+    or None if it doesn't resolve or resolves to a private address
+    """
     try:
-        ip = ip_address(resolve(hostname)[0])
-        return not ip.is_private  # for hostnames like localhost
-    except Exception as e:  # the returned ip is not valid
-        return False
+        return __public_ip_or_none(resolve(hostname)[0])
+    except Exception:  # the returned ip is not valid
+        return None
+
+
+async def async_resolve_public_address(hostname):
+    """
+    Same as resolve_public_address but non-blocking
+    """
+    try:
+        return __public_ip_or_none((await async_resolve(hostname))[0])
+    except Exception:  # the returned ip is not valid
+        return None
+
+
+def __public_ip_or_none(address):
+    ip = ip_address(address)
+    if ip.is_private:  # for hostnames like localhost
+        return None
+    return str(ip)
+
+
+def dns_resolves(hostname):
+    return resolve_public_address(hostname) is not None
 
 
 def is_valid_address(address):
@@ -87,6 +111,17 @@ def is_valid_address(address):
         return dns_resolves(address)  # it's a hostname
 
 
+async def async_is_valid_address(address):
+    """
+    Same as is_valid_address but non-blocking
+    """
+    try:
+        ip = ip_address(address)  # it's an ip address
+        return not ip.is_private  # private ips are not allowed
+    except ValueError:
+        return await async_resolve_public_address(address) is not None
+
+
 def time_delta_to_string(seconds):
     """
     Converts a time delta in seconds to a string of the form "Xd Yh Zm"
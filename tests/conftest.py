@@ -0,0 +1,90 @@
+"""
+The tests run against a dedicated PostgreSQL db: its tables are dropped
+before every test that uses it. tests/config.ini is read on top of the
+usual config files, point HOSTPINGBOT_CONFIG to another file to change the
+connection settings (its [Database] Name must contain "test")
+"""
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "src"))
+os.environ.setdefault("HOSTPINGBOT_CONFIG", os.path.join(TESTS_DIR, "config.ini"))
+
+from configuration import Configuration  # noqa: E402
+
+
+@pytest.fixture
+def empty_db():
+    """
+    The test db without any table, the test is skipped if it's unreachable
+    """
+    from peewee import OperationalError
+    from database import db
+
+    if "test" not in Configuration.DATABASE_NAME:
+        pytest.exit(
+            f"Refusing to drop the tables of {Configuration.DATABASE_NAME}, "
+            "use a db whose name contains 'test'"
+        )
+
+    try:
+        db.connect(reuse_if_open=True)
+    except OperationalError as e:
+        pytest.skip(f"PostgreSQL not available: {e}")
+
+    db.execute_sql("DROP SCHEMA public CASCADE")
+    db.execute_sql("CREATE SCHEMA public")
+    yield db
+    if not db.is_closed():
+        db.close()
+
+
+@pytest.fixture
+def db(empty_db):
+    """
+    Db on the test db with every migration applied
+    """
+    from database import Db
+    from migrations import run_migrations
+
+    run_migrations()
+    return Db()
+
+
+class FakeBot:
+    """
+    Records the notifications instead of sending them
+    """
+
+    def __init__(self):
+        self.online = []  # (watchdog, last_update)
+        self.offline = []
+
+    def notify_online_host(self, watchdog, last_update=None):
+        self.online.append((watchdog, last_update))
+
+    def notify_offline_hosts(self, watchdogs):
+        self.offline += watchdogs
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def alive_network(monkeypatch):
+    """
+    Every pinged address answers
+    """
+    import pinger
+    from icmplib import Host
+
+    def multiping(addresses, count=2, **kwargs):
+        return [Host(a, count, [1.0] * count) for a in addresses]
+
+    monkeypatch.setattr(pinger, "multiping", multiping)
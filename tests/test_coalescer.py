@@ -0,0 +1,98 @@
+import asyncio
+
+from notifier import NotificationCoalescer, NotificationDispatcher
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.submitted = []  # (chat_id, text, priority)
+
+    def submit(self, chat_id, text, priority=NotificationDispatcher.PRIORITY_ONLINE):
+        self.submitted.append((chat_id, text, priority))
+
+
+def coalesce(events, window=0.05, wait=0.2):
+    """
+    Add (chat_id, is_offline, name, down_for) events, returns the submitted messages
+    """
+    dispatcher = FakeDispatcher()
+
+    async def run():
+        coalescer = NotificationCoalescer(dispatcher, window=window)
+        for event in events:
+            coalescer.add(*event)
+        await asyncio.sleep(wait)
+
+    asyncio.run(run())
+    return dispatcher.submitted
+
+
+def test_single_event_is_sent_alone():
+    ((chat_id, text, priority),) = coalesce([(1, True, "host", None)])
+
+    assert chat_id == 1
+    assert "host" in text
+    assert priority == NotificationDispatcher.PRIORITY_OFFLINE
+
+
+def test_events_of_a_chat_within_the_window_make_one_digest():
+    submitted = coalesce(
+        [(1, True, "a", None), (2, False, "b", "1m"), (1, False, "c", "2m")]
+    )
+
+    assert sorted(chat_id for chat_id, _, _ in submitted) == [1, 2]
+    (digest,) = [text for chat_id, text, _ in submitted if chat_id == 1]
+    assert "\ta\n" in digest and "c <i>(down for 2m)</i>" in digest
+
+
+def test_events_after_the_window_are_sent_separately():
+    dispatcher = FakeDispatcher()
+
+    async def run():
+        coalescer = NotificationCoalescer(dispatcher, window=0.05)
+        coalescer.add(1, True, "a")
+        await asyncio.sleep(0.1)
+        coalescer.add(1, True, "b")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+    assert len(dispatcher.submitted) == 2
+
+
+def test_long_digest_is_split_at_line_boundaries():
+    offline = [f"offline host {i:04d} " + "x" * 40 for i in range(150)]
+    online = [f"online host {i:04d} " + "y" * 40 for i in range(150)]
+    events = [(1, True, name, None) for name in offline] + [
+        (1, False, name, "5m") for name in online
+    ]
+
+    submitted = coalesce(events)
+    messages = [text for _, text, _ in submitted]
+
+    assert len(messages) > 1
+    for text in messages:
+        assert 0 < len(text) <= NotificationCoalescer.MAX_MESSAGE_LENGTH
+        assert text.endswith("\n") and not text.startswith("\n")
+
+    # every host exactly once, no line cut in two
+    items = [
+        line.strip() for text in messages for line in text.splitlines() if "host" in line
+    ]
+    assert sorted(items) == sorted(
+        offline + [f"{name} <i>(down for 5m)</i>" for name in online]
+    )
+    # offline first, in a digest with the highest priority
+    assert all(p == NotificationDispatcher.PRIORITY_OFFLINE for _, _, p in submitted)
+
+
+def test_section_separator_never_starts_a_message():
+    # sizes where the offline section fills a message exactly
+    events = [(1, True, f"h{i:03d}" + "x" * 43, None) for i in range(159)]
+    events.append((1, False, "back", None))
+
+    messages = [text for _, text, _ in coalesce(events)]
+
+    assert messages[-1] == "<b>[🟢] 1 watchdogs are back ONLINE</b>\n\t\tback\n"
+    assert not any(text.startswith("\n") for text in messages)
+    assert "".join(messages).count("\t\t") == 160
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from database import Watchdog
+
+
+def test_transition_offline_returns_only_changed(db):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+
+    assert [x.uuid for x in db.transition_watchdogs_offline([w.uuid])] == [w.uuid]
+    assert db.transition_watchdogs_offline([w.uuid]) == []
+    assert db.get_watchdog(w.uuid).is_offline
+
+
+def test_transition_online_returns_previous_state(db):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    last_update = datetime.now() - timedelta(hours=1)
+    Watchdog.update(last_update=last_update, is_offline=True).execute()
+
+    (updated,) = db.transition_watchdogs_online([w.uuid])
+
+    assert updated.was_offline
+    assert isinstance(updated.previous_update, datetime)
+    assert abs(updated.previous_update - last_update) < timedelta(seconds=1)
+    assert updated.last_update > last_update
+    assert not db.get_watchdog(w.uuid).is_offline
+
+    (updated,) = db.transition_watchdogs_online([w.uuid])
+    assert not updated.was_offline
+
+
+def test_transition_expired_push_watchdogs(db):
+    expired = db.add_push_watchdog("expired", 1)
+    db.add_push_watchdog("alive", 1)
+    Watchdog.update(deadline=datetime.now() - timedelta(seconds=1)).where(
+        Watchdog.uuid == expired.uuid
+    ).execute()
+
+    assert [w.uuid for w in db.transition_expired_push_watchdogs()] == [expired.uuid]
+    assert db.transition_expired_push_watchdogs() == []
@@ -0,0 +1,102 @@
+from deadlines import DeadlineTracker
+
+
+def test_pop_expired_in_deadline_order():
+    tracker = DeadlineTracker()
+    tracker.set("a", 20)
+    tracker.set("b", 10)
+    tracker.set("c", 30)
+
+    assert tracker.pop_expired(5) == []
+    assert tracker.pop_expired(25) == ["b", "a"]
+    assert not tracker.has("a")
+    assert tracker.has("c")
+    # they don't expire again until a new deadline is set
+    assert tracker.pop_expired(25) == []
+    assert tracker.seconds_to_next(25) == 5
+
+
+def test_reschedule_shadows_the_old_deadline():
+    tracker = DeadlineTracker()
+    tracker.set("a", 10)
+    tracker.set("a", 20)
+
+    assert tracker.pop_expired(15) == []
+    assert tracker.has("a")
+    assert tracker.pop_expired(20) == ["a"]
+
+
+def test_reschedule_earlier():
+    tracker = DeadlineTracker()
+    tracker.set("a", 20)
+    tracker.set("a", 10)
+
+    assert tracker.pop_expired(10) == ["a"]
+    # the older entry doesn't bring it back
+    assert tracker.pop_expired(20) == []
+    assert not tracker.has("a")
+
+
+def test_same_deadline_twice_expires_once():
+    tracker = DeadlineTracker()
+    tracker.set("a", 10)
+    tracker.set("a", 10)
+
+    assert tracker.pop_expired(10) == ["a"]
+    assert tracker.pop_expired(10) == []
+
+
+def test_removed_never_expire():
+    tracker = DeadlineTracker()
+    tracker.set("a", 10)
+    tracker.remove("a")
+    tracker.remove("unknown")
+
+    assert not tracker.has("a")
+    assert tracker.pop_expired(100) == []
+
+
+def test_set_after_expiry_tracks_again():
+    tracker = DeadlineTracker()
+    tracker.set("a", 10)
+    assert tracker.pop_expired(10) == ["a"]
+
+    tracker.set("a", 30)
+
+    assert tracker.has("a")
+    assert tracker.pop_expired(20) == []
+    assert tracker.pop_expired(30) == ["a"]
+
+
+def test_wakeup_only_when_the_earliest_deadline_moves_earlier():
+    tracker = DeadlineTracker()
+    wakeups = []
+    tracker.add_wakeup_hook(lambda: wakeups.append(True))
+
+    tracker.set("a", 20)
+    tracker.set("b", 30)
+    assert len(wakeups) == 1
+
+    tracker.set("c", 10)
+    assert len(wakeups) == 2
+
+
+def test_load_replaces_the_deadlines():
+    tracker = DeadlineTracker()
+    tracker.set("old", 10)
+
+    tracker.load([("a", 20), ("b", 10)])
+
+    assert not tracker.has("old")
+    assert tracker.pop_expired(20) == ["b", "a"]
+
+
+def test_many_reschedules_are_compacted():
+    tracker = DeadlineTracker()
+    for deadline in range(5000):
+        tracker.set("a", deadline)
+    tracker.set("b", 100)
+
+    assert tracker.pop_expired(4998) == ["b"]
+    assert tracker.pop_expired(4999) == ["a"]
+    assert tracker.seconds_to_next(0) is None
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+import time
+
+from database import Watchdog
+from heartbeats import HeartbeatBuffer
+
+
+class FakeUptime:
+    def __init__(self):
+        self.up = 0
+        self.down = 0
+
+    def add(self, uuid, up_seconds, down_seconds, timestamp=None):
+        self.up += up_seconds
+        self.down += down_seconds
+
+
+def expire(w):
+    Watchdog.update(deadline=datetime.now() - timedelta(seconds=1)).where(
+        Watchdog.uuid == w.uuid
+    ).execute()
+
+
+def test_flush_writes_the_latest_heartbeat(db):
+    w = db.add_push_watchdog("push", 1)
+    buffer = HeartbeatBuffer(db)
+
+    buffer.heartbeat(w.uuid, "1.1.1.1")
+    watchdog, last_update = buffer.heartbeat(w.uuid, "2.2.2.2")
+    assert watchdog.uuid == w.uuid
+    assert last_update is None
+    assert db.get_watchdog(w.uuid).address is None  # not flushed yet
+
+    buffer.flush()
+
+    stored = db.get_watchdog(w.uuid)
+    assert stored.address == "2.2.2.2"
+    assert stored.deadline > datetime.now() + timedelta(seconds=w.check_interval - 10)
+
+
+def test_heartbeat_after_expired_deadline_brings_watchdog_online(db):
+    w = db.add_push_watchdog("push", 1)
+    buffer = HeartbeatBuffer(db)
+    watchdog, _ = buffer.heartbeat(w.uuid, "1.1.1.1")
+    buffer.flush()
+
+    # no heartbeat for two intervals
+    last_heartbeat = datetime.now() - timedelta(seconds=2 * w.check_interval)
+    watchdog.last_update = last_heartbeat
+    expire(w)
+
+    assert buffer.set_offline(db.transition_expired_push_watchdogs()) != []
+    assert db.get_watchdog(w.uuid).is_offline
+
+    _, last_update = buffer.heartbeat(w.uuid, "1.1.1.1")
+    assert last_update == last_heartbeat
+    buffer.flush()
+    assert not db.get_watchdog(w.uuid).is_offline
+
+
+def test_flushed_heartbeat_prevents_the_offline_transition(db):
+    w = db.add_push_watchdog("push", 1)
+    expire(w)
+    buffer = HeartbeatBuffer(db)
+    buffer.heartbeat(w.uuid, "1.1.1.1")
+
+    buffer.flush()
+
+    assert db.transition_expired_push_watchdogs() == []
+
+
+def test_heartbeat_during_the_transition_is_not_reported_offline(db):
+    w = db.add_push_watchdog("push", 1)
+    expire(w)
+    buffer = HeartbeatBuffer(db)
+    # received after the flush, while the deadlines are checked
+    buffer.heartbeat(w.uuid, "1.1.1.1")
+
+    hosts = db.transition_expired_push_watchdogs()
+    assert [h.uuid for h in hosts] == [w.uuid]
+    assert buffer.set_offline(hosts) == []
+
+    _, last_update = buffer.heartbeat(w.uuid, "1.1.1.1")
+    assert last_update is None  # still online, no notification either way
+    buffer.flush()
+    assert not db.get_watchdog(w.uuid).is_offline
+
+
+def test_downtime_is_recorded_from_the_deadline(db):
+    w = db.add_push_watchdog("push", 1)
+    uptime = FakeUptime()
+    buffer = HeartbeatBuffer(db, uptime=uptime)
+    watchdog, _ = buffer.heartbeat(w.uuid, "1.1.1.1")
+    buffer.flush()
+    uptime.up = uptime.down = 0
+
+    # the deadline expired 30 seconds ago
+    watchdog.last_update = datetime.now() - timedelta(seconds=w.check_interval + 30)
+    expire(w)
+    buffer.set_offline(db.transition_expired_push_watchdogs())
+
+    assert abs(uptime.up - w.check_interval) < 0.1
+    assert abs(uptime.down - 30) < 0.1
+
+    # still down, before any heartbeat
+    time.sleep(0.5)
+    buffer.record_downtime()
+    assert uptime.down >= 30.5 - 0.01
+    buffer.heartbeat(w.uuid, "1.1.1.1")
+    buffer.record_downtime()
+
+    # each period counted once, nothing while online
+    assert abs(uptime.up - w.check_interval) < 0.1
+    assert abs(uptime.down - 30.5) < 0.1
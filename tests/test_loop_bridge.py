@@ -0,0 +1,115 @@
+import asyncio
+from threading import Event, Thread
+import time
+
+import pytest
+
+from loop_bridge import LoopBridge
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def saturate(bridge, max_pending):
+    """
+    Block the loop in a callback and fill every slot, returns the Event unblocking it
+    """
+    unblock = Event()
+    assert bridge.submit(unblock.wait)
+    for _ in range(max_pending - 1):
+        assert bridge.submit(lambda: None)
+    return unblock
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_saturated_bridge_drops_after_the_timeout(loop):
+    bridge = LoopBridge(loop, max_pending=3, timeout=0.1)
+    unblock = saturate(bridge, 3)
+    ran = []
+
+    start = time.monotonic()
+    assert not bridge.submit(ran.append, 1)
+    assert not bridge.submit(ran.append, 2)
+    elapsed = time.monotonic() - start
+
+    # the submitting thread waits timeout seconds per callback at most
+    assert 0.2 <= elapsed < 1
+    assert bridge.overflowed == 2
+    assert bridge.dropped == 2
+    assert bridge.submitted == 3
+    assert bridge.pending == 3
+
+    unblock.set()
+    assert wait_for(lambda: bridge.pending == 0)
+    assert ran == []
+
+    # the slots are free again
+    assert bridge.submit(ran.append, 3)
+    assert wait_for(lambda: ran == [3])
+    assert bridge.dropped == 2
+
+
+def test_default_timeout_is_one_second(loop):
+    bridge = LoopBridge(loop, max_pending=1)
+    unblock = saturate(bridge, 1)
+
+    start = time.monotonic()
+    assert not bridge.submit(lambda: None)
+    elapsed = time.monotonic() - start
+    unblock.set()
+
+    assert 0.9 <= elapsed < 2
+    assert bridge.dropped == 1
+
+
+def test_overflow_waits_for_a_free_slot(loop):
+    bridge = LoopBridge(loop, max_pending=2, timeout=5)
+    unblock = saturate(bridge, 2)
+    ran = []
+
+    Thread(target=lambda: (time.sleep(0.1), unblock.set())).start()
+    assert bridge.submit(ran.append, 1)
+
+    assert wait_for(lambda: ran == [1])
+    assert bridge.overflowed == 1
+    assert bridge.dropped == 0
+    assert wait_for(lambda: bridge.pending == 0)
+
+
+def test_failing_callback_releases_its_slot(loop):
+    bridge = LoopBridge(loop, max_pending=1, timeout=1)
+
+    assert bridge.submit(lambda: 1 / 0)
+    assert wait_for(lambda: bridge.pending == 0)
+
+    ran = []
+    assert bridge.submit(ran.append, 1)
+    assert wait_for(lambda: ran == [1])
+    assert bridge.dropped == 0
+
+
+def test_loop_thread_runs_the_callback_inline():
+    async def run():
+        bridge = LoopBridge(asyncio.get_running_loop(), max_pending=1)
+        ran = []
+        assert bridge.submit(ran.append, 1)
+        assert ran == [1]
+        return bridge
+
+    bridge = asyncio.run(run())
+    assert bridge.submitted == 0
+    assert bridge.pending == 0
@@ -0,0 +1,71 @@
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def registered(metric_class, *args, **kwargs):
+    registry = Registry()
+    metric = metric_class(*args, registry=registry, **kwargs)
+    return metric, registry
+
+
+def test_counter_by_label():
+    counter, registry = registered(
+        Counter, "requests_total", "Requests", labels=["status"]
+    )
+
+    counter.inc(status=200)
+    counter.inc(2, status=200)
+    counter.inc(status='4"0\\4')
+
+    assert registry.render() == (
+        "# HELP requests_total Requests\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{status="200"} 3.0\n'
+        'requests_total{status="4\\"0\\\\4"} 1.0\n'
+    )
+
+
+def test_gauge_without_labels_starts_at_zero():
+    gauge, registry = registered(Gauge, "queue_depth", "Queue depth")
+    assert "queue_depth 0.0\n" in registry.render()
+
+    gauge.set(5)
+    assert registry.render().endswith("queue_depth 5.0\n")
+
+    gauge.set_function(lambda: 7)
+    assert registry.render().endswith("queue_depth 7.0\n")
+
+
+def test_gauge_function_errors_keep_the_last_value():
+    gauge, registry = registered(Gauge, "queue_depth", "Queue depth")
+    gauge.set(3)
+    gauge.set_function(lambda: 1 / 0)
+
+    assert registry.render().endswith("queue_depth 3.0\n")
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram, registry = registered(
+        Histogram, "seconds", "Durations", labels=["stage"], buckets=(1, 0.1)
+    )
+
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5, stage="a")
+
+    assert registry.render().splitlines()[2:] == [
+        'seconds_bucket{stage="a",le="0.1"} 1',
+        'seconds_bucket{stage="a",le="1.0"} 2',
+        'seconds_bucket{stage="a",le="+Inf"} 3',
+        'seconds_sum{stage="a"} 5.55',
+        'seconds_count{stage="a"} 3',
+    ]
+
+
+def test_histogram_timer_observes_the_block():
+    histogram, registry = registered(Histogram, "seconds", "Durations")
+
+    with histogram.time():
+        pass
+
+    assert 'seconds_bucket{le="0.005"} 1' in registry.render()
+    assert "seconds_count 1" in registry.render()
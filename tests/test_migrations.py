@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+import uuid
+
+from database import Db, Watchdog
+from migrations import MIGRATIONS, BaselineWatchdog, SchemaMigration, run_migrations
+
+
+def columns(db):
+    return set(c.name for c in db.get_columns(Watchdog._meta.table_name))
+
+
+def indexes(db):
+    return set(i.name for i in db.get_indexes(Watchdog._meta.table_name))
+
+
+def applied_versions():
+    return sorted(m.version for m in SchemaMigration.select())
+
+
+def test_migrations_upgrade_baseline_schema(empty_db):
+    # a db created by the first release, before any migration
+    BaselineWatchdog.create_table()
+    push, ping, duplicate = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    now = datetime.now().replace(microsecond=0)
+    taken, duplicate2 = uuid.uuid4(), uuid.uuid4()
+    for id, name, is_push in [
+        (push, "a", True),
+        (ping, "b", False),
+        (duplicate, "a", False),
+        (duplicate2, "a", False),
+        (taken, "a (2)", False),
+    ]:
+        BaselineWatchdog.create(
+            uuid=id,
+            name=name,
+            is_push=is_push,
+            address=None if is_push else "8.8.8.8",
+            is_enabled=True,
+            last_update=now,
+            check_interval=60,
+            chat_id=1,
+        )
+
+    run_migrations()
+
+    assert applied_versions() == list(range(1, len(MIGRATIONS) + 1))
+    assert {"updated_at", "deadline"} <= columns(empty_db)
+    assert {
+        "watchdog_updated_at",
+        "watchdog_chat_id_name",
+        "watchdog_is_enabled_is_push",
+        "watchdog_push_deadline",
+    } <= indexes(empty_db)
+    assert "watchdog_deadline" not in indexes(empty_db)
+
+    db = Db()
+    assert db.get_watchdog(push).deadline == now + timedelta(seconds=60)
+    assert db.get_watchdog(ping).deadline is None
+    # duplicate names get a suffix that isn't taken yet
+    assert sorted(w.name for w in Watchdog.select()) == [
+        "a",
+        "a (2)",
+        "a (3)",
+        "a (4)",
+        "b",
+    ]
+
+
+def test_migrations_on_empty_db_are_idempotent(empty_db):
+    run_migrations()
+    run_migrations()
+
+    assert applied_versions() == list(range(1, len(MIGRATIONS) + 1))
+    assert {"updated_at", "deadline"} <= columns(empty_db)
+    assert Db().add_push_watchdog("push", 1).deadline is not None
@@ -0,0 +1,83 @@
+import asyncio
+
+from aiogram.utils.exceptions import NetworkError, RetryAfter
+
+from notifier import NotificationDispatcher
+
+
+class FakeBot:
+    """
+    send_message raises the given errors in order, then succeeds
+    """
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.calls += 1
+        if len(self.errors) != 0:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def dispatch(bot, seconds=0.5, **kwargs):
+    dispatcher = NotificationDispatcher(bot, chat_interval=0, **kwargs)
+
+    async def run():
+        dispatcher.submit(1, "host is offline")
+        task = asyncio.get_running_loop().create_task(dispatcher.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+
+    asyncio.run(run())
+    return dispatcher
+
+
+def test_flood_waits_dont_count_as_attempts():
+    bot = FakeBot([RetryAfter(0)] * 5)
+
+    dispatcher = dispatch(bot, max_attempts=2)
+
+    assert bot.sent == [(1, "host is offline")]
+    assert bot.calls == 6
+    assert dispatcher.errors == {"RetryAfter": 5}
+
+
+def test_network_errors_are_retried_with_backoff():
+    bot = FakeBot([NetworkError("down")])
+
+    dispatcher = dispatch(bot, seconds=2.5, max_attempts=2)
+
+    assert bot.sent == [(1, "host is offline")]
+    assert dispatcher.errors == {"NetworkError": 1}
+
+
+def test_network_errors_drop_after_max_attempts():
+    bot = FakeBot([NetworkError("down")] * 2)
+
+    dispatcher = dispatch(bot, max_attempts=1)
+
+    assert bot.sent == []
+    assert bot.calls == 1
+    assert dispatcher.queue_depth == 0
+
+
+def test_past_chat_send_times_are_pruned():
+    bot = FakeBot([])
+    dispatcher = NotificationDispatcher(bot, rate=100000, chat_interval=0)
+    chats = 3 * NotificationDispatcher.MIN_PRUNE_SIZE
+
+    async def run():
+        for chat_id in range(chats):
+            dispatcher.submit(chat_id, "host is offline")
+        task = asyncio.get_running_loop().create_task(dispatcher.run())
+        await asyncio.sleep(0.5)
+        task.cancel()
+
+    asyncio.run(run())
+
+    assert len(bot.sent) == chats
+    slots = dispatcher._NotificationDispatcher__next_send_by_chat
+    assert len(slots) < NotificationDispatcher.MIN_PRUNE_SIZE
@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import time
+
+from icmplib import Host
+from icmplib.exceptions import SocketPermissionError
+
+import pinger as pinger_module
+import resolver as resolver_module
+from database import Watchdog
+from pinger import Pinger
+
+
+def failing_dns(failures):
+    """
+    resolve_public_address that fails the first `failures` lookups
+    """
+    calls = []
+
+    def resolve(hostname):
+        calls.append(hostname)
+        return None if len(calls) <= failures else "8.8.8.8"
+
+    return resolve
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_transient_dns_failure_is_not_reported_offline(
+    db, bot, alive_network, monkeypatch
+):
+    monkeypatch.setattr(resolver_module, "resolve_public_address", failing_dns(1))
+    w = db.add_ping_watchdog("host", "host.example", 1)
+    pinger = Pinger(db, bot).start(schedule=False)
+
+    pinger.ping_all()
+
+    # the failed lookup is cached, the prober resolves it again
+    assert pinger.suspects == 1
+    assert wait_for(lambda: pinger.suspects == 0)
+    assert bot.offline == []
+    assert not db.get_watchdog(w.uuid).is_offline
+
+
+def test_unresolvable_host_goes_offline_after_confirmation(
+    db, bot, alive_network, monkeypatch
+):
+    monkeypatch.setattr(resolver_module, "resolve_public_address", failing_dns(10))
+    w = db.add_ping_watchdog("host", "host.example", 1)
+    pinger = Pinger(db, bot, p_offline_repeat_count=1).start(schedule=False)
+
+    pinger.ping_all()
+    assert bot.offline == []
+
+    assert wait_for(lambda: len(bot.offline) != 0)
+    assert [h.uuid for h in bot.offline] == [w.uuid]
+    assert db.get_watchdog(w.uuid).is_offline
+
+
+def test_pinger_notifies_host_back_online(db, bot, alive_network):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    db.transition_watchdogs_offline([w.uuid])
+
+    assert Pinger(db, bot).ping_all() == 1
+
+    ((watchdog, last_update),) = bot.online
+    assert watchdog.uuid == w.uuid
+    # what MainBot.notify_online_host does with it
+    assert timedelta(0) <= datetime.now() - last_update < timedelta(minutes=1)
+    assert not db.get_watchdog(w.uuid).is_offline
+
+
+class RejectingNetwork:
+    """
+    multiping fails on the whole batch when it contains bad_address, the
+    single pings only fail on it
+    """
+
+    def __init__(self, bad_address, error):
+        self.bad_address = bad_address
+        self.error = error
+        self.batches = []
+        self.single = []
+
+    def multiping(self, addresses, count=2, **kwargs):
+        self.batches.append(sorted(addresses))
+        if self.bad_address in addresses:
+            raise self.error
+        return [Host(a, count, [1.0] * count) for a in addresses]
+
+    async def async_ping(self, address, count=2, **kwargs):
+        self.single.append(address)
+        if address == self.bad_address:
+            raise self.error
+        return Host(address, count, [1.0] * count)
+
+
+def test_failed_batch_only_skips_the_bad_address(db, bot, monkeypatch):
+    network = RejectingNetwork("1.1.1.1", ValueError("bad address"))
+    monkeypatch.setattr(pinger_module, "multiping", network.multiping)
+    monkeypatch.setattr(pinger_module, "async_ping", network.async_ping)
+    for i, address in enumerate(["8.8.8.8", "8.8.4.4", "1.1.1.1"]):
+        db.add_ping_watchdog(f"host {i}", address, 1)
+    pinger = Pinger(db, bot)
+
+    pinger.ping_all()
+
+    # one batch, then each address on its own
+    assert network.batches == [["1.1.1.1", "8.8.4.4", "8.8.8.8"]]
+    assert sorted(network.single) == ["1.1.1.1", "8.8.4.4", "8.8.8.8"]
+    assert pinger.suspects == 1
+
+    pinger.ping_all()
+    assert network.batches[-1] == ["8.8.4.4", "8.8.8.8"]
+
+
+def test_socket_error_marks_no_address(db, bot, monkeypatch):
+    network = RejectingNetwork("1.1.1.1", SocketPermissionError(False))
+    monkeypatch.setattr(pinger_module, "multiping", network.multiping)
+    monkeypatch.setattr(pinger_module, "async_ping", network.async_ping)
+    for i, address in enumerate(["8.8.8.8", "1.1.1.1"]):
+        db.add_ping_watchdog(f"host {i}", address, 1)
+    pinger = Pinger(db, bot)
+
+    pinger.ping_all()
+
+    assert network.single == []
+    assert pinger.suspects == 0
+    assert bot.offline == []
+
+    pinger.ping_all()
+    assert network.batches[-1] == ["1.1.1.1", "8.8.8.8"]
+
+
+def run_schedule(pinger, clock, until, step=0.25, before_step=None):
+    """
+    Drive the pinger schedule on a fake clock, returns {uuid: [ping times]}
+    """
+    pings = {}
+    while clock.now <= until:
+        if before_step is not None:
+            before_step(clock.now)
+        pinger._Pinger__refresh_hosts()
+        for w in pinger._Pinger__pop_due_hosts(clock.now):
+            pings.setdefault(w.uuid, []).append(clock.now)
+        clock.now += step
+    return pings
+
+
+def test_hosts_are_pinged_every_check_interval(db, bot, monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(pinger_module, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    # check_interval -> expected interval, clamped to [min_interval, interval]
+    expected = {30: 30, 5: 10, 300: 120}
+    watchdogs = {}
+    for check_interval in expected:
+        w = db.add_ping_watchdog(f"host {check_interval}", "8.8.8.8", 1)
+        Watchdog.update(check_interval=check_interval).where(
+            Watchdog.uuid == w.uuid
+        ).execute()
+        watchdogs[w.uuid] = check_interval
+    pinger = Pinger(db, bot, interval=120, min_interval=10)
+    added = []
+
+    def add_host(now):
+        if now == 200:
+            added.append(db.add_ping_watchdog("new host", "8.8.4.4", 1))
+
+    pings = run_schedule(pinger, clock, until=600, before_step=add_host)
+
+    for uuid, check_interval in watchdogs.items():
+        times = pings[uuid]
+        # the startup load is spread over the first interval
+        assert times[0] <= expected[check_interval] + 0.25
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        assert all(abs(gap - expected[check_interval]) <= 0.25 for gap in gaps)
+
+    # hosts added later are pinged right away, then every check_interval (120)
+    assert pings[added[0].uuid] == [200, 320, 440, 560]
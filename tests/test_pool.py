@@ -0,0 +1,77 @@
+import heapq
+
+import pytest
+
+from configuration import Configuration
+from database import HealthCheckedPooledDatabase
+
+
+@pytest.fixture
+def pool(empty_db):
+    pool = HealthCheckedPooledDatabase(
+        Configuration.DATABASE_NAME,
+        host=Configuration.DATABASE_HOST,
+        user=Configuration.DATABASE_USER,
+        password=Configuration.DATABASE_PASSWORD,
+        max_connections=5,
+        min_connections=3,
+        stale_timeout=60,
+        health_check_interval=30,
+    )
+    pool.fill()
+    yield pool
+    if not pool.is_closed():
+        pool.close()
+    pool.close_all()
+
+
+def pool_size(pool):
+    return len(pool._connections) + len(pool._in_use)
+
+
+def returned_at(pool):
+    return pool._HealthCheckedPooledDatabase__returned_at
+
+
+def test_fill_opens_min_connections(pool):
+    assert pool_size(pool) == 3
+    pool.fill()
+    assert pool_size(pool) == 3
+
+
+def test_stale_connections_are_replaced(pool):
+    pool.connect()
+    pool.close()
+    assert len(returned_at(pool)) == 1
+
+    # every idle connection is older than stale_timeout
+    pool._connections = [(ts - 120, conn) for ts, conn in pool._connections]
+    heapq.heapify(pool._connections)
+
+    pool.connect()
+
+    assert pool_size(pool) == 3
+    assert all(conn.closed == 0 for _, conn in pool._connections)
+    pool.close()
+    # only the connections in the pool are tracked
+    keys = set(pool.conn_key(conn) for _, conn in pool._connections)
+    assert set(returned_at(pool)) <= keys
+
+
+def test_unhealthy_connection_is_dropped_and_replaced(pool, empty_db):
+    pool.connect()
+    pid = pool.connection().get_backend_pid()
+    pool.close()
+
+    # the server closes the connection while it's idle in the pool
+    empty_db.execute_sql("SELECT pg_terminate_backend(%s)", (pid,))
+    for key in returned_at(pool):
+        returned_at(pool)[key] -= 60  # due for a health check
+
+    # the oldest connection is checked out first, the one just returned
+    pool.connect()
+    pool.execute_sql("SELECT 1")
+
+    assert pool.connection().get_backend_pid() != pid
+    assert pool_size(pool) == 3
+    assert returned_at(pool) == {}
@@ -0,0 +1,65 @@
+import pytest
+
+from push_server import HISTORY_MAX_HOURS, METRICS_CONTENT_TYPE, PushServer
+
+
+@pytest.fixture
+def client(db, bot):
+    return PushServer(db, bot).app.test_client()
+
+
+@pytest.mark.parametrize("hours", ["nan", "inf", "-inf", "0", "-1", "abc"])
+def test_history_rejects_bad_hours(db, client, hours):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+
+    assert client.get(f"/history/{w.uuid}?hours={hours}").status_code == 400
+
+
+def test_history_clamps_hours(db, client):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+
+    response = client.get(f"/history/{w.uuid}?hours=100000&points=10")
+
+    assert response.status_code == 200
+    assert response.get_json()["bucket"] == HISTORY_MAX_HOURS * 3600 // 10
+    assert response.get_json()["samples"] == []
+
+
+@pytest.mark.parametrize("route", ["status", "badge"])
+def test_unchanged_status_is_not_modified(db, client, route):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+
+    response = client.get(f"/{route}/{w.uuid}")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+
+    not_modified = client.get(f"/{route}/{w.uuid}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+
+    # the cache is invalidated by the status change
+    db.transition_watchdogs_offline([w.uuid])
+    response = client.get(f"/{route}/{w.uuid}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_metrics_disabled_without_token(client):
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_require_the_token(db, bot):
+    client = PushServer(db, bot, metrics_token="secret").app.test_client()
+
+    assert client.get("/metrics").status_code == 401
+    assert (
+        client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code
+        == 401
+    )
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.content_type == METRICS_CONTENT_TYPE
+    assert "# TYPE hostpingbot_update_requests_total counter" in response.get_data(
+        as_text=True
+    )
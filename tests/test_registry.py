@@ -0,0 +1,102 @@
+from datetime import datetime
+
+import pytest
+
+from database import Watchdog
+from registry import WatchdogRegistry
+
+
+def edit(uuid, updated_at=None, **fields):
+    """
+    Edit made by another process: no hook is fired, updated_at is bumped
+    """
+    Watchdog.update(updated_at=updated_at or datetime.now(), **fields).where(
+        Watchdog.uuid == uuid
+    ).execute()
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def registry(db, events):
+    registry = WatchdogRegistry(db, poll_interval=0, reconcile_interval=3600)
+    registry.add_added_hook(lambda w: events.append(("added", w.uuid)))
+    registry.add_removed_hook(lambda uuid: events.append(("removed", uuid)))
+    return registry
+
+
+def test_edited_watchdog_is_picked_up(db, registry, events):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    registry.refresh()
+    events.clear()
+
+    edit(w.uuid, address="8.8.4.4", check_interval=30)
+    registry.refresh()
+
+    assert registry.get(w.uuid).address == "8.8.4.4"
+    assert registry.get(w.uuid).check_interval == 30
+    assert events == [("added", w.uuid)]
+
+    # polling the same rows again changes nothing
+    registry.refresh()
+    assert events == [("added", w.uuid)]
+
+
+def test_disabled_watchdog_is_removed(db, registry, events):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    registry.refresh()
+    events.clear()
+
+    edit(w.uuid, is_enabled=False)
+    registry.refresh()
+
+    assert registry.get(w.uuid) is None
+    assert events == [("removed", w.uuid)]
+
+
+def test_deleted_watchdog_is_removed(db, registry, events):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    registry.refresh()
+
+    db.delete_watchdog(w.uuid)
+
+    assert registry.get(w.uuid) is None
+    assert events[-1] == ("removed", w.uuid)
+
+
+def test_watchdog_deleted_by_another_process_is_reconciled(db, events):
+    registry = WatchdogRegistry(db, poll_interval=0, reconcile_interval=0)
+    registry.add_removed_hook(lambda uuid: events.append(("removed", uuid)))
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    kept = db.add_ping_watchdog("kept", "8.8.4.4", 1)
+    registry.refresh()
+
+    Watchdog.delete().where(Watchdog.uuid == w.uuid).execute()
+    registry.refresh()
+
+    assert registry.get(w.uuid) is None
+    assert registry.get(kept.uuid) is not None
+    assert events == [("removed", w.uuid)]
+
+
+def test_edits_at_the_same_timestamp_are_not_missed(db, registry, events):
+    a = db.add_ping_watchdog("a", "8.8.8.8", 1)
+    b = db.add_ping_watchdog("b", "8.8.8.8", 1)
+    registry.refresh()
+    events.clear()
+    updated_at = datetime.now()
+
+    edit(a.uuid, updated_at, address="1.1.1.1")
+    registry.refresh()
+    # committed after the poll, with the timestamp of the high-water mark
+    edit(b.uuid, updated_at, address="1.0.0.1")
+    edit(a.uuid, updated_at, address="9.9.9.9")
+    registry.refresh()
+
+    assert registry.get(a.uuid).address == "9.9.9.9"
+    assert registry.get(b.uuid).address == "1.0.0.1"
+    assert events[0] == ("added", a.uuid)
+    assert sorted(events[1:]) == sorted([("added", a.uuid), ("added", b.uuid)])
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import resolver as resolver_module
+from resolver import Resolver
+
+IPS = {"good.example": "8.8.8.8", "bad.example": None}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        resolver_module, "time", SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    return clock
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """
+    Hostnames looked up through the DNS, in order
+    """
+    lookups = []
+
+    def resolve(hostname):
+        lookups.append(hostname)
+        return IPS[hostname]
+
+    async def async_resolve(hostname):
+        return resolve(hostname)
+
+    monkeypatch.setattr(resolver_module, "resolve_public_address", resolve)
+    monkeypatch.setattr(resolver_module, "async_resolve_public_address", async_resolve)
+    return lookups
+
+
+def test_ips_are_not_looked_up(lookups):
+    resolver = Resolver()
+
+    assert resolver.resolve_all(["1.1.1.1", "192.168.1.1"]) == {
+        "1.1.1.1": "1.1.1.1",
+        "192.168.1.1": None,
+    }
+    assert lookups == []
+
+
+def test_resolved_hostnames_are_cached_for_ttl(clock, lookups):
+    resolver = Resolver(ttl=300, negative_ttl=60)
+
+    assert resolver.resolve_all(["good.example"]) == {"good.example": "8.8.8.8"}
+    clock.now += 299
+    assert resolver.resolve_all(["good.example"]) == {"good.example": "8.8.8.8"}
+    assert lookups == ["good.example"]
+
+    clock.now += 1
+    resolver.resolve_all(["good.example"])
+    assert lookups == ["good.example"] * 2
+
+
+def test_failures_are_cached_for_negative_ttl(clock, lookups):
+    resolver = Resolver(ttl=300, negative_ttl=60)
+
+    assert resolver.resolve_all(["bad.example"]) == {"bad.example": None}
+    clock.now += 59
+    assert resolver.resolve_all(["bad.example"]) == {"bad.example": None}
+    assert lookups == ["bad.example"]
+
+    clock.now += 1
+    resolver.resolve_all(["bad.example"])
+    assert lookups == ["bad.example"] * 2
+
+
+def test_retry_failures_bypasses_only_the_negative_cache(clock, lookups):
+    resolver = Resolver()
+    resolver.resolve_all(["good.example", "bad.example"])
+
+    resolved = resolver.resolve_all(["good.example", "bad.example"], retry_failures=True)
+
+    assert resolved == IPS
+    assert sorted(lookups) == ["bad.example", "bad.example", "good.example"]
+
+
+def test_async_lookups_share_the_cache(clock, lookups):
+    resolver = Resolver()
+
+    resolved = asyncio.run(resolver.resolve_all_async(["good.example", "bad.example"]))
+    assert resolved == IPS
+
+    assert resolver.resolve_all(["good.example", "bad.example"]) == IPS
+    assert sorted(lookups) == ["bad.example", "good.example"]
@@ -0,0 +1,62 @@
+from icmplib import Host
+import pytest
+
+from samples import SampleWriter
+
+
+class FlakyDb:
+    def __init__(self, failures, during_write=None):
+        self.failures = failures
+        self.during_write = during_write  # called by each write, as a concurrent add
+        self.written = []
+
+    def add_ping_samples(self, samples):
+        if self.during_write is not None:
+            self.during_write()
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("db unreachable")
+        self.written += samples
+
+
+def add(writer, uuid, timestamp):
+    writer.add(uuid, Host("8.8.8.8", 2, [1.0, 1.0]), timestamp)
+
+
+def test_failed_flush_keeps_the_samples():
+    db = FlakyDb(failures=1)
+    writer = SampleWriter(db)
+    add(writer, "a", 1)
+
+    with pytest.raises(ConnectionError):
+        writer.flush()
+    add(writer, "b", 2)
+    writer.flush()
+
+    assert [(uuid, timestamp) for uuid, timestamp, _, _ in db.written] == [
+        ("a", 1),
+        ("b", 2),
+    ]
+
+
+def test_requeued_samples_are_capped_to_max_pending():
+    writer = None
+    concurrent = [[3, 4], [5], []]  # timestamps added during each write
+
+    def add_concurrently():
+        for timestamp in concurrent.pop(0):
+            add(writer, "a", timestamp)
+
+    db = FlakyDb(failures=1, during_write=add_concurrently)
+    writer = SampleWriter(db, max_pending=3)
+    add(writer, "a", 1)
+    add(writer, "a", 2)
+
+    with pytest.raises(ConnectionError):
+        writer.flush()
+    writer.flush()
+
+    # the oldest sample made room for the failed batch
+    assert [timestamp for _, timestamp, _, _ in db.written] == [2, 3, 4]
+    writer.flush()
+    assert [timestamp for _, timestamp, _, _ in db.written] == [2, 3, 4, 5]
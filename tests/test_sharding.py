@@ -0,0 +1,113 @@
+from collections import Counter
+from datetime import timedelta
+import time
+import uuid
+
+from peewee import fn
+
+from database import PingerLease
+from sharding import HashRing, ShardCoordinator
+
+KEYS = [uuid.UUID(int=i * 7919 + 12345) for i in range(10000)]
+
+
+def owners(nodes):
+    ring = HashRing(nodes)
+    return {key: ring.owner(key) for key in KEYS}
+
+
+def assert_balanced(owned, nodes):
+    counts = Counter(owned.values())
+    fair = len(KEYS) / len(nodes)
+    assert set(counts) == set(nodes)
+    assert all(0.7 * fair <= counts[node] <= 1.3 * fair for node in nodes)
+
+
+def test_ownership_is_stable_and_balanced():
+    nodes = ["w1", "w2", "w3"]
+
+    assert owners(nodes) == owners(list(reversed(nodes)))
+    assert_balanced(owners(nodes), nodes)
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    before = owners(["w1", "w2", "w3"])
+    after = owners(["w1", "w2", "w3", "w4"])
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "w4" for key in moved)
+    assert_balanced(after, ["w1", "w2", "w3", "w4"])
+
+
+def test_removing_a_node_only_moves_its_keys():
+    before = owners(["w1", "w2", "w3", "w4"])
+    after = owners(["w1", "w2", "w4"])
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(before[key] == "w3" for key in moved)
+    assert_balanced(after, ["w1", "w2", "w4"])
+
+
+def test_empty_ring_owns_nothing():
+    assert HashRing([]).owner(KEYS[0]) is None
+
+
+def expire_lease(worker_id, lease_ttl):
+    PingerLease.update(
+        heartbeat=fn.NOW() - timedelta(seconds=lease_ttl + 1)
+    ).where(PingerLease.worker_id == worker_id).execute()
+
+
+def test_lease_expiry_and_renewal(db):
+    db.renew_pinger_lease("w1", 30)
+    db.renew_pinger_lease("w2", 30)
+    assert db.get_live_pinger_workers(30) == ["w1", "w2"]
+
+    expire_lease("w1", 30)
+    assert db.get_live_pinger_workers(30) == ["w2"]
+
+    # renewing a lease drops the expired ones
+    db.renew_pinger_lease("w2", 30)
+    assert [l.worker_id for l in PingerLease.select()] == ["w2"]
+
+    db.renew_pinger_lease("w1", 30)
+    assert db.get_live_pinger_workers(30) == ["w1", "w2"]
+
+    db.release_pinger_lease("w1")
+    assert db.get_live_pinger_workers(30) == ["w2"]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def partitioned_as(coordinators, nodes):
+    """
+    The coordinators own the keys as a ring of nodes would assign them
+    """
+    expected = owners(nodes)
+    return lambda: all(
+        c.owns(key) == (expected[key] == c.worker_id)
+        for c in coordinators
+        for key in KEYS
+    )
+
+
+def test_coordinators_split_and_take_over_partitions(db):
+    db.renew_pinger_lease("crashed", 30)  # a worker that won't renew its lease
+    w1 = ShardCoordinator(db, worker_id="w1", renew_interval=0.05).start()
+    w2 = ShardCoordinator(db, worker_id="w2", renew_interval=0.05).start()
+    try:
+        assert wait_for(partitioned_as([w1, w2], ["crashed", "w1", "w2"]))
+
+        expire_lease("crashed", 30)
+        assert wait_for(partitioned_as([w1, w2], ["w1", "w2"]))
+
+        w2.stop()
+        assert wait_for(partitioned_as([w1], ["w1"]))
+    finally:
+        w1.stop()
+        w2.stop()
@@ -0,0 +1,90 @@
+from database import Watchdog
+from status_cache import StatusCache
+
+
+def set_offline_behind_the_cache(uuid):
+    """
+    Change made by another process: no hook is fired
+    """
+    Watchdog.update(is_offline=True).where(Watchdog.uuid == uuid).execute()
+
+
+def test_status_is_cached_until_the_ttl(db):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    cache = StatusCache(db, ttl=60)
+
+    assert cache.get(w.uuid).online
+    set_offline_behind_the_cache(w.uuid)
+    assert cache.get(w.uuid).online
+
+    assert not StatusCache(db, ttl=0).get(w.uuid).online
+
+
+def test_status_changes_invalidate_the_watchdog(db):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    other = db.add_ping_watchdog("other", "8.8.4.4", 1)
+    cache = StatusCache(db, ttl=60)
+    cache.get(w.uuid)
+    cache.get(other.uuid)
+    set_offline_behind_the_cache(other.uuid)
+
+    db.transition_watchdogs_offline([w.uuid])
+
+    assert not cache.get(w.uuid).online
+    # the others stay cached
+    assert cache.get(other.uuid).online
+
+
+def test_deleted_watchdog_is_invalidated(db):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    cache = StatusCache(db, ttl=60)
+    cache.get(w.uuid)
+
+    db.delete_watchdog(w.uuid)
+
+    assert cache.get(w.uuid) is None
+
+
+class InvalidatingDb:
+    """
+    Invalidates the given uuid in the middle of every read, as a status change
+    made by another thread would
+    """
+
+    def __init__(self, db, uuid):
+        self.db = db
+        self.uuid = uuid
+        self.reads = 0
+        self.cache = None
+
+    def add_status_hook(self, hook):
+        pass
+
+    def add_deleted_hook(self, hook):
+        pass
+
+    def get_watchdog(self, uuid):
+        self.reads += 1
+        w = self.db.get_watchdog(uuid)
+        self.cache.invalidate(self.uuid)
+        return w
+
+    def get_uptime(self, uuids):
+        return self.db.get_uptime(uuids)
+
+
+def test_read_invalidated_meanwhile_is_not_stored(db):
+    w = db.add_ping_watchdog("host", "8.8.8.8", 1)
+    other = db.add_ping_watchdog("other", "8.8.4.4", 1)
+
+    invalidating = InvalidatingDb(db, w.uuid)
+    cache = invalidating.cache = StatusCache(invalidating, ttl=60)
+
+    cache.get(w.uuid)
+    cache.get(w.uuid)
+    assert invalidating.reads == 2
+
+    # invalidating another watchdog doesn't prevent caching this one
+    cache.get(other.uuid)
+    cache.get(other.uuid)
+    assert invalidating.reads == 3